@@ -1,25 +1,27 @@
 #!/usr/bin/env python
 
 import argparse
-import copy
 import os
 import sys
 
-from ast import literal_eval as make_tuple
 import matplotlib
 matplotlib.use('Agg')  # this import must happen immediately after importing matplotlib
 from matplotlib import pyplot as plt
 from matplotlib import rcParams
 from matplotlib.collections import LineCollection
 from matplotlib.collections import PatchCollection
+from matplotlib.collections import PathCollection
+from matplotlib.collections import PolyCollection
 from matplotlib.font_manager import FontProperties
 import matplotlib.patches as mpatches
-from matplotlib.path import Path
 import numpy as np
 
 from bionanoUtil import *
+from profileUtil import StageProfiler, count_artists
 import VizUtil as vu
 
+logger = vu.logger
+
 rcParams['font.family'] = 'sans-serif'
 rcParams['font.sans-serif'] = ['Arial']
 
@@ -32,10 +34,19 @@ intertrack_spacing = .7
 gene_spacing = 1.7
 
 contig_bar_height = -14 / 3
+# height of the stack of molecules drawn under the contigs
+molecule_track_height = 2.0
+# smallest spacing of contig rows when concentric rings are squeezed to fit
+min_contig_row_pitch = 0.05
 segment_bar_height = -8.0 / 3
 gene_to_locations = defaultdict(list)
 overlap_genes = []
 all_relGenes = []
+gene_chevron_segs = []
+gene_marker_ends = []
+# (r_inner, r_outer, theta1, theta2, color) of gene bars and exons, drawn together after all genes are placed
+gene_bar_sectors = []
+exon_sectors = []
 
 
 # get the start and end angle from the linear start and end
@@ -53,6 +64,12 @@ def start_end_angle(normStart, normEnd, total_length):
     return start_angle, end_angle
 
 
+# draw annulus sectors (as made by Wedge) in one collection
+def add_sectors(r_inner, r_outer, theta1, theta2, **kwargs):
+    verts = vu.annulus_sectors(r_inner, r_outer, theta1, theta2, px_per_unit)
+    ax.add_collection(PolyCollection(verts, closed=True, **kwargs))
+
+
 def plot_bpg_connection(ref_placements, total_length, prev_seg_index_is_adj=None, bpg_dict=None, seg_end_pos_d=None,
                         manual_links=None):
     if prev_seg_index_is_adj and bpg_dict and seg_end_pos_d:
@@ -64,6 +81,7 @@ def plot_bpg_connection(ref_placements, total_length, prev_seg_index_is_adj=None
         ch = bar_width/2
         prev_seg_index_is_adj = defaultdict(bool)
 
+    sectors = []
     for ind, refObj in ref_placements.items():
         if refObj.custom_bh:
             curr_bh = refObj.custom_bh
@@ -92,18 +110,19 @@ def plot_bpg_connection(ref_placements, total_length, prev_seg_index_is_adj=None
 
             start_angle, end_angle = start_end_angle(next_refObj.abs_start_pos, refObj.abs_end_pos, total_length)
             # makes the reference genome wedges
-            ax.add_patch(
-                mpatches.Wedge((0, 0), curr_bh - ch, end_angle, start_angle, edgecolor=connect_col,
-                               facecolor=connect_col, linewidth=0, width=connect_width))
-            # f_color_v.append(connect_col)
-            # e_color_v.append(connect_col)
-            # lw_v.append(0)
+            sectors.append((curr_bh - ch - connect_width, curr_bh - ch, end_angle, start_angle, connect_col))
+
+    if sectors:
+        r_in, r_out, t1, t2, cols = zip(*sectors)
+        add_sectors(r_in, r_out, t1, t2, facecolors=cols, edgecolors=cols, linewidths=0)
 
 
 def plot_links(cfc):
     ig = cfc.base + intertrack_spacing  # radial location on the inside of the plot where the link passes over
     og = cfc.top + intertrack_spacing/3  # radial location on the edge of the plot where the link originates
+    midpoint = cfc.track_props['linkpoint'] == "midpoint"
     for currlinks in [cfc.primary_links, cfc.secondary_links]:
+        a_tups, b_tups, pair_links = [], [], []
         for cLink in currlinks:
             for a_tup in cLink.posA_hits:
                 acenter = sum(a_tup) / 2.0
@@ -127,110 +146,74 @@ def plot_links(cfc):
                     btuplist = cLink.posB_hits
 
                 for b_tup in btuplist:
-                    bcenter = sum(b_tup) / 2.0
-                    if a_tup[0] - a_tup[1] != 0 or b_tup[0] - b_tup[1] != 0 and not cfc.track_props['linkpoint'] == "midpoint":
-                        aloc_0 = a_tup[0]
-                        bloc_0 = b_tup[0]
-                        aloc_1 = a_tup[1]
-                        bloc_1 = b_tup[1]
-                        # a0, am, a1, a1, b1, b1, bm, b0, b0, a0, a0
-                        alocs = [aloc_0, acenter, aloc_1, aloc_1, bloc_0, bloc_0, bcenter, bloc_1, bloc_1, aloc_0, aloc_0, aloc_0]
-                        aguides = [og, og, og, ig, ig, og, og, og, ig, ig, og, og]
-                        aphis = np.multiply(alocs, ((1.0 / total_length) * 2 * np.pi))
-                        point_zip = zip(aphis, aguides)
-                        codes = [
-                            Path.MOVETO,
-                            Path.CURVE3,
-                            Path.CURVE3,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                            Path.CURVE3,
-                            Path.CURVE3,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                            Path.CLOSEPOLY
-                        ]
-                        fc = cLink.link_color
-                        ec = 'lightgrey'
-
-                    else:
-                        aphi = acenter / total_length * 2 * np.pi
-                        bphi = bcenter / total_length * 2 * np.pi
-                        codes = [
-                            Path.MOVETO,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                            Path.CURVE4,
-                        ]
-                        point_zip = zip([aphi, aphi, bphi, bphi], [og, ig, ig, og])
-                        fc = 'none'
-                        ec = cLink.link_color
-
-                    verts = []
-                    for phi, g in point_zip:
-                        x, y = vu.pol2cart(g, phi)
-                        verts.append((x, y))
-                    # x_a, y_a = vu.pol2cart(outer_guide, aphi)
-                    # x_b, y_b = vu.pol2cart(outer_guide, bphi)
-                    # x_a_i, y_a_i = vu.pol2cart(inner_guide, aphi)
-                    # x_b_i, y_b_i = vu.pol2cart(inner_guide, bphi)
-                    # verts = [
-                    #     (x_a, y_a),  # P0
-                    #     (x_a_i, y_a_i),  # P1
-                    #     (x_b_i, y_b_i),  # P2
-                    #     (x_b, y_b),  # P3
-                    # ]
-                    lw_val = np.log2(cLink.score + 0.1) / 10
-                    path = Path(verts, codes)
-                    # patches.append(mpatches.PathPatch(path, facecolor='none', edgecolor=currcol, linewidth=lw_val,
-                    #                                   alpha=0.5))
-                    ax.add_patch(mpatches.PathPatch(path, facecolor=fc, edgecolor=ec, linewidth=lw_val, alpha=0.5))
-                    # f_color_v.append('none')
-                    # e_color_v.append(currcol)
-                    # lw_v.append(np.log2(cLink.score + 0.1)/10)
-
-
-def plot_rects(refObj, index):
-    cfc = None
-    for cfc_x in refObj.feature_tracks:
-        if cfc_x.index == index:
-            cfc = cfc_x
-
-    currStart = refObj.abs_start_pos
-    pTup = (refObj.chrom, refObj.ref_start, refObj.ref_end)
-    for k, klist in cfc.primary_data.items():
-        for x in klist:
-            # pTup = (k, x[0], x[1])
-            istart, iend = x[0], x[1]
-            seg_len = pTup[2] - pTup[1]
-            hasStart = False
-            hasEnd = False
-            if refObj.direction == "+":
-                ts = max(0, istart - pTup[1])
-                te = min(seg_len, iend - pTup[1])
-
-                normStart = currStart + max(0, istart - pTup[1])
-                normEnd = currStart + min(seg_len, iend - pTup[1])
+                    a_tups.append(a_tup)
+                    b_tups.append(b_tup)
+                    pair_links.append(cLink)
 
-            else:
-                te = min(seg_len, pTup[2] - istart)
-                ts = max(0, pTup[2] - iend)
+        if not pair_links:
+            continue
 
-                normEnd = currStart + min(seg_len, pTup[2] - istart)
-                normStart = currStart + max(0, pTup[2] - iend)
+        if cfc.track_props['link_aggregate']:
+            plot_aggregated_links(cfc, a_tups, b_tups, pair_links, ig, og)
+            continue
+
+        # all the links of the track are drawn in one collection, ribbons are filled and curves are outlined
+        paths, is_ribbon = vu.link_paths(a_tups, b_tups, ig, og, total_length, midpoint)
+        fcs = [x.link_color if r else 'none' for x, r in zip(pair_links, is_ribbon.tolist())]
+        ecs = ['lightgrey' if r else x.link_color for x, r in zip(pair_links, is_ribbon.tolist())]
+        lws = np.log2(np.array([x.score for x in pair_links]) + 0.1) / 10
+        ax.add_collection(PathCollection(paths, facecolors=fcs, edgecolors=ecs, linewidths=lws, alpha=0.5,
+                                         joinstyle='miter', capstyle='butt'))
+
+
+# one ribbon per pair of bins along the circle, as wide as the share of the top summed score the bin pair has
+def plot_aggregated_links(cfc, a_tups, b_tups, pair_links, ig, og):
+    bin_width = cfc.track_props['link_bin_width'] / 360.0 * total_length
+    a_bins, b_bins, agg_scores, rep_inds = vu.aggregate_links([sum(x) / 2.0 for x in a_tups],
+                                                              [sum(x) / 2.0 for x in b_tups],
+                                                              [x.score for x in pair_links], bin_width)
+    keep = agg_scores > 0
+    if not keep.any():
+        return
+
+    a_bins, b_bins, agg_scores, rep_inds = a_bins[keep], b_bins[keep], agg_scores[keep], rep_inds[keep]
+    half_widths = bin_width * agg_scores / agg_scores.max() / 2.0
+    a_centers, b_centers = (a_bins + 0.5) * bin_width, (b_bins + 0.5) * bin_width
+    agg_a_tups = np.column_stack([a_centers - half_widths, a_centers + half_widths])
+    agg_b_tups = np.column_stack([b_centers - half_widths, b_centers + half_widths])
+    paths, _ = vu.link_paths(agg_a_tups, agg_b_tups, ig, og, total_length)
+    logger.debug("track %d: %d links aggregated into %d ribbons", cfc.index, len(pair_links), len(paths))
+    fcs = [pair_links[i].link_color for i in rep_inds.tolist()]
+    ax.add_collection(PathCollection(paths, facecolors=fcs, edgecolors='lightgrey', linewidths=0.1, alpha=0.5,
+                                     joinstyle='miter', capstyle='butt'))
+
+
+# draw the rects of a track on every reference segment as one collection
+def plot_rects(ref_placements, cfc):
+    norm_starts, norm_ends, colors = [], [], []
+    for refObj in ref_placements.values():
+        for cfc_x in refObj.feature_tracks:
+            if cfc_x.index != cfc.index:
+                continue
 
-            start_angle = normStart / total_length * 360
-            end_angle = normEnd / total_length * 360
-            text_angle = (start_angle + end_angle) / 2.0
-            if end_angle < 0 and start_angle > 0:
-                end_angle += 360
+            for k, klist in cfc_x.primary_data.items():
+                if not klist:
+                    continue
 
-            width = cfc.top - cfc.base
-            ctup = make_tuple("".join(x[2][2].split()))
-            ax.add_patch(mpatches.Wedge((0, 0), cfc.base, start_angle, end_angle, facecolor=ctup, linewidth=0,
-                                        width=width))
+                ns, ne = vu.map_to_segment([x[0] for x in klist], [x[1] for x in klist], refObj.abs_start_pos,
+                                           refObj.ref_start, refObj.ref_end, refObj.direction)
+                norm_starts.append(ns)
+                norm_ends.append(ne)
+                colors.extend([x[2][2] for x in klist])
+
+    if not colors:
+        return
+
+    start_angles = np.concatenate(norm_starts) / total_length * 360
+    end_angles = np.concatenate(norm_ends) / total_length * 360
+    end_angles[(end_angles < 0) & (start_angles > 0)] += 360
+    add_sectors(2 * cfc.base - cfc.top, cfc.base, start_angles, end_angles, facecolors=np.array(colors),
+                edgecolors='none', linewidths=0)
 
 
 def plot_standard_IF_track(currStart, currEnd, seg_dir, pTup, cfc, curr_chrom, total_length, seg_copies, f_ind):
@@ -260,7 +243,13 @@ def plot_standard_IF_track(currStart, currEnd, seg_dir, pTup, cfc, curr_chrom, t
                                 **cfc.track_props['background_kwargs']))
 
     # plot the legends lines
-    legend_points = np.linspace(currStart / total_length * 2 * np.pi, (currEnd + 1) / total_length * 2 * np.pi, 10000)
+    n_legend_points = 10000
+    if genome_overview:
+        # the overview has many segments, use a point count proportional to the segment's share of the circle
+        n_legend_points = max(10, int(vu.overview_track_bins * (currEnd - currStart) / total_length))
+
+    legend_points = np.linspace(currStart / total_length * 2 * np.pi, (currEnd + 1) / total_length * 2 * np.pi,
+                                n_legend_points)
     lheights = list(np.linspace(cfc.base, cfc.top, cfc.track_props['num_hlines']))
     # legend_ticks = list(np.linspace(cfc.track_min, cfc.track_max, cfc.track_props['num_hlines']))
 
@@ -313,7 +302,7 @@ def plot_standard_IF_track(currStart, currEnd, seg_dir, pTup, cfc, curr_chrom, t
         val_data = []
         for p in datalist:
             if p[1] - p[0] > granularity:
-                plocs = np.linspace(p[0], p[1], (p[1] - p[0])/granularity)
+                plocs = np.linspace(p[0], p[1], int((p[1] - p[0])/granularity))
                 for newp in plocs:
                     point_data.append(newp)
                     val_data.append(p[2])
@@ -334,10 +323,8 @@ def plot_standard_IF_track(currStart, currEnd, seg_dir, pTup, cfc, curr_chrom, t
             val_data = smvd
 
         # set the direction and convert to polars from proportional length
-        if seg_dir == "+":
-            normed_data = [(currStart + x - gs)/total_length * 2 * np.pi for x in point_data]
-        else:
-            normed_data = [(currStart + ge - x)/total_length * 2 * np.pi for x in point_data]
+        normed_data = (vu.map_points_to_segment(point_data, currStart, gs, ge, seg_dir) / total_length * 2 *
+                       np.pi).tolist()
 
         # convert to cartesians
         x_v, y_v = vu.polar_series_to_cartesians(normed_data, val_data)
@@ -372,10 +359,11 @@ def plot_standard_IF_track(currStart, currEnd, seg_dir, pTup, cfc, curr_chrom, t
             ax.add_collection(line_segments)
 
         else:
-            print("feature_style must be either 'points', 'lines', or 'radial'\n")
+            logger.error("feature_style must be either 'points', 'lines', or 'radial'")
 
 
 def plot_interior_tracks(ref_placements):
+    rect_tracks = {}
     for ind, refObj in ref_placements.items():
         seg_coord_tup = (refObj.chrom, refObj.ref_start, refObj.ref_end)
         for cfc in refObj.feature_tracks:
@@ -386,8 +374,11 @@ def plot_interior_tracks(ref_placements):
                 plot_standard_IF_track(refObj.abs_start_pos, refObj.abs_end_pos, refObj.direction, seg_coord_tup, cfc,
                                    refObj.chrom, total_length, refObj.seg_count, cfc.index)
 
-            if cfc.track_props['tracktype'] == 'rects':
-                plot_rects(refObj, cfc.index)
+            if cfc.track_props['tracktype'] == 'rects' and cfc.index not in rect_tracks:
+                rect_tracks[cfc.index] = cfc
+
+    for cfc in rect_tracks.values():
+        plot_rects(ref_placements, cfc)
 
 
 def plot_track_legend(refObj, ofpre, outer_bar, bar_width):
@@ -492,36 +483,43 @@ def plot_track_legend(refObj, ofpre, outer_bar, bar_width):
     fig_l.savefig(ofpre + '.pdf', format='pdf')
 
 
-def plot_gene_direction_indicator(s, e, total_length, drop, flanked, gInstance):
-    slant = 3.0
+# spacing and linewidth of the gene direction chevrons
+def chevron_freq_and_width(total_length):
     if args.figure_size_style == "small":
-        marker_freq = 0.015 * total_length
-        clw = 0.8
-    else:
-        marker_freq = 0.007 * total_length
-        clw = 0.4
+        return 0.015 * total_length, 0.8
+
+    return 0.007 * total_length, 0.4
 
-    fullspace_a = np.arange(0, total_length, marker_freq)
-    fullspace_b = np.arange(marker_freq/slant, total_length + marker_freq/slant, marker_freq)
+
+# chevrons sit on a grid of marker_freq spaced positions around the whole plot, so that they line up between genes.
+# Only the grid positions inside [s, e] are generated.
+def plot_gene_direction_indicator(s, e, total_length, drop, flanked, gInstance):
+    slant = 3.0
+    marker_freq = chevron_freq_and_width(total_length)[0]
+    # the grid is np.arange(0, total_length, marker_freq), and the second point of each chevron is offset by
+    # marker_freq/slant
+    n_grid = int(np.ceil(total_length / marker_freq))
+    offset_a, offset_b = 0, marker_freq/slant
 
     trim = 1 * drop / 4
     if drop < 0:
-        # posns_a, posns_b = posns_b, posns_a
-        fullspace_a, fullspace_b = fullspace_b, fullspace_a
+        offset_a, offset_b = offset_b, offset_a
         trim *= -1
 
-    boolean_array = np.logical_and(fullspace_a >= s, fullspace_a <= e)
-    in_range_indices = np.where(boolean_array)[0]
+    k_first = max(0, int(np.floor((s - offset_a) / marker_freq)))
+    k_last = min(n_grid - 1, int(np.ceil((e - offset_a) / marker_freq)))
+    grid = np.arange(k_first, k_last + 1) * marker_freq
+    grid = grid[np.logical_and(grid + offset_a >= s, grid + offset_a <= e)]
     # put one down if it's too skinny
-    if len(in_range_indices) == 0 and not flanked:
-        posns_a = [(e + s)/2.0]
-        posns_b = [(e + s)/2.0 + marker_freq/slant]
+    if len(grid) == 0 and not flanked:
+        posns_a = np.array([(e + s)/2.0])
+        posns_b = posns_a + marker_freq/slant
         if drop < 0:
             posns_a, posns_b = posns_b, posns_a
 
     else:
-        posns_a = [fullspace_a[x] for x in in_range_indices]
-        posns_b = [fullspace_b[x] for x in in_range_indices]
+        posns_a = grid + offset_a
+        posns_b = grid + offset_b
 
     ttop = outer_bar - bar_width / 4.0 + drop - trim
     tbot = ttop - bar_width / 4.0 + trim
@@ -529,59 +527,63 @@ def plot_gene_direction_indicator(s, e, total_length, drop, flanked, gInstance):
     btop = tbot
     bbot = tbot - bar_width/ 4.0 + trim
 
-    for fpos, rpos in zip(posns_a, posns_b):
-        pos_angle_a = fpos / total_length * 360
-        pos_angle_b = rpos / total_length * 360
+    if len(posns_a) > 0:
+        phi_a = posns_a / total_length * 360 / 360 * 2 * np.pi
+        phi_b = posns_b / total_length * 360 / 360 * 2 * np.pi
+        x_a, y_a = vu.pol2cart(ttop, phi_a)
+        x_b, y_b = vu.pol2cart(tbot, phi_b)
+        gene_chevron_segs.extend(np.stack([np.column_stack([x_a, y_a]), np.column_stack([x_b, y_b])], axis=1))
+        x_a, y_a = vu.pol2cart(btop, phi_b)
+        x_b, y_b = vu.pol2cart(bbot, phi_a)
+        gene_chevron_segs.extend(np.stack([np.column_stack([x_a, y_a]), np.column_stack([x_b, y_b])], axis=1))
 
+    # marker starts and ends are drawn later with the chevrons
+    gInstance.add_marker_ends(tbot, gene_marker_ends)
 
-        x_b, y_b = vu.pol2cart(ttop, (pos_angle_a / 360 * 2 * np.pi))
-        x_t, y_t = vu.pol2cart(tbot, (pos_angle_b / 360 * 2 * np.pi))
-        plt.plot([x_b, x_t], [y_b, y_t], linewidth=clw, color='grey')
 
-        x_b, y_b = vu.pol2cart(btop, (pos_angle_b / 360 * 2 * np.pi))
-        x_t, y_t = vu.pol2cart(bbot, (pos_angle_a / 360 * 2 * np.pi))
-        plt.plot([x_b, x_t], [y_b, y_t], linewidth=clw, color='grey')
+# draw all the gene direction chevrons in one collection, and the gene start/end markers
+def plot_gene_sectors():
+    if gene_bar_sectors:
+        r_in, r_out, t1, t2, cols = zip(*gene_bar_sectors)
+        add_sectors(r_in, r_out, t1, t2, facecolors=cols, edgecolors=cols, linewidths=0)
+        del gene_bar_sectors[:]
 
-    #draw marker starts and ends
-    gInstance.draw_marker_ends(tbot)
+    if exon_sectors:
+        r_in, r_out, t1, t2, cols = zip(*exon_sectors)
+        add_sectors(r_in, r_out, t1, t2, facecolors=cols, edgecolors=cols, linewidths=0.3)
+        del exon_sectors[:]
 
 
-def plot_gene_bars(currStart, currEnd, relGenes, pTup, total_length, seg_dir, ind, flanked, plot_gene_direction=True):
-    overlap_genes.append({})
-    for gObj in relGenes:
-        # e_posns is a list of tuples of exon (start,end)
-        # these can be plotted similarly to how the coding region is marked
-        gname, gstart, gend, e_posns = gObj.gname, gObj.gstart, gObj.gend, gObj.eposns
-        # print(gname, gstart, gend, pTup, len(gObj.gdrops))
-        seg_len = pTup[2] - pTup[1]
-        hasStart = False
-        hasEnd = False
-        if seg_dir == "+":
-            ts = max(0, gstart - pTup[1])
-            te = min(seg_len, gend - pTup[1])
-            if gObj.strand == "+":
-                if ts > 0: hasStart = True
-                if te < seg_len: hasEnd = True
-            else:
-                if ts > 0: hasEnd = True
-                if te < seg_len: hasStart = True
+def plot_gene_chevrons(total_length):
+    if gene_chevron_segs:
+        clw = chevron_freq_and_width(total_length)[1]
+        ax.add_collection(LineCollection(gene_chevron_segs, linewidths=clw, colors='grey', zorder=2,
+                                         capstyle='projecting'))
+        del gene_chevron_segs[:]
 
-            normStart = currStart + max(0, gstart - pTup[1])
-            normEnd = currStart + min(seg_len, gend - pTup[1])
+    if gene_marker_ends:
+        vu.draw_gene_marker_ends(ax, gene_marker_ends)
+        del gene_marker_ends[:]
 
-        else:
-            te = min(seg_len, pTup[2] - gstart)
-            ts = max(0, pTup[2] - gend)
-            if gObj.strand == "+":
-                if te < seg_len: hasStart = True
-                if ts > 0: hasEnd = True
-            else:
-                if te < seg_len: hasEnd = True
-                if ts > 0: hasStart = True
 
-            normEnd = currStart + min(seg_len, pTup[2] - gstart)
-            normStart = currStart + max(0, pTup[2] - gend)
+def plot_gene_bars(currStart, currEnd, relGenes, pTup, total_length, seg_dir, ind, flanked, plot_gene_direction=True):
+    overlap_genes.append({})
+    if not relGenes:
+        return
+
+    seg_len = pTup[2] - pTup[1]
+    g_offsets = vu.segment_offsets([x.gstart for x in relGenes], [x.gend for x in relGenes], pTup[1], pTup[2],
+                                   seg_dir)
+    for gObj, ts, te in zip(relGenes, g_offsets[0].tolist(), g_offsets[1].tolist()):
+        gname, gstart, gend = gObj.gname, gObj.gstart, gObj.gend
+        # the gene is truncated where it does not fit inside the segment
+        if seg_dir == gObj.strand:
+            hasStart, hasEnd = ts > 0, te < seg_len
+        else:
+            hasStart, hasEnd = te < seg_len, ts > 0
 
+        normStart = currStart + ts
+        normEnd = currStart + te
         start_angle = normStart / total_length * 360
         end_angle = normEnd / total_length * 360
         text_angle = (start_angle + end_angle) / 2.0
@@ -593,8 +595,7 @@ def plot_gene_bars(currStart, currEnd, relGenes, pTup, total_length, seg_dir, in
         drop = gsign * bar_width / 4.0
         gbh = outer_bar - 5.0*bar_width/12 + drop
         gObj.gdrops.append(gbh)
-        ax.add_patch(mpatches.Wedge((0, 0), gbh, start_angle, end_angle, facecolor='k', edgecolor='k', linewidth=0,
-                                      width=bar_width / 6.0))
+        gene_bar_sectors.append((gbh - bar_width / 6.0, gbh, start_angle, end_angle, 'k'))
 
         # TODO: REFACTOR TO OUTSIDE - put in the gParent
         if gname not in overlap_genes[len(overlap_genes)-2] or not overlap_genes[len(overlap_genes)-2].get(gname)[0] \
@@ -623,27 +624,42 @@ def plot_gene_bars(currStart, currEnd, relGenes, pTup, total_length, seg_dir, in
         if not (pTup[2] >= gend and pTup[1] <= gstart):
             overlap_genes[len(overlap_genes)-1][gname] = (True, seg_dir)
 
-        for exon in e_posns:
-            if gObj.highlight_name:
-                ecolor = 'r'
-                lw = 0.3
-            else:
-                ecolor = 'k'
-                lw = 0.3
-            if exon[1] > pTup[1] and exon[0] < pTup[2]:
-                if seg_dir == "+":
-                    normStart = currStart + max(1, exon[0] - pTup[1])
-                    normEnd = currStart + min(pTup[2] - pTup[1], exon[1] - pTup[1])
-
-                else:
-                    normEnd = currStart + min(pTup[2] - pTup[1], pTup[2] - exon[0])
-                    normStart = currStart + max(1, pTup[2] - exon[1])
+        # exons can be plotted similarly to how the coding region is marked
+        ecolor = 'r' if gObj.highlight_name else 'k'
+        lw = 0.3
+        e_in_seg = (gObj.eends > pTup[1]) & (gObj.estarts < pTup[2])
+        e_starts, e_ends = vu.map_to_segment(gObj.estarts[e_in_seg], gObj.eends[e_in_seg], currStart, pTup[1],
+                                             pTup[2], seg_dir, lo=1)
+        for normStart, normEnd in zip(e_starts.tolist(), e_ends.tolist()):
+            start_angle, end_angle = start_end_angle(normStart, normEnd, total_length)
+            e_top = outer_bar - bar_width / 4.0 + (drop)
+            exon_sectors.append((e_top - bar_width / 2.0, e_top, start_angle, end_angle, ecolor))
+
+
+# genome overview: show the density of genes along the reference instead of drawing each gene
+def plot_gene_density(ref_placements, total_length, gene_subset=None):
+    bin_width = total_length / float(vu.overview_gene_bins)
+    seg_counts = {}
+    for ind, refObj in ref_placements.items():
+        seg_counts[ind] = vu.gene_density(gene_tree, refObj, bin_width, gene_subset)
 
-                start_angle, end_angle = start_end_angle(normStart, normEnd, total_length)
+    max_count = max([x.max() for x in seg_counts.values()] + [1])
+    base = outer_bar - bar_width
+    for ind, refObj in ref_placements.items():
+        counts = seg_counts[ind]
+        if not counts.any():
+            continue
 
-                ax.add_patch(
-                    mpatches.Wedge((0, 0), outer_bar - bar_width / 4.0 + (drop), start_angle, end_angle,
-                                   facecolor=ecolor, edgecolor=ecolor, linewidth=lw, width=bar_width / 2.0))
+        seg_len = refObj.abs_end_pos - refObj.abs_start_pos
+        edges = refObj.abs_start_pos + np.minimum(np.arange(len(counts) + 1) * bin_width, seg_len)
+        phis = edges / total_length * 2 * np.pi
+        # step outline over the bins, then back along the base of the reference bar
+        top_phis = np.repeat(phis, 2)[1:-1]
+        top_rads = np.repeat(base + 0.8 * bar_width * counts / max_count, 2)
+        x_v, y_v = vu.pol2cart(np.concatenate([top_rads, np.full(len(phis), base)]),
+                               np.concatenate([top_phis, phis[::-1]]))
+        ax.add_patch(mpatches.Polygon(np.column_stack([x_v, y_v]), closed=True, facecolor='k', edgecolor='none',
+                                      alpha=0.5, linewidth=0))
 
 
 # Gene plotting
@@ -651,21 +667,41 @@ def plot_genes(ref_placements, cycle, onco_set=None):
     if onco_set is None:
         onco_set = set()
 
+    if genome_overview:
+        plot_gene_density(ref_placements, total_length, onco_set)
+        # only draw and name the gene subset and the highlighted genes
+        onco_set = set(onco_set) | set(args.gene_highlight_list)
+        if not onco_set:
+            return
+
     for ind, refObj in ref_placements.items():
         seg_coord_tup = (refObj.chrom, refObj.ref_start, refObj.ref_end)
-        relGenes = vu.rel_genes(gene_tree, seg_coord_tup, copy.copy(onco_set))
+        relGenes = vu.rel_genes(gene_tree, seg_coord_tup, onco_set)
         all_relGenes.extend(relGenes)
         # plot the gene track
         # print(ind, refObj.to_string(), len(relGenes))
         flanked = refObj.next_is_adjacent or refObj.prev_is_adjacent
         plot_gene_bars(refObj.abs_start_pos, refObj.abs_end_pos, relGenes, seg_coord_tup, total_length, cycle[ind][1], ind,
-                        flanked)
+                        flanked, plot_gene_direction=not genome_overview)
+
+    plot_gene_sectors()
+    plot_gene_chevrons(total_length)
+
+
+# tick spacing used in genome overview mode, a round number of Mbp
+def overview_tick_freq(total_length):
+    for tick_mb in [1, 2, 5, 10, 20, 25, 50]:
+        if total_length / (tick_mb * 1000000.) <= 80:
+            break
+
+    return tick_mb * 1000000
 
 
 # plot the reference genome
 def plot_ref_genome(ref_placements, cycle, total_length, imputed_status, label_segs, edge_ticks):
     font0 = FontProperties()
     # rot_sp = global_rot / 360. * total_length
+    sectors = []
     for ind, refObj in ref_placements.items():
         if refObj.custom_bh:
             curr_bh = refObj.custom_bh
@@ -681,7 +717,7 @@ def plot_ref_genome(ref_placements, cycle, total_length, imputed_status, label_s
         if not refObj.custom_color:
             if args.structure_color == "auto":
                 if chrom not in chromosome_colors:
-                    print("Color not found for " + chrom + ". Using red.")
+                    logger.warning("Color not found for " + chrom + ". Using red.")
                     chromosome_colors[chrom] = "red"
 
                 f_color = chromosome_colors[chrom]
@@ -696,9 +732,7 @@ def plot_ref_genome(ref_placements, cycle, total_length, imputed_status, label_s
             f_color = refObj.custom_color
             e_color = 'k'
 
-        # lw_v.append(0.2)
-        ax.add_patch(mpatches.Wedge((0, 0), curr_bh, end_angle, start_angle, facecolor=f_color, edgecolor=e_color,
-                                      linewidth=0.2, width=bar_width))
+        sectors.append((curr_bh - bar_width, curr_bh, end_angle, start_angle, f_color, e_color))
 
         # makes the ticks on the reference genome wedges
         # TODO: Refactor outside
@@ -733,18 +767,25 @@ def plot_ref_genome(ref_placements, cycle, total_length, imputed_status, label_s
             tick_freq = float('inf')
 
         else:
-            text_trunc = 10000
-            tick_freq = max(10000, 30000 * int(np.floor(total_length / 1200000)))
-            print("tick freq", tick_freq)
-            step = int(tick_freq/10000)
-            a = int(np.floor(ts[0] / 10000)) + 1
-            b = int(np.floor(te[0] / 10000)) + 1
-            print(a, b, ts[0], te[0], step)
-            for j in np.arange(a, b, s):
-                if (j*10000) % tick_freq == 0:
-                    sj = j*10000
-                    rpos = vu.convert_gpos_to_ropos(sj, refObj.abs_start_pos, refObj.abs_end_pos, seg_coord_tup[1], dir)
-                    posns.append((sj, rpos))
+            if genome_overview:
+                text_trunc = 1000000
+                tick_freq = overview_tick_freq(total_length)
+            else:
+                text_trunc = 10000
+                tick_freq = max(10000, 30000 * int(np.floor(total_length / 1200000)))
+
+            logger.debug("tick freq %s", tick_freq)
+            # ticks go on the multiples of tick_freq (itself a multiple of 10 kbp) within the segment
+            if s == 1:
+                lo, hi = (np.floor(ts[0] / 10000) + 1) * 10000, np.floor(te[0] / 10000) * 10000
+            else:
+                lo, hi = (np.floor(te[0] / 10000) + 2) * 10000, (np.floor(ts[0] / 10000) + 1) * 10000
+
+            for m in np.arange(np.ceil(lo / tick_freq), np.floor(hi / tick_freq) + 1)[::s]:
+                sj = int(m) * tick_freq
+                rpos = vu.convert_gpos_to_ropos(sj, refObj.abs_start_pos, refObj.abs_end_pos, seg_coord_tup[1],
+                                                cycle[ind][1])
+                posns.append((sj, rpos))
 
         for j in posns:
             text_angle = j[1] / total_length * 360
@@ -798,20 +839,25 @@ def plot_ref_genome(ref_placements, cycle, total_length, imputed_status, label_s
             ax.text(x, y, t, color='grey', rotation=text_angle, ha=ha, va=va, fontsize=5, fontproperties=font,
                     rotation_mode='anchor')
 
+    if sectors:
+        r_in, r_out, t1, t2, f_cols, e_cols = zip(*sectors)
+        add_sectors(r_in, r_out, t1, t2, facecolors=f_cols, edgecolors=e_cols, linewidths=0.2)
 
 
-# set the heights of the bed track features
-def get_feature_heights(ntracks, intertrack_spacing, has_OM, has_IS):
+# set the heights of the bed track features. contig_rows is the number of rows of overlapping OM contigs.
+def get_feature_heights(ntracks, intertrack_spacing, has_OM, has_IS, has_molecules=False, lowest_contig_shift=0):
     IS_height = segment_bar_height/2
     if ntracks > 0:
         maxtop = outer_bar-(intertrack_spacing + 0.5)
         if has_OM:
-            maxtop += contig_bar_height
+            maxtop += contig_bar_height - lowest_contig_shift
+            if has_molecules:
+                maxtop -= molecule_track_height
         if has_IS:
             maxtop += IS_height
 
         if maxtop < center_hole:
-            print("ERROR: om and segment height exceeds allowed height in track")
+            logger.error("om and segment height exceeds allowed height in track")
             sys.exit(1)
 
         divs = np.linspace(center_hole, maxtop, ntracks+1)
@@ -827,35 +873,31 @@ def get_feature_heights(ntracks, intertrack_spacing, has_OM, has_IS):
         if has_IS:
             smt = maxtop - IS_height
 
-        print("Intertrack spacing is ", bases, tops)
+        logger.debug("Intertrack spacing is %s %s", bases, tops)
         return bases, tops, smt
 
     return [], [], 0
 
 
-# plot cmap track for bionano
-def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_id_labels=False):
+# plot cmap track for bionano. Bars thinner than bar_width keep their top edge, where the alignment lines end.
+def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_id_labels=False,
+                    bar_thickness=bar_width):
     cycle_label_locs = defaultdict(list)
+    sectors = []
+    label_segs = []
+    linewidth = min(0.25 * 2000000 / total_length, 0.25)
     for ind, segObj in seg_placements.items():
         bar_height = unadj_bar_height + segObj.track_height_shift
-        print("cmap_plot", segObj.id)
+        bar_bottom = bar_height + bar_width - bar_thickness
         start_angle, end_angle = start_end_angle(segObj.abs_end_pos, segObj.abs_start_pos, total_length)
-        ax.add_patch(mpatches.Wedge((0, 0), bar_height + bar_width, end_angle, start_angle, facecolor=color,
-                                      edgecolor='k', linewidth=0, width=bar_width))
-        # f_color_v.append(color)
-        # e_color_v.append('k')
-        # lw_v.append(0)
-
-        linewidth = min(0.25 * 2000000 / total_length, 0.25)
-        for i in segObj.label_posns:
-            if i > segObj.abs_end_pos or i < segObj.abs_start_pos:
-                continue
+        sectors.append((bar_bottom, bar_height + bar_width, end_angle, start_angle))
 
-            label_rads = i / total_length * 2 * np.pi
-            x, y = vu.pol2cart(bar_height, label_rads)
-            x_t, y_t = vu.pol2cart(bar_height + bar_width, label_rads)
-            # linewidth = min(0.2*2000000/total_length,0.2)
-            ax.plot([x, x_t], [y, y_t], color='k', alpha=0.9, linewidth=linewidth)
+        l_posns = segObj.label_posns
+        l_posns = l_posns[(l_posns <= segObj.abs_end_pos) & (l_posns >= segObj.abs_start_pos)]
+        label_rads = l_posns / total_length * 2 * np.pi
+        x, y = vu.pol2cart(bar_bottom, label_rads)
+        x_t, y_t = vu.pol2cart(bar_height + bar_width, label_rads)
+        label_segs.extend(np.stack([np.column_stack([x, y]), np.column_stack([x_t, y_t])], axis=1))
 
         if seg_id_labels:
             mid_sp = (segObj.abs_end_pos + segObj.abs_start_pos) / 2
@@ -866,28 +908,135 @@ def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_i
             ax.text(x, y, text, color='grey', rotation=text_angle,
                     ha=ha, fontsize=5, rotation_mode='anchor')
 
+    if sectors:
+        r_in, r_out, t1, t2 = zip(*sectors)
+        add_sectors(r_in, r_out, t1, t2, facecolors=color, edgecolors='k', linewidths=0)
+
+    if label_segs:
+        ax.add_collection(LineCollection(label_segs, colors='k', alpha=0.9, linewidths=linewidth,
+                                         capstyle='projecting', zorder=2))
+
     return cycle_label_locs
 
 
+# Stack the molecules aligned to the contigs (from a molecule-to-contig xmap) in a band of at most max_depth rows,
+# under the lowest row of contigs (based at unadj_bar_height). Molecules of overlapping contigs share the band, so
+# they never cover other contigs. If a bnx is given, the labels of the drawn molecules are marked.
+def plot_molecule_track(contig_placements, total_length, unadj_bar_height, xmapf, bnxf=None, max_depth=20):
+    contigs = dict((cObj.id, cObj) for cObj in contig_placements.values())
+    mols = []
+    n_alns = 0
+    for aln in iter_xmap(xmapf, ref_ids=set(contigs)):
+        cObj = contigs[aln["RefContigID"]]
+        ends = vu.contig_to_plot_posns(vu.molecule_to_contig_posns([0, aln["QryLen"]], aln), cObj)
+        n_alns += 1
+        # clip to the drawn (possibly trimmed) extent of the contig
+        s, e = max(min(ends), cObj.abs_start_pos), min(max(ends), cObj.abs_end_pos)
+        if s < e:
+            mols.append((s, e, aln, cObj))
+
+    row_h = molecule_track_height / float(max_depth)
+    top = unadj_bar_height - 0.25
+    sectors = []
+    # placements drawn for each molecule id. A molecule can align to several contigs, or more than once to a contig
+    drawn = defaultdict(list)
+    rows = vu.pack_rows([x[0] for x in mols], [x[1] for x in mols], max_depth, gap=0.002 * total_length,
+                        period=total_length)
+    for (s, e, aln, cObj), row in zip(mols, rows.tolist()):
+        if row < 0:
+            continue
+
+        r_out = top - row * row_h
+        sectors.append((r_out - 0.7 * row_h, r_out, s / total_length * 360, e / total_length * 360))
+        drawn[aln["QryContigID"]].append((aln, cObj, r_out - 0.7 * row_h, r_out))
+
+    logger.info("drawing %d of %d molecule alignments (depth cap %d)", len(sectors), n_alns, max_depth)
+    if not sectors:
+        return
+
+    r_in, r_out, t1, t2 = zip(*sectors)
+    add_sectors(r_in, r_out, t1, t2, facecolors='silver', edgecolors='none', linewidths=0)
+
+    if bnxf:
+        segs = []
+        for mol_id, length, labels in fetch_bnx_molecules(bnxf, list(drawn)):
+            for aln, cObj, r_lo, r_hi in drawn[mol_id]:
+                l_posns = vu.contig_to_plot_posns(vu.molecule_to_contig_posns(labels, aln), cObj)
+                l_posns = l_posns[(l_posns <= cObj.abs_end_pos) & (l_posns >= cObj.abs_start_pos)]
+                phis = l_posns / total_length * 2 * np.pi
+                x0, y0 = vu.pol2cart(r_lo, phis)
+                x1, y1 = vu.pol2cart(r_hi, phis)
+                segs.extend(np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y1])], axis=1))
+
+        if segs:
+            ax.add_collection(LineCollection(segs, colors='k', linewidths=0.1))
+
+
+# place the contigs of a path alignment on the segments. Returns the contig placements and the list of contig ids.
+def place_om_contigs(aln_vect, seg_placements, contig_cmap_vects, total_length, isCycle):
+    with prof.stage("place_contigs_and_labels"):
+        contig_placements, contig_list = vu.place_contigs_and_labels(seg_placements, aln_vect, total_length,
+                                                                     contig_cmap_vects, isCycle, True, segSeqD)
+
+        vu.decide_trim_contigs(contig_cmap_vects, contig_placements, total_length)
+
+    return contig_placements, contig_list
+
+
 # plot the connecting lines for the bionano track
-def plot_alignment(contig_locs, segment_locs, total_length):
+def plot_alignment(aln_vect, contig_locs, segment_locs, total_length):
     segs_base = outer_bar + segment_bar_height
     linewidth = min(0.25 * 2000000 / total_length, 0.25)
-    for a_d in aln_vect:
-        c_id = a_d["contig_id"]
-        c_num_dir = int(a_d["contig_dir"] + "1")
-
-        contig_label_vect = contig_locs[c_id].label_posns
-        seg_label_vect = segment_locs[a_d["seg_aln_number"]].label_posns
-        c_l_pos = contig_label_vect[a_d["contig_label"] - 1]
-        c_l_loc = c_l_pos / total_length * 2. * np.pi
-        # s_l_pos = seg_label_vect[s_num_dir*a_d["seg_label"]-(s_num_dir+1)/2]
-        s_l_pos = seg_label_vect[a_d["seg_label"] - 1]
-        s_l_loc = s_l_pos / total_length * 2. * np.pi
-        contig_top = outer_bar + contig_bar_height + contig_locs[c_id].track_height_shift + bar_width
-        x_c, y_c = vu.pol2cart(contig_top, c_l_loc)
-        x_s, y_s = vu.pol2cart(segs_base, s_l_loc)
-        ax.plot([x_c, x_s], [y_c, y_s], color="grey", linewidth=linewidth)
+    if not len(aln_vect):
+        return
+
+    c_l_pos, s_l_pos, contig_top = vu.alignment_label_posns(aln_vect, contig_locs, segment_locs)
+    contig_top += outer_bar + contig_bar_height + bar_width
+    x_c, y_c = vu.pol2cart(contig_top, c_l_pos / total_length * 2. * np.pi)
+    x_s, y_s = vu.pol2cart(segs_base, s_l_pos / total_length * 2. * np.pi)
+    aln_segs = np.stack([np.column_stack([x_c, y_c]), np.column_stack([x_s, y_s])], axis=1)
+    ax.add_collection(LineCollection(aln_segs, colors="grey", linewidths=linewidth, capstyle='projecting', zorder=2))
+
+
+# small multiples of the structure and OM contigs of each path alignment, reusing the parsed cmaps and seg placements.
+# The first panel reuses the contig placements of the main figure. The panels are drawn on their own figure, with the
+# global axes and scale restored afterwards.
+def plot_om_compare(aln_vects, aln_names, first_placements, ref_placements, cycle, cycle_seg_placements,
+                    contig_cmap_vects, total_length, isCycle, label_segs, fname):
+    global fig, ax, px_per_unit
+    saved = fig, ax, px_per_unit
+    n_cols = int(np.ceil(np.sqrt(len(aln_vects))))
+    n_rows = int(np.ceil(len(aln_vects) / float(n_cols)))
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=(3 * n_cols, 3 * n_rows), squeeze=False)
+    px_per_unit = 300 * 3 / (2 * (outer_bar + 3.3))
+    for p_ind, ax in enumerate(axes.flat):
+        ax.set_axis_off()
+        if p_ind >= len(aln_vects):
+            continue
+
+        p_imputed_status = vu.imputed_status_from_aln(aln_vects[p_ind], len(cycle))
+        plot_ref_genome(ref_placements, cycle, total_length, p_imputed_status, label_segs, "none")
+        plot_cmap_track(cycle_seg_placements, total_length, outer_bar + segment_bar_height, "darkorange")
+        if p_ind == 0:
+            p_contig_placements = first_placements
+        else:
+            p_contig_placements, p_contig_list = place_om_contigs(aln_vects[p_ind], cycle_seg_placements,
+                                                                  contig_cmap_vects, total_length, isCycle)
+            vu.set_contig_height_shifts(p_contig_placements, p_contig_list, total_length=total_length)
+
+        plot_cmap_track(p_contig_placements, total_length, outer_bar + contig_bar_height, "cornflowerblue",
+                        seg_id_labels=True)
+        plot_alignment(aln_vects[p_ind], p_contig_placements, cycle_seg_placements, total_length)
+        ax.set_xlim(-(outer_bar + 1.25), (outer_bar + 1.25))
+        ax.set_ylim(-(outer_bar + 3.3), (outer_bar + 3.3))
+        ax.set_aspect(1.0)
+        ax.set_title(aln_names[p_ind], fontsize=6)
+
+    fig.tight_layout()
+    fig.savefig(fname + '_om_compare.png', dpi=300)
+    fig.savefig(fname + '_om_compare.pdf', format='pdf')
+    plt.close(fig)
+    fig, ax, px_per_unit = saved
 
 
 def construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length, prev_seg_index_is_adj, next_seg_index_is_adj,
@@ -896,26 +1045,9 @@ def construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length, prev_seg_in
         aln_vect = []
 
     spacing_bp = seg_spacing * raw_cycle_length
-    cycle_ref_placements = {}
-    curr_start = 0.0 if isCycle else spacing_bp
-    next_start = 0
-    for ind, i in enumerate(cycle):
-        seg_id_count = cycle_seg_counts[i[0]]
-        seg_len = segSeqD[i[0]][2] - segSeqD[i[0]][1]
-        seg_end = curr_start + seg_len
-        padj, nadj = prev_seg_index_is_adj[ind], next_seg_index_is_adj[ind]
-        curr_obj = vu.CycleVizElemObj(i[0], segSeqD[i[0]][0], segSeqD[i[0]][1], segSeqD[i[0]][2], i[1], curr_start,
-                                      seg_end, seg_id_count, padj, nadj)
-        cycle_ref_placements[ind] = curr_obj
-        next_start = seg_end
-        mod_ind = (ind + 1) % (len(prev_seg_index_is_adj))
-        if not prev_seg_index_is_adj[mod_ind]:
-            next_start += spacing_bp
-
-        curr_start = next_start
-
-    total_length = next_start
-    return cycle_ref_placements, total_length
+    first_start = 0.0 if isCycle else spacing_bp
+    return vu.construct_ref_placements(cycle, segSeqD, spacing_bp, prev_seg_index_is_adj, next_seg_index_is_adj,
+                                       cycle_seg_counts, first_start)
 
 
 parser = argparse.ArgumentParser(description="Circular visualizations of genome structures")
@@ -936,7 +1068,17 @@ parser.add_argument("--interior_segments_cycle",
                     type=str, default="")
 parser.add_argument("-c", "--contigs", help="contig cmap file")
 parser.add_argument("--om_segs", help="segments cmap file")
-parser.add_argument("--AR_path_alignment", help="AR path alignment file")
+parser.add_argument("--AR_path_alignment", help="AR path alignment file. Give several to compare the alignments (see "
+                    "--om_compare)", nargs="+")
+parser.add_argument("--om_compare", help="How to show several path alignments: 'multiples' draws the first in the main "
+                    "figure and all of them side by side in [outname]_om_compare, 'concentric' draws the contigs of "
+                    "each in a ring inside the previous one, if they fit", choices=["multiples", "concentric"],
+                    default="multiples")
+parser.add_argument("--om_molecule_xmap", help="xmap of molecules aligned to the contigs, to stack the molecules below "
+                    "the contigs")
+parser.add_argument("--om_molecules", help="bnx file of the molecules in --om_molecule_xmap, to mark their labels")
+parser.add_argument("--om_molecule_depth", help="maximum number of rows of molecules to stack under the contigs", type=int,
+                    default=20)
 parser.add_argument("--outname", "-o", help="output prefix")
 # parser.add_argument("--rot", help="number of segments to rotate counterclockwise", type=int, default=0)
 parser.add_argument("--label_segs", help="label segs with segments number-direction or names", default='numbers',
@@ -963,16 +1105,30 @@ parser.add_argument("--structure_color", help="Use 'auto' coloring, or specify a
 parser.add_argument("--hide_chrom_color_legend", help="Do not show a legend of the chromosome colors",
                     action='store_true', default=False)
 parser.add_argument("--center_hole", type=float, help="whitespace in center of plot", default=1.25)
+parser.add_argument("--genome_overview", help="Draw aggregated gene density, Mbp ticks and binned feature tracks "
+                    "instead of individual genes and points. 'auto' turns this on when the structure spans at least "
+                    "100 Mbp", choices=["auto", "on", "off"], default="auto")
 parser.add_argument("--figure_size_style", choices=["normal", "small"], default="normal")
+parser.add_argument("--profile", help="Report wall/CPU time, peak memory, artist count and input sizes of each stage",
+                    action='store_true', default=False)
+parser.add_argument("--profile_json", help="Write the --profile report to this JSON file", type=str, default="")
+parser.add_argument("--profile_trace", help="Write the --profile report to this Chrome trace (chrome://tracing) file",
+                    type=str, default="")
+parser.add_argument("--log_level", help="Verbosity of messages printed while running (default WARNING)",
+                    choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper, default="WARNING")
 
 args = parser.parse_args()
+vu.setup_logging(args.log_level)
 if args.input_yaml_file:
     vu.parse_main_args_yaml(args)
 
 if args.ref == "GRCh38":
     args.ref = "hg38"
 
-print(args.ref)
+if isinstance(args.AR_path_alignment, str):
+    args.AR_path_alignment = [args.AR_path_alignment]
+
+logger.info("Reference genome " + args.ref)
 
 if args.figure_size_style == "small":
     bar_width *= 1.5
@@ -984,10 +1140,14 @@ gene_spacing = args.gene_spacing
 
 sourceDir = os.path.dirname(os.path.abspath(__file__)) + "/"
 
-print("Unaligned fraction cutoff set to " + str(vu.unaligned_cutoff_frac))
+prof = StageProfiler(args.profile or bool(args.profile_json) or bool(args.profile_trace))
+logger.info("Unaligned fraction cutoff set to " + str(vu.unaligned_cutoff_frac))
 chromosome_colors = vu.get_chr_colors()
 plt.clf()
 fig, ax = plt.subplots()
+prof.fig = fig
+# output pixels per data unit in the saved png (600 dpi, y limits set before saving), for sampling arcs
+px_per_unit = 600 * fig.get_size_inches()[1] / (2 * (outer_bar + 3.3))
 patches = []
 f_color_v = []
 e_color_v = []
@@ -1002,23 +1162,30 @@ if args.cycles_file:
     if not args.outname:
         args.outname = os.path.splitext(os.path.basename(args.cycles_file))[0] + "_"
     fname = args.outname + "cycle_" + args.cycle
-    cycles, segSeqD, circular_D = vu.parse_cycles_file(args.cycles_file)
-    isCycle = circular_D[args.cycle]
-    cycle = cycles[args.cycle]
+    with prof.stage("parse_cycles_file"):
+        cycles, segSeqD, circular_D = vu.parse_cycles_file(args.cycles_file)
+        isCycle = circular_D[args.cycle]
+        cycle = cycles[args.cycle]
+
     if args.graph:
-        bpg_dict, seg_end_pos_d = vu.parse_BPG(args.graph)
+        with prof.stage("parse_BPG"):
+            bpg_dict, seg_end_pos_d = vu.parse_BPG(args.graph)
 
 # use the structure_bed format to determine the structure
 else:
     if not args.outname:
-        print("Must specify --sname with --structure-bed")
+        logger.error("Must specify --sname with --structure-bed")
         sys.exit(1)
         # args.outname = os.path.splitext(os.path.basename(args.structure_bed))[0] + "_"
     fname = args.outname + "cycle_1"
     if args.structure_bed in {"hg19", "GRCh37", "hg38", "GRCh38"}:
         args.structure_bed = sourceDir + "resources/" + args.structure_bed + "_structure.bed"
-    struct_data = vu.parse_bed(args.structure_bed, store_all_additional_fields=True)
-    cycle, isCycle, segSeqD, seg_end_pos_d, bpg_dict = vu.handle_struct_bed_data(struct_data)
+    with prof.stage("parse_structure_bed"):
+        struct_data = vu.parse_bed(args.structure_bed, store_all_additional_fields=True)
+        cycle, isCycle, segSeqD, seg_end_pos_d, bpg_dict = vu.handle_struct_bed_data(struct_data)
+
+prof.set_size("segments", len(segSeqD))
+prof.set_size("path_length", len(cycle))
 
 # bookkeeping
 cycle_seg_counts = vu.get_seg_amplicon_count(cycle)
@@ -1037,105 +1204,211 @@ if args.gene_subset_file:
 elif args.gene_subset_list:
     gene_set = set(args.gene_subset_list)
 
-fbases, ftops, IS_bh = get_feature_heights(len(args.feature_yaml_list), intertrack_spacing, args.om_alignments,
-                                    args.interior_segments_cycle)
-
 # standard case
+lowest_contig_shift = 0
+om_compare = args.om_compare
+has_molecules = bool(args.om_molecule_xmap)
 if not args.om_alignments:
-    ref_placements, total_length = construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length,
-                                                                  prev_seg_index_is_adj, next_seg_index_is_adj,
-                                                                  isCycle, cycle_seg_counts)
+    with prof.stage("construct_cycle_ref_placements", segments=len(cycle)):
+        ref_placements, total_length = construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length,
+                                                                      prev_seg_index_is_adj, next_seg_index_is_adj,
+                                                                      isCycle, cycle_seg_counts)
     imputed_status = [False] * len(cycle)
 
 # only if bionano data present
 else:
-    print("Visualizing with alignments")
-    print("Contig spacing set to " + str(vu.contig_spacing))
-    seg_cmaps = parse_cmap(args.om_segs, True)
-    seg_cmap_vects = vectorize_cmaps(seg_cmaps)
-    seg_cmap_lens = get_cmap_lens(args.om_segs)
-    aln_vect, meta_dict = vu.parse_alnfile(args.AR_path_alignment)
-    is_segdup, split_ind = vu.check_segdup(aln_vect, cycle, isCycle)
+    logger.info("Visualizing with alignments")
+    logger.info("Contig spacing set to " + str(vu.contig_spacing))
+    with prof.stage("parse_om_segs"):
+        seg_cmap_vects, seg_cmap_lens = parse_cmap_vects(args.om_segs, True)
+
+    with prof.stage("parse_alnfile") as st:
+        aln_vects = [vu.parse_alnfile(x)[0] for x in args.AR_path_alignment]
+        aln_vect = aln_vects[0]
+        st["rows"] = sum(len(x) for x in aln_vects)
+
+    segdup_status = [vu.check_segdup(x, cycle, isCycle) for x in aln_vects]
+    is_segdup = segdup_status[0][0]
+    if any(x[0] != is_segdup for x in segdup_status):
+        logger.error("Path alignments disagree on whether the path is a simple segdup and cannot be compared")
+        sys.exit(1)
+
     if is_segdup:
-        print("alignment shows simple segdup")
+        logger.info("alignment shows simple segdup")
         cycle = [cycle[0]] * 2
-        print(cycle)
         isCycle = False
         prev_seg_index_is_adj = [False, True]
         next_seg_index_is_adj = [True, False]
-        for a_ind in range(split_ind, len(aln_vect)):
-            aln_vect[a_ind]["seg_aln_number"] = 1
+        for x, (_, split_ind) in zip(aln_vects, segdup_status):
+            for a_ind in range(split_ind, len(x)):
+                x[a_ind]["seg_aln_number"] = 1
 
-    ref_placements, total_length = construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length,
-                                                                  prev_seg_index_is_adj, next_seg_index_is_adj, isCycle,
-                                                                  cycle_seg_counts)
+    with prof.stage("construct_cycle_ref_placements", segments=len(cycle)):
+        ref_placements, total_length = construct_cycle_ref_placements(cycle, segSeqD, raw_cycle_length,
+                                                                      prev_seg_index_is_adj, next_seg_index_is_adj,
+                                                                      isCycle, cycle_seg_counts)
 
-    cycle_seg_placements = vu.place_path_segs_and_labels(cycle, ref_placements, seg_cmap_vects)
-    contig_cmaps = parse_cmap(args.contigs, True)
-    contig_cmap_vects = vectorize_cmaps(contig_cmaps)
-    contig_cmap_lens = get_cmap_lens(args.contigs)
-    contig_placements, contig_list = vu.place_contigs_and_labels(cycle_seg_placements, aln_vect, total_length,
-                                                                 contig_cmap_vects, isCycle, True, segSeqD)
+    with prof.stage("place_path_segs_and_labels"):
+        cycle_seg_placements = vu.place_path_segs_and_labels(cycle, ref_placements, seg_cmap_vects)
 
-    vu.decide_trim_contigs(contig_cmap_vects, contig_placements, total_length)
+    with prof.stage("parse_contigs") as st:
+        contig_cmap_vects, contig_cmap_lens = parse_cmap_vects(args.contigs, True)
+        st["contigs"] = len(contig_cmap_vects)
 
     # plot cmap segs
-    plot_cmap_track(cycle_seg_placements, total_length, outer_bar + segment_bar_height, "darkorange")
+    with prof.stage("plot_cmap_track_segs"):
+        plot_cmap_track(cycle_seg_placements, total_length, outer_bar + segment_bar_height, "darkorange")
+
+    # place contigs. In concentric mode the contigs of each further alignment go in a ring inside the previous ones.
+    n_rings = len(aln_vects) if om_compare == "concentric" else 1
+    rings = [place_om_contigs(aln_vects[ring], cycle_seg_placements, contig_cmap_vects, total_length, isCycle)
+             for ring in range(n_rings)]
+    contig_placements = rings[0][0]
 
     # check overlaps of contigs and adjust heights accordingly
-    contig_height_shifts = vu.set_contig_height_shifts(contig_placements, contig_list)
+    ring_rows = [vu.set_contig_height_shifts(p, l, total_length=total_length) for p, l in rings]
+    row_scale = 1.0
+    contig_thickness = bar_width
+    if n_rings > 1:
+        # squeeze the rows of all the rings between the first contig row and the center hole, leaving a unit of
+        # radius for each feature track, and thin the bars to fit the rows. Past the smallest row spacing the rings
+        # are too thin to read.
+        ring_floor = center_hole
+        if args.feature_yaml_list:
+            ring_floor += intertrack_spacing + 0.5 + len(args.feature_yaml_list)
+
+        ring_space = outer_bar + contig_bar_height - ring_floor
+        row_pitch = min(vu.contig_row_shift, ring_space / max(sum(ring_rows) - 1, 1))
+        if row_pitch < min_contig_row_pitch:
+            logger.warning("Concentric contig rings (%d rows) do not fit above the center hole, drawing them as "
+                           "multiples instead", sum(ring_rows))
+            om_compare = "multiples"
+            n_rings = 1
+            rings = rings[:1]
+            ring_rows = ring_rows[:1]
+
+    if n_rings > 1:
+        row_scale = row_pitch / vu.contig_row_shift
+        contig_thickness = min(bar_width, row_pitch / 1.1)
+        for p, l in rings:
+            vu.set_contig_height_shifts(p, l, row_scale, total_length)
+
+        ring_names = [os.path.splitext(os.path.basename(x))[0] for x in args.AR_path_alignment]
+        if len(ring_names) > 10:
+            ring_names = ring_names[:9] + ["... {} more".format(len(ring_names) - 9)]
+
+        ax.text(-(outer_bar + 1.25), outer_bar + 3.3, "contig rings, outer to inner:\n" + "\n".join(ring_names),
+                color='grey', fontsize=5, va='top')
+
     # plot contigs
-    plot_cmap_track(contig_placements, total_length, outer_bar + contig_bar_height, "cornflowerblue",
-                    seg_id_labels=True)
+    n_contig_rows = 0
+    for (ring_placements, _), rows in zip(rings, ring_rows):
+        contig_base = outer_bar + contig_bar_height - n_contig_rows * vu.contig_row_shift
+        with prof.stage("plot_cmap_track_contigs", contigs=len(ring_placements)):
+            # segment ids are drawn below each bar, where they would run into the rows of squeezed rings
+            plot_cmap_track(ring_placements, total_length, contig_base, "cornflowerblue",
+                            seg_id_labels=row_scale == 1.0, bar_thickness=contig_thickness)
+
+        n_contig_rows += rows * row_scale
+
+    # the base of the lowest row of contigs is one row above the total height of the rows
+    lowest_contig_shift = (n_contig_rows - row_scale) * vu.contig_row_shift
+
+    if n_rings > 1 and has_molecules:
+        logger.warning("Molecules are not drawn with concentric path alignments")
+        has_molecules = False
+
+    # plot molecules aligned to the contigs, below the lowest row of contigs
+    if has_molecules:
+        with prof.stage("plot_molecule_track"):
+            lowest_contig_base = outer_bar + contig_bar_height - lowest_contig_shift
+            plot_molecule_track(contig_placements, total_length, lowest_contig_base, args.om_molecule_xmap,
+                                args.om_molecules, args.om_molecule_depth)
 
     # plot alignments
-    plot_alignment(contig_placements, cycle_seg_placements, total_length)
+    with prof.stage("plot_alignment", rows=len(aln_vect)):
+        plot_alignment(aln_vect, contig_placements, cycle_seg_placements, total_length)
+
     imputed_status = vu.imputed_status_from_aln(aln_vect, len(cycle))
 
-print("plotting structure")
-print(args.label_segs)
-plot_ref_genome(ref_placements, cycle, total_length, imputed_status, args.label_segs, args.tick_type)
+fbases, ftops, IS_bh = get_feature_heights(len(args.feature_yaml_list), intertrack_spacing, args.om_alignments,
+                                    args.interior_segments_cycle, has_molecules, lowest_contig_shift)
+
+genome_overview = vu.use_genome_overview(args.genome_overview, ref_placements)
+if genome_overview:
+    logger.info("using genome overview mode")
+
+logger.info("plotting structure")
+with prof.stage("plot_ref_genome", segments=len(ref_placements)):
+    plot_ref_genome(ref_placements, cycle, total_length, imputed_status, args.label_segs, args.tick_type)
+
 if args.annotate_structure == 'genes':
-    print("Reading genes")
-    gene_tree = vu.parse_genes(args.ref, args.gene_highlight_list)
-    print("plotting genes")
-    plot_genes(ref_placements, cycle, gene_set)
+    logger.info("Reading genes")
+    with prof.stage("parse_genes"):
+        gene_tree = vu.parse_genes(args.ref, args.gene_highlight_list)
+
+    logger.info("plotting genes")
+    with prof.stage("plot_genes") as st:
+        plot_genes(ref_placements, cycle, gene_set)
+        st["genes"] = len(all_relGenes)
+
+    prof.set_size("genes", len(all_relGenes))
 
 
 # Interior segments
 if args.interior_segments_cycle:
-    IS_cycles, IS_segSeqD, IS_circular_D = vu.parse_cycles_file(args.interior_segments_cycle)
-    print("Interior segment cycles handles first cycle only. Multi-cycle support coming soon")
-    IS_cycle, IS_isCircular = IS_cycles["1"], IS_circular_D["1"]
-    IS_rObj_placements, new_IS_cycle, new_IS_links = vu.handle_IS_data(ref_placements, IS_cycle, IS_segSeqD,
-                                                                       IS_isCircular, IS_bh)
-    plot_ref_genome(IS_rObj_placements, new_IS_cycle, total_length, [False] * len(new_IS_cycle), False, None)
+    with prof.stage("interior_segments"):
+        IS_cycles, IS_segSeqD, IS_circular_D = vu.parse_cycles_file(args.interior_segments_cycle)
+        if len(IS_cycles) > 1:
+            logger.warning("Interior segment cycles handles first cycle only. Multi-cycle support coming soon")
+        IS_cycle, IS_isCircular = IS_cycles["1"], IS_circular_D["1"]
+        IS_rObj_placements, new_IS_cycle, new_IS_links = vu.handle_IS_data(ref_placements, IS_cycle, IS_segSeqD,
+                                                                           IS_isCircular, IS_bh)
+        plot_ref_genome(IS_rObj_placements, new_IS_cycle, total_length, [False] * len(new_IS_cycle), False, None)
 
-    plot_bpg_connection(IS_rObj_placements, total_length, manual_links=new_IS_links)
+        plot_bpg_connection(IS_rObj_placements, total_length, manual_links=new_IS_links)
 
 # bedgraph
 if args.feature_yaml_list:
     if args.annotate_structure != "genes":
-        cfc = vu.parse_feature_yaml(args.annotate_structure, 0, 1)
-        cfc.base, cfc.top = outer_bar, outer_bar+bar_width
-        vu.store_bed_data(cfc, ref_placements, cfc.track_props['end_trim'])
-        print("plotting rects")
-        for refObj in ref_placements.values():
-            plot_rects(refObj, 0)
+        with prof.stage("parse_feature_yaml", track=0):
+            cfc = vu.parse_feature_yaml(args.annotate_structure, 0, 1)
+            cfc.base, cfc.top = outer_bar, outer_bar+bar_width
+
+        with prof.stage("store_bed_data", track=0, points=vu.count_track_points(cfc)):
+            vu.store_bed_data(cfc, ref_placements, cfc.track_props['end_trim'])
 
+        logger.info("plotting rects")
+        with prof.stage("plot_rects", track=0):
+            plot_rects(ref_placements, cfc)
+
+    n_points = 0
     for ind, yaml_file in enumerate(args.feature_yaml_list):
-        cfc = vu.parse_feature_yaml(yaml_file, ind + 1, len(args.feature_yaml_list))
-        cfc.base, cfc.top = fbases[ind], ftops[ind]
-        vu.store_bed_data(cfc, ref_placements, cfc.track_props['end_trim'])
+        with prof.stage("parse_feature_yaml", track=ind + 1):
+            cfc = vu.parse_feature_yaml(yaml_file, ind + 1, len(args.feature_yaml_list))
+            cfc.base, cfc.top = fbases[ind], ftops[ind]
+            if genome_overview and cfc.track_props['tracktype'] == 'standard':
+                vu.bin_feature_track(cfc, total_length / float(vu.overview_track_bins))
+
+        track_points = vu.count_track_points(cfc)
+        n_points += track_points
+        with prof.stage("store_bed_data", track=ind + 1, points=track_points):
+            vu.store_bed_data(cfc, ref_placements, cfc.track_props['end_trim'])
+
         if cfc.track_props['tracktype'] == 'standard':
             vu.reset_track_min_max(ref_placements, ind, cfc)
-            plot_interior_tracks(ref_placements)
+            with prof.stage("plot_interior_tracks", track=ind + 1):
+                plot_interior_tracks(ref_placements)
         else:
-            plot_links(cfc)
+            with prof.stage("plot_links", track=ind + 1):
+                plot_links(cfc)
+
+    prof.set_size("points", n_points)
 
 
 if bpg_dict:
-    plot_bpg_connection(ref_placements, total_length, prev_seg_index_is_adj, bpg_dict, seg_end_pos_d)
+    with prof.stage("plot_bpg_connection"):
+        plot_bpg_connection(ref_placements, total_length, prev_seg_index_is_adj, bpg_dict, seg_end_pos_d)
 
 ax.set_xlim(-(outer_bar + 1.25), (outer_bar + 1.25))
 ax.set_ylim(-(outer_bar + 3.3), (outer_bar + 3.3))
@@ -1161,15 +1434,28 @@ if not args.hide_chrom_color_legend and args.structure_color == 'auto':
 ax.set_aspect(1.0)
 plt.axis('off')
 
-print("saving PNG")
-plt.savefig(fname + '.png', dpi=600)
-print("saving PDF")
-plt.savefig(fname + '.pdf', format='pdf')
+prof.set_size("artists", count_artists(fig))
+logger.info("saving PNG")
+with prof.stage("savefig_png"):
+    plt.savefig(fname + '.png', dpi=600)
+logger.info("saving PDF")
+with prof.stage("savefig_pdf"):
+    plt.savefig(fname + '.pdf', format='pdf')
 plt.close()
 
 # make plots of the yaml tracks
-print("saving legend")
+logger.info("saving legend")
 if args.feature_yaml_list:
-    plot_track_legend(ref_placements[0], fname + "_legend", outer_bar, bar_width)
-
-print("finished")
\ No newline at end of file
+    with prof.stage("plot_track_legend"):
+        plot_track_legend(ref_placements[0], fname + "_legend", outer_bar, bar_width)
+
+# small multiples of the path alignments
+if args.om_alignments and len(aln_vects) > 1 and om_compare == "multiples":
+    logger.info("plotting %d path alignments side by side", len(aln_vects))
+    with prof.stage("plot_om_compare", alignments=len(aln_vects)):
+        aln_names = [os.path.basename(x) for x in args.AR_path_alignment]
+        plot_om_compare(aln_vects, aln_names, contig_placements, ref_placements, cycle, cycle_seg_placements,
+                        contig_cmap_vects, total_length, isCycle, args.label_segs, fname)
+
+prof.report(args.profile_json, args.profile_trace)
+logger.info("finished")
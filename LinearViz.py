@@ -2,22 +2,25 @@
 
 import argparse
 from collections import defaultdict
-import copy
 import os
+import sys
 
 import matplotlib
 matplotlib.use('Agg') #this import must happen immediately after importing matplotlib
 
 from matplotlib import pyplot as plt
 from matplotlib import rcParams
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import LineCollection, PatchCollection
 from matplotlib.font_manager import FontProperties
 import matplotlib.patches as mpatches
 import numpy as np
 
 from bionanoUtil import *
+from profileUtil import StageProfiler, count_artists
 import VizUtil as vu
 
+logger = vu.logger
+
 rcParams['font.family'] = 'sans-serif'
 rcParams['font.sans-serif'] = ['Arial']
 
@@ -61,27 +64,22 @@ def plot_bpg_connection(ref_placements, prev_seg_index_is_adj, bpg_dict, seg_end
 def plot_gene_track(currStart, currEnd, relGenes, pTup, total_length, seg_dir):
     global prev_start, alternate, alternated
     overlap_genes.append({})
-    for gObj in relGenes:
+    if not relGenes:
+        return
+
+    norm_starts, norm_ends = vu.map_to_segment([x.gstart for x in relGenes], [x.gend for x in relGenes], currStart,
+                                               pTup[1], pTup[2], seg_dir)
+    for gObj, normStart, normEnd in zip(relGenes, norm_starts.tolist(), norm_ends.tolist()):
         # e_posns is a list of tuples of exon (start,end)
         # these can be plotted similarly to how the coding region is marked
         gname, gstart, gend, e_posns = gObj.gname, gObj.gstart, gObj.gend, gObj.eposns
-        seg_len = pTup[2] - pTup[1]
-        if seg_dir == "+":
-            normStart = currStart + max(0, gstart - pTup[1])
-            normEnd = currStart + min(seg_len, gend - pTup[1])
-        else:
-            normEnd = currStart + min(seg_len, pTup[2] - gstart)
-            normStart = currStart + max(0, pTup[2] - gend)
-
         gene_to_locations[gname].append((normStart, normEnd))
         box_len = normEnd - normStart
         # patches.append(mpatches.Wedge((0,0), seg_bar_height, start_angle, end_angle, width=bar_width/2.0))
-        print(gname, "GBH",gene_bar_height,"BW",bar_width)
         patches.append(mpatches.Rectangle((normStart, gene_bar_height + bar_width), box_len, 0.6 * bar_width))
         f_color_v.append('k')
         e_color_v.append('k')
         lw_v.append(0)
-        print(total_length, bar_width)
         # TODO:
         # draw some arrows over the black box
         # but first draw a white line in the box
@@ -134,7 +132,6 @@ def plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status,
     font0 = FontProperties()
     p_end = 0
     for ind, refObj in ref_placements.items():
-        print(ind,refObj.to_string(),ref_bar_height)
         seg_coord_tup = segSeqD[path[ind][0]]
         # print(refObj.to_string())
         # start_angle, end_angle = start_end_angle(refObj.abs_end_pos,refObj.abs_start_pos,total_length)
@@ -148,7 +145,7 @@ def plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status,
         try:
             f_color_v.append(chromosome_colors[chrom])
         except KeyError:
-            print("Color not found for " + chrom + ". Using red.")
+            logger.warning("Color not found for " + chrom + ". Using red.")
             chromosome_colors[chrom] = "red"
             f_color_v.append("red")
 
@@ -188,7 +185,7 @@ def plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status,
 
         p_end = refObj.abs_end_pos
         # gene_tree = vu.parse_genes(seg_coord_tup[0], args.ref)
-        relGenes = vu.rel_genes(gene_tree, seg_coord_tup, copy.copy(onco_set))
+        relGenes = vu.rel_genes(gene_tree, seg_coord_tup, onco_set)
 
         # plot the gene track
         plot_gene_track(refObj.abs_start_pos, refObj.abs_end_pos, relGenes, seg_coord_tup, total_length, path[ind][1])
@@ -217,9 +214,10 @@ def plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status,
 # plot cmap track
 def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_id_labels=False):
     path_label_locs = defaultdict(list)
+    label_segs = []
+    linewidth = min(0.5 * 2000000 / total_length, 0.5)
     for ind, segObj in seg_placements.items():
         bar_height = unadj_bar_height + segObj.track_height_shift
-        print("cmap_plot", segObj.id)
         # print "cmap plotting abs end pos are"
         # print segObj.abs_start_pos, segObj.abs_end_pos
         box_len = segObj.abs_end_pos - segObj.abs_start_pos
@@ -230,14 +228,11 @@ def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_i
         e_color_v.append('k')
         lw_v.append(0)
 
-        linewidth = min(0.5 * 2000000 / total_length, 0.5)
         # Draw the labels in the box
-        for i in segObj.label_posns:
-            if i > segObj.abs_end_pos or i < segObj.abs_start_pos:
-                continue
-
-            y_i, y_f = bar_height, bar_height + bar_width
-            ax.plot([i, i], [y_i, y_f], color='k', alpha=0.9, linewidth=linewidth)
+        l_posns = segObj.label_posns
+        l_posns = l_posns[(l_posns <= segObj.abs_end_pos) & (l_posns >= segObj.abs_start_pos)]
+        y_i, y_f = np.full(len(l_posns), bar_height), np.full(len(l_posns), bar_height + bar_width)
+        label_segs.extend(np.stack([np.column_stack([l_posns, y_i]), np.column_stack([l_posns, y_f])], axis=1))
 
         # TODO: fix for dense packing
         if seg_id_labels:
@@ -245,23 +240,35 @@ def plot_cmap_track(seg_placements, total_length, unadj_bar_height, color, seg_i
             text = segObj.id + segObj.direction
             ax.text(mid_sp, bar_height + 1.1 * bar_width, text, color='grey', fontsize=9, ha="center")
 
+    if label_segs:
+        ax.add_collection(LineCollection(label_segs, colors='k', alpha=0.9, linewidths=linewidth,
+                                         capstyle='projecting', zorder=2))
+
     return path_label_locs
 
 
+# place the contigs of a path alignment on the segments. Returns the contig placements and the list of contig ids.
+def place_om_contigs(aln_vect, seg_placements, contig_cmap_vects, total_length, isCycle):
+    with prof.stage("place_contigs_and_labels"):
+        contig_placements, contig_list = vu.place_contigs_and_labels(seg_placements, aln_vect, total_length,
+                                                                     contig_cmap_vects, isCycle, True, segSeqD)
+        vu.decide_trim_contigs(contig_cmap_vects, contig_placements, total_length)
+
+    return contig_placements, contig_list
+
+
 # plot the connecting lines for the bionano track
-def plot_alignment(contig_locs, segment_locs, total_length):
+def plot_alignment(aln_vect, contig_locs, segment_locs, total_length):
     linewidth = min(0.5 * 2000000 / total_length, 0.5)
-    print("linewidth", linewidth, total_length)
-    for a_d in aln_vect:
-        c_id = a_d["contig_id"]
-        c_num_dir = int(a_d["contig_dir"] + "1")
-        contig_label_vect = contig_locs[c_id].label_posns
-        seg_label_vect = segment_locs[a_d["seg_aln_number"]].label_posns
-        clx = contig_label_vect[a_d["contig_label"] - 1]
-        slx = seg_label_vect[a_d["seg_label"] - 1]
-        # contig_top = seg_bar_height + contig_bar_height + contig_locs[c_id].track_height_shift + bar_width
-        contig_bottom = seg_bar_height + contig_bar_height + contig_locs[c_id].track_height_shift
-        ax.plot([slx, clx], [seg_bar_height + bar_width, contig_bottom], color="grey", linewidth=linewidth)
+    logger.debug("alignment linewidth %s", linewidth)
+    if not len(aln_vect):
+        return
+
+    clx, slx, contig_bottom = vu.alignment_label_posns(aln_vect, contig_locs, segment_locs)
+    contig_bottom += seg_bar_height + contig_bar_height
+    seg_top = np.full(len(slx), seg_bar_height + bar_width)
+    aln_segs = np.stack([np.column_stack([slx, seg_top]), np.column_stack([clx, contig_bottom])], axis=1)
+    ax.add_collection(LineCollection(aln_segs, colors="grey", linewidths=linewidth, capstyle='projecting', zorder=2))
 
 
 def construct_path_ref_placements(path, segSeqD, raw_path_length, prev_seg_index_is_adj, next_seg_index_is_adj,
@@ -270,26 +277,46 @@ def construct_path_ref_placements(path, segSeqD, raw_path_length, prev_seg_index
         aln_vect = []
 
     spacing_bp = seg_spacing * raw_path_length
-    path_ref_placements = {}
-    curr_start = 0.0
-    for ind, i in enumerate(path):
-        seg_id_count = cycle_seg_counts[i[0]]
-        seg_len = segSeqD[i[0]][2] - segSeqD[i[0]][1]
-        seg_end = curr_start + seg_len
-        padj, nadj = prev_seg_index_is_adj[ind], next_seg_index_is_adj[ind]
-        curr_obj = vu.CycleVizElemObj(i[0], segSeqD[i[0]][0], segSeqD[i[0]][1], segSeqD[i[0]][2], i[1], curr_start,
-                                      seg_end, seg_id_count, padj, nadj)
-
-        path_ref_placements[ind] = curr_obj
-        next_start = seg_end
-        mod_ind = (ind + 1) % (len(prev_seg_index_is_adj))
-        if not prev_seg_index_is_adj[mod_ind]:
-            next_start += spacing_bp
-
-        curr_start = next_start
-
-    total_length = next_start
-    return path_ref_placements, total_length
+    return vu.construct_ref_placements(path, segSeqD, spacing_bp, prev_seg_index_is_adj, next_seg_index_is_adj,
+                                       cycle_seg_counts)
+
+
+# one panel per path alignment with the segment track, contigs and alignment lines, stacked in one column. The first
+# panel reuses the contig placements of the main figure. The panels are drawn on their own figure, with the global
+# axes and patch lists restored afterwards.
+def plot_om_compare(aln_vects, aln_names, first_placements, path_seg_placements, contig_cmap_vects, total_length,
+                    isCycle, fname):
+    global fig, ax, patches, f_color_v, e_color_v, lw_v
+    saved = fig, ax, patches, f_color_v, e_color_v, lw_v
+    fig, axes = plt.subplots(len(aln_vects), 1, figsize=(10, 2.5 * len(aln_vects)), squeeze=False)
+    for p_ind, ax in enumerate(axes.flat):
+        patches, f_color_v, e_color_v, lw_v = [], [], [], []
+        plot_cmap_track(path_seg_placements, total_length, seg_bar_height + segment_bar_height, "darkorange")
+        if p_ind == 0:
+            p_contig_placements = first_placements
+        else:
+            p_contig_placements, p_contig_list = place_om_contigs(aln_vects[p_ind], path_seg_placements,
+                                                                  contig_cmap_vects, total_length, isCycle)
+            vu.set_contig_height_shifts(p_contig_placements, p_contig_list, -bar_width)
+
+        plot_cmap_track(p_contig_placements, total_length, seg_bar_height + contig_bar_height, "cornflowerblue",
+                        seg_id_labels=True)
+        plot_alignment(aln_vects[p_ind], p_contig_placements, path_seg_placements, total_length)
+        p = PatchCollection(patches)
+        p.set_facecolor(f_color_v)
+        p.set_edgecolor(e_color_v)
+        p.set_linewidth(lw_v)
+        ax.add_collection(p)
+        ax.autoscale_view()
+        ax.set_aspect(1.0)
+        ax.set_axis_off()
+        ax.set_title(aln_names[p_ind], fontsize=9)
+
+    fig.tight_layout()
+    fig.savefig(fname + '_om_compare.png', dpi=300)
+    fig.savefig(fname + '_om_compare.pdf', format='pdf')
+    plt.close(fig)
+    fig, ax, patches, f_color_v, e_color_v, lw_v = saved
 
 
 parser = argparse.ArgumentParser(description="Linear visualizations of AA & AR output")
@@ -302,7 +329,11 @@ parser.add_argument("-c", "--contigs", help="contig cmap file")
 parser.add_argument("--ref", help="reference genome", choices=["hg19", "hg38", "GRCh37", "GRCh38"], default="hg19")
 parser.add_argument("--cycles_file", help="AA/AR cycles-formatted input file", required=True)
 parser.add_argument("--path", help="path number to visualize", required=True)
-parser.add_argument("--AR_path_alignment", help="AR path alignment file")
+parser.add_argument("--AR_path_alignment", help="AR path alignment file. Give several to compare them (see "
+                    "--om_compare)", nargs="+")
+parser.add_argument("--om_compare", help="How to show several path alignments: 'multiples' draws the first in the main "
+                    "figure and each in its own panel in [outname]_om_compare, 'stacked' draws the contigs of each "
+                    "in rows above the previous one", choices=["multiples", "stacked"], default="multiples")
 parser.add_argument("--outname", help="output prefix")
 parser.add_argument("--label_segs", help="label segs with graph IDs", choices=["id", "dir"], default="id")
 parser.add_argument("--reduce_path", help="Number of path elements to remove from left and right ends. Must supply both values, \
@@ -314,12 +345,20 @@ group2 = parser.add_mutually_exclusive_group(required=False)
 group2.add_argument("--gene_subset_file", help="File containing subset of genes to plot (e.g. oncogene genelist file)",
                     default="")
 group2.add_argument("--gene_subset_list", help="List of genes to plot (e.g. MYC PVT1)", nargs="+", type=str)
+parser.add_argument("--profile", help="Report wall/CPU time, peak memory, artist count and input sizes of each stage",
+                    action='store_true', default=False)
+parser.add_argument("--profile_json", help="Write the --profile report to this JSON file", type=str, default="")
+parser.add_argument("--profile_trace", help="Write the --profile report to this Chrome trace (chrome://tracing) file",
+                    type=str, default="")
+parser.add_argument("--log_level", help="Verbosity of messages printed while running (default WARNING)",
+                    choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper, default="WARNING")
 
 
 # ----------------------
 # handle arguments
 
 args = parser.parse_args()
+vu.setup_logging(args.log_level)
 if args.ref == "GRCh38":
     args.ref = "hg38"
 
@@ -332,38 +371,43 @@ if outdir and not os.path.exists(outdir):
 
 fname = args.outname + "_path_" + args.path + "_trim_" + str(args.reduce_path[0]) + "_" + str(args.reduce_path[1])
 
-print(args.reduce_path)
+prof = StageProfiler(args.profile or bool(args.profile_json) or bool(args.profile_trace))
+logger.info("Reading genes")
+with prof.stage("parse_genes"):
+    gene_tree = vu.parse_genes(args.ref, [])
 
-print("Reading genes")
-gene_tree = vu.parse_genes(args.ref, [])
-
-print("Unaligned fraction cutoff set to " + str(vu.unaligned_cutoff_frac))
+logger.info("Unaligned fraction cutoff set to " + str(vu.unaligned_cutoff_frac))
 
 chromosome_colors = vu.get_chr_colors()
 plt.clf()
 fig, ax = plt.subplots(figsize=(10, 6))
+prof.fig = fig
 patches = []
 f_color_v = []
 e_color_v = []
 lw_v = []
 
-paths, segSeqD, circular_D = vu.parse_cycles_file(args.cycles_file)
+with prof.stage("parse_cycles_file"):
+    paths, segSeqD, circular_D = vu.parse_cycles_file(args.cycles_file)
+
 path_num = args.path
 path = paths[path_num]
+prof.set_size("segments", len(segSeqD))
+prof.set_size("path_length", len(path))
 
 if args.reduce_path != [0, 0]:
     isCycle = False
 else:
     isCycle = circular_D[path_num]
 
-prev_seg_index_is_adj = vu.adjacent_segs(path, segSeqD, isCycle)
-print(path)
-print("PSIIA", prev_seg_index_is_adj)
+prev_seg_index_is_adj, next_seg_index_is_adj = vu.adjacent_segs(path, segSeqD, isCycle)
+logger.debug("path %s, previous segment adjacency %s", path, prev_seg_index_is_adj)
 raw_path_length = vu.get_raw_path_length(path, segSeqD)
 
 bpg_dict, seg_end_pos_d = {}, {}
 if args.graph:
-    bpg_dict, seg_end_pos_d = vu.parse_BPG(args.graph)
+    with prof.stage("parse_BPG"):
+        bpg_dict, seg_end_pos_d = vu.parse_BPG(args.graph)
 
 gene_set = set()
 
@@ -387,8 +431,10 @@ if not args.om_alignments:
 
     prev_seg_index_is_adj, next_seg_index_is_adj = vu.adjacent_segs(path, segSeqD, isCycle)
     cycle_seg_counts = vu.get_seg_amplicon_count(path)
-    ref_placements, total_length = construct_path_ref_placements(path, segSeqD, raw_path_length, prev_seg_index_is_adj,
-                                                                 next_seg_index_is_adj, cycle_seg_counts)
+    with prof.stage("construct_path_ref_placements", segments=len(path)):
+        ref_placements, total_length = construct_path_ref_placements(path, segSeqD, raw_path_length,
+                                                                     prev_seg_index_is_adj, next_seg_index_is_adj,
+                                                                     cycle_seg_counts)
 
     imputed_status = [False] * len(path)
     # set heights
@@ -410,30 +456,45 @@ if not args.om_alignments:
     ax.plot(0,seg_bar_height + contig_bar_height, color='white', markersize=10)
 
 else:
-    seg_cmaps = parse_cmap(args.om_segs, True)
-    seg_cmap_vects = vectorize_cmaps(seg_cmaps)
-    seg_cmap_lens = get_cmap_lens(args.om_segs)
-    aln_vect, meta_dict = vu.parse_alnfile(args.AR_path_alignment)
+    with prof.stage("parse_om_segs"):
+        seg_cmap_vects, seg_cmap_lens = parse_cmap_vects(args.om_segs, True)
+
+    with prof.stage("parse_alnfile") as st:
+        aln_vects = [vu.parse_alnfile(x)[0] for x in args.AR_path_alignment]
+        st["rows"] = sum(len(x) for x in aln_vects)
+
     if args.reduce_path != [0, 0]:
-        # reduce alignments
-        path, prev_seg_index_is_adj, aln_vect = vu.reduce_path(path, prev_seg_index_is_adj, args.reduce_path, aln_vect)
+        # reduce alignments. reduce_path copies the path, so every alignment is reduced from the full one.
+        full_path, full_prev_seg_index_is_adj = path, prev_seg_index_is_adj
+        for a_ind, x in enumerate(aln_vects):
+            path, prev_seg_index_is_adj, aln_vects[a_ind] = vu.reduce_path(full_path, full_prev_seg_index_is_adj,
+                                                                           args.reduce_path, x)
+
+    aln_vect = aln_vects[0]
+    segdup_status = [vu.check_segdup(x, path, isCycle) for x in aln_vects]
+    is_segdup = segdup_status[0][0]
+    if any(x[0] != is_segdup for x in segdup_status):
+        logger.error("Path alignments disagree on whether the path is a simple segdup and cannot be compared")
+        sys.exit(1)
 
-    is_segdup, split_ind = vu.check_segdup(aln_vect, path, isCycle)
     if is_segdup:
-        print("alignment shows simple segdup")
+        logger.info("alignment shows simple segdup")
         path = [path[0]] * 2
-        print(path)
         isCycle = False
         prev_seg_index_is_adj = [False, True]
-        for a_ind in range(split_ind, len(aln_vect)):
-            aln_vect[a_ind]["seg_aln_number"] = 1
+        for x, (_, split_ind) in zip(aln_vects, segdup_status):
+            for a_ind in range(split_ind, len(x)):
+                x[a_ind]["seg_aln_number"] = 1
 
     prev_seg_index_is_adj, next_seg_index_is_adj = vu.adjacent_segs(path, segSeqD, isCycle)
     cycle_seg_counts = vu.get_seg_amplicon_count(path)
-    ref_placements, total_length = construct_path_ref_placements(path, segSeqD, raw_path_length, prev_seg_index_is_adj,
-                                                                 next_seg_index_is_adj, cycle_seg_counts)
+    with prof.stage("construct_path_ref_placements", segments=len(path)):
+        ref_placements, total_length = construct_path_ref_placements(path, segSeqD, raw_path_length,
+                                                                     prev_seg_index_is_adj, next_seg_index_is_adj,
+                                                                     cycle_seg_counts)
 
-    path_seg_placements = vu.place_path_segs_and_labels(path, ref_placements, seg_cmap_vects)
+    with prof.stage("place_path_segs_and_labels"):
+        path_seg_placements = vu.place_path_segs_and_labels(path, ref_placements, seg_cmap_vects)
 
     # set heights
     # this is same as non-om version, but total length is different, thus bar_width is different
@@ -452,40 +513,51 @@ else:
     gene_bar_height = seg_bar_height - bar_width * bar_drop_prop + 0.7*bar_width
     ref_bar_height = seg_bar_height - (bar_width * 1.5 * bar_drop_prop) - 0.7*bar_width
 
-    contig_cmaps = parse_cmap(args.contigs, True)
-    contig_cmap_vects = vectorize_cmaps(contig_cmaps)
+    with prof.stage("parse_contigs") as st:
+        contig_cmap_vects, contig_cmap_lens = parse_cmap_vects(args.contigs, True)
+        st["contigs"] = len(contig_cmap_vects)
 
     ###
     # TODO: TRIM REF SEGS
     ###
 
-    contig_cmap_lens = get_cmap_lens(args.contigs)
-    # path_seg_placements,aln_vect,total_length,contig_cmap_vects
-    contig_placements, contig_list = vu.place_contigs_and_labels(path_seg_placements, aln_vect, total_length,
-                                                                 contig_cmap_vects, isCycle, True, segSeqD)
-    vu.decide_trim_contigs(contig_cmap_vects, contig_placements, total_length)
+    # place contigs. In stacked mode the contigs of each further alignment go in rows above the previous ones.
+    n_stacks = len(aln_vects) if args.om_compare == "stacked" else 1
+    stacks = [place_om_contigs(aln_vects[stack], path_seg_placements, contig_cmap_vects, total_length, isCycle)
+              for stack in range(n_stacks)]
+    contig_placements = stacks[0][0]
 
     # plot segs cmap
-    print("SH", seg_bar_height + segment_bar_height)
-    print("CH", seg_bar_height + contig_bar_height)
-    plot_cmap_track(path_seg_placements, total_length, seg_bar_height + segment_bar_height, "darkorange")
+    with prof.stage("plot_cmap_track_segs"):
+        plot_cmap_track(path_seg_placements, total_length, seg_bar_height + segment_bar_height, "darkorange")
+
+    # check overlaps of contigs and adjust heights accordingly, then plot contigs cmap
+    n_contig_rows = 0
+    for stack_placements, stack_list in stacks:
+        contig_base = seg_bar_height + contig_bar_height + n_contig_rows * vu.contig_row_shift * bar_width
+        rows = vu.set_contig_height_shifts(stack_placements, stack_list, -bar_width)
+        with prof.stage("plot_cmap_track_contigs", contigs=len(stack_placements)):
+            plot_cmap_track(stack_placements, total_length, contig_base, "cornflowerblue", seg_id_labels=True)
 
-    # check overlaps of contigs and adjust heights accordingly
-    contig_height_shifts = vu.set_contig_height_shifts(contig_placements, contig_list, -bar_width)
-    # plot contigs cmap
-    plot_cmap_track(contig_placements, total_length, seg_bar_height + contig_bar_height, "cornflowerblue",
-                    seg_id_labels=True)
+        n_contig_rows += rows
+
+    if n_stacks > 1:
+        stack_names = [os.path.splitext(os.path.basename(x))[0] for x in args.AR_path_alignment]
+        ax.text(0, seg_bar_height + contig_bar_height + (n_contig_rows + 0.5) * vu.contig_row_shift * bar_width,
+                "contig rows, bottom to top:\n" + "\n".join(stack_names), color='grey', fontsize=9, va='bottom')
 
     # plot alignments
-    plot_alignment(contig_placements, path_seg_placements, total_length)
+    with prof.stage("plot_alignment", rows=len(aln_vect)):
+        plot_alignment(aln_vect, contig_placements, path_seg_placements, total_length)
 
     imputed_status = vu.imputed_status_from_aln(aln_vect, len(path))
 
-print("RH", ref_bar_height, "BW", bar_width)
-plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status, args.label_segs, gene_set)
+with prof.stage("plot_ref_genome", segments=len(ref_placements)):
+    plot_ref_genome(ref_placements, path, total_length, segSeqD, imputed_status, args.label_segs, gene_set)
 
 if args.graph:
-    plot_bpg_connection(ref_placements, prev_seg_index_is_adj, bpg_dict, seg_end_pos_d)
+    with prof.stage("plot_bpg_connection"):
+        plot_bpg_connection(ref_placements, prev_seg_index_is_adj, bpg_dict, seg_end_pos_d)
 
 #ax.set_xlim(-(seg_bar_height+1.25), (seg_bar_height+1.25))
 #ax.set_ylim(-(seg_bar_height+1.25), (seg_bar_height+1.25))
@@ -510,8 +582,22 @@ p.set_linewidth(lw_v)
 ax.add_collection(p)
 ax.set_aspect(1.0)
 plt.axis('off')
-plt.savefig(fname + '.png', dpi=600)
-plt.savefig(fname + '.pdf', format='pdf')
+prof.set_size("artists", count_artists(fig))
+prof.set_size("patches", len(patches))
+with prof.stage("savefig_png"):
+    plt.savefig(fname + '.png', dpi=600)
+with prof.stage("savefig_pdf"):
+    plt.savefig(fname + '.pdf', format='pdf')
 
 plt.close()
-print("finished")
\ No newline at end of file
+
+# one panel per path alignment
+if args.om_alignments and len(aln_vects) > 1 and args.om_compare == "multiples":
+    logger.info("plotting %d path alignments one above the other", len(aln_vects))
+    with prof.stage("plot_om_compare", alignments=len(aln_vects)):
+        aln_names = [os.path.basename(x) for x in args.AR_path_alignment]
+        plot_om_compare(aln_vects, aln_names, contig_placements, path_seg_placements, contig_cmap_vects, total_length,
+                        isCycle, fname)
+
+prof.report(args.profile_json, args.profile_trace)
+logger.info("finished")
\ No newline at end of file
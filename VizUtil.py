@@ -1,19 +1,49 @@
+from ast import literal_eval
 import bisect
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import copy
+import heapq
+import logging
 import os
 import sys
 
 from intervaltree import IntervalTree
 import matplotlib
 from matplotlib import pyplot as plt
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba
+from matplotlib.path import Path
+from matplotlib.transforms import IdentityTransform
 import numpy as np
 import yaml
 
 matplotlib.use('Agg')
 
+logger = logging.getLogger("CycleViz")
+
 contig_spacing = 1. / 100
 unaligned_cutoff_frac = 1. / 60
+# height between rows of overlapping contigs
+contig_row_shift = 1.5
+# structures spanning at least this much reference sequence are drawn in genome overview mode (when set to 'auto')
+genome_overview_min_length = 100000000
+# number of bins around the plot used to aggregate genes and feature tracks in genome overview mode
+overview_gene_bins = 720
+overview_track_bins = 5000
+# largest distance, in output pixels, between a sampled arc and the true circle
+arc_tolerance_px = 0.1
+
+
+# configure the log level shared by CycleViz, LinearViz and the util modules. Default is quiet (warnings and errors).
+def setup_logging(level="WARNING"):
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+    logger.setLevel(getattr(logging, level.upper()))
+
+
+# log a summary of events that were counted inside a loop, instead of logging each one
+def log_counts(counts, message, level=logging.INFO):
+    if counts and logger.isEnabledFor(level):
+        logger.log(level, message + ": " + ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items())))
 
 
 def cart2pol(x, y):
@@ -68,7 +98,9 @@ class CycleVizElemObj(object):
         self.cmap_vect = cmap_vect
         self.aln_lab_ends = (None, None)
         self.aln_bound_posns = (None, None)
-        self.label_posns = []
+        self.label_posns = np.zeros(0)
+        # the start position label_posns were placed from, which trimming the map ends does not move
+        self.label_origin = s
         self.track_height_shift = 0
         self.start_trim = False
         self.end_trim = False
@@ -88,8 +120,9 @@ class CycleVizElemObj(object):
                 self.abs_end_pos = self.aln_bound_posns[1] + self.scaling_factor * (
                         self.cmap_vect[-1] - self.cmap_vect[self.aln_lab_ends[1] - 1])
 
-            for i in self.cmap_vect[:-1]:
-                self.label_posns.append(self.scaling_factor * i + self.abs_start_pos)
+            cmap_vect = np.asarray(self.cmap_vect, dtype=float)
+            self.label_posns = self.scaling_factor * cmap_vect[:-1] + self.abs_start_pos
+            self.label_origin = self.abs_start_pos
 
         else:
             if self.abs_start_pos is None:
@@ -100,11 +133,10 @@ class CycleVizElemObj(object):
                 self.abs_end_pos = self.aln_bound_posns[1] + self.scaling_factor * self.cmap_vect[
                     self.aln_lab_ends[0] - 1]
 
-            rev_cmap_vect = [self.cmap_vect[-1] - x for x in self.cmap_vect[::-1][1:]]  # does not include length value
-            for i in rev_cmap_vect:
-                self.label_posns.append(self.scaling_factor * i + self.abs_start_pos)
-
-            self.label_posns = self.label_posns[::-1]
+            # label positions measured from the end of the map, in the forward label order (without the length value)
+            cmap_vect = np.asarray(self.cmap_vect, dtype=float)
+            self.label_posns = self.scaling_factor * (cmap_vect[-1] - cmap_vect[:-1]) + self.abs_start_pos
+            self.label_origin = self.abs_start_pos
 
     def to_string(self):
         return "{}{} | Start: {} | End: {} | scaling {}".format(self.id, self.direction, self.chrom,
@@ -117,27 +149,195 @@ class CycleVizElemObj(object):
         # overhang should go to 1/3 of the unaligned cutoff threshold
         if self.start_trim:
             p_abs_start = self.abs_start_pos
-            print("DOING s TRIM on " + self.id)
             self.abs_start_pos = self.aln_bound_posns[0] - unaligned_cutoff_frac * total_length / 4.
             if self.direction == "-":
                 self.update_label_posns(p_abs_start - self.abs_start_pos)
-            print("now", self.abs_start_pos)
+            logger.debug("trimmed start of %s: %s -> %s", self.id, p_abs_start, self.abs_start_pos)
 
         if self.end_trim:
             p_abs_end = self.abs_end_pos
-            print("DOING e TRIM on " + self.id)
-            print(self.aln_bound_posns)
             self.abs_end_pos = self.aln_bound_posns[-1] + unaligned_cutoff_frac * total_length / 4.
             if self.direction == "-":
                 self.update_label_posns(p_abs_end - self.abs_end_pos)
 
-            print("now", self.abs_end_pos)
+            logger.debug("trimmed end of %s: %s -> %s (aligned bounds %s)", self.id, p_abs_end, self.abs_end_pos,
+                         self.aln_bound_posns)
 
     # update label positions after trimming contigs
     def update_label_posns(self, s_diff):
-        print("diff", s_diff)
-        for ind in range(len(self.label_posns)):
-            self.label_posns[ind] -= s_diff
+        self.label_posns = self.label_posns - s_diff
+        self.label_origin -= s_diff
+
+
+# Table of the reference segment placements. It can be used like the {index: CycleVizElemObj} dict it replaces
+# (items, values, keys, [], len), with each row still available as its CycleVizElemObj. The placement coordinates are
+# also kept as numpy columns so that whole arrays of features can be mapped onto the plot at once.
+class PlacementTable(object):
+    def __init__(self, objs=None):
+        self.objs = list(objs) if objs else []
+        self.refresh()
+
+    # rebuild the columns from the row objects. Needed only if the objects' coordinates are changed.
+    def refresh(self):
+        objs = self.objs
+        self.chrom_names = sorted(set(x.chrom for x in objs))
+        chrom_ids = dict((c, i) for i, c in enumerate(self.chrom_names))
+        self.chrom_id = np.array([chrom_ids[x.chrom] for x in objs], dtype=int)
+        self.ref_start = np.array([x.ref_start for x in objs], dtype=float)
+        self.ref_end = np.array([x.ref_end for x in objs], dtype=float)
+        self.direction = np.array([1 if x.direction == "+" else -1 for x in objs], dtype=int)
+        self.abs_start = np.array([x.abs_start_pos for x in objs], dtype=float)
+        self.abs_end = np.array([x.abs_end_pos for x in objs], dtype=float)
+        self.seg_count = np.array([x.seg_count for x in objs], dtype=int)
+        self.prev_adj = np.array([bool(x.prev_is_adjacent) for x in objs], dtype=bool)
+        self.next_adj = np.array([bool(x.next_is_adjacent) for x in objs], dtype=bool)
+
+    # indices of the rows placed from a chromosome
+    def chrom_rows(self, chrom):
+        if chrom not in self.chrom_names:
+            return np.array([], dtype=int)
+
+        return np.flatnonzero(self.chrom_id == self.chrom_names.index(chrom))
+
+    def ref_length(self):
+        return float(np.sum(self.ref_end - self.ref_start))
+
+    def __getitem__(self, ind):
+        return self.objs[ind]
+
+    def __len__(self):
+        return len(self.objs)
+
+    def __iter__(self):
+        return iter(range(len(self.objs)))
+
+    def keys(self):
+        return list(range(len(self.objs)))
+
+    def values(self):
+        return list(self.objs)
+
+    def items(self):
+        return list(enumerate(self.objs))
+
+
+# lay the segments of a cycle or path end to end, leaving spacing_bp between segments not adjacent in the reference.
+# returns the PlacementTable and the total length of the layout.
+def construct_ref_placements(path, segSeqD, spacing_bp, prev_seg_index_is_adj, next_seg_index_is_adj, seg_counts,
+                             first_start=0.0):
+    n_adj = len(prev_seg_index_is_adj)
+    seg_lens = [segSeqD[i[0]][2] - segSeqD[i[0]][1] for i in path]
+    gaps = [0 if prev_seg_index_is_adj[(ind + 1) % n_adj] else spacing_bp for ind in range(len(path))]
+    # running sum over first_start, len_0, gap_0, len_1, gap_1, ... gives the segment starts and ends
+    steps = np.empty(2 * len(path) + 1)
+    steps[0] = first_start
+    steps[1::2] = seg_lens
+    steps[2::2] = gaps
+    bounds = np.cumsum(steps)
+    starts, ends = bounds[:-1:2].tolist(), bounds[1::2].tolist()
+
+    objs = []
+    for ind, i in enumerate(path):
+        chrom, ref_start, ref_end = segSeqD[i[0]]
+        objs.append(CycleVizElemObj(i[0], chrom, ref_start, ref_end, i[1], starts[ind], ends[ind], seg_counts[i[0]],
+                                    prev_seg_index_is_adj[ind], next_seg_index_is_adj[ind]))
+
+    return PlacementTable(objs), bounds[-1].item()
+
+
+# Mapping of genomic coordinates onto the plot. On a '+' segment a position x lands at abs_start + (x - ref_start), on a
+# '-' segment at abs_start + (ref_end - x).
+
+# offsets of intervals from the start of a placed segment, in the segment's direction, clipped to [lo, seg_len].
+# Returns arrays (offset_starts, offset_ends).
+def segment_offsets(starts, ends, ref_start, ref_end, direction, lo=0):
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    seg_len = ref_end - ref_start
+    if direction == "+":
+        return np.maximum(lo, starts - ref_start), np.minimum(seg_len, ends - ref_start)
+
+    return np.maximum(lo, ref_end - ends), np.minimum(seg_len, ref_end - starts)
+
+
+# plot coordinates of intervals on a placed segment, clipped to the segment. Returns arrays (norm_starts, norm_ends).
+def map_to_segment(starts, ends, abs_start, ref_start, ref_end, direction, lo=0):
+    ts, te = segment_offsets(starts, ends, ref_start, ref_end, direction, lo)
+    return abs_start + ts, abs_start + te
+
+
+# plot coordinates of single positions on a placed segment (not clipped)
+def map_points_to_segment(posns, abs_start, ref_start, ref_end, direction):
+    posns = np.asarray(posns, dtype=float)
+    if direction == "+":
+        return abs_start + posns - ref_start
+
+    return abs_start + ref_end - posns
+
+
+# expand per-query index ranges [lo, hi) into arrays of (query index, position) pairs
+def _range_pairs(lo, hi):
+    counts = np.maximum(hi - lo, 0)
+    q_inds = np.repeat(np.arange(len(lo)), counts)
+    posns = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+    return q_inds, posns
+
+
+# (interval index, segment index) candidate hits of intervals on segments sorted by start, where no segment is longer
+# than max_len
+def _segment_hits(rs, re, fs, fe, mode):
+    max_len = np.max(re - rs)
+    if mode == "endpoint":
+        hit_keys = []
+        for pts in [fs, fe]:
+            q, pos = _range_pairs(np.searchsorted(rs, pts - max_len, 'left'), np.searchsorted(rs, pts, 'right'))
+            keep = re[pos] >= pts[q]
+            hit_keys.append(q[keep] * len(rs) + pos[keep])
+
+        return np.divmod(np.unique(np.concatenate(hit_keys)), len(rs))
+
+    q, pos = _range_pairs(np.searchsorted(rs, fs - max_len, 'right'), np.searchsorted(rs, fe, 'left'))
+    keep = re[pos] > fs[q]
+    return q[keep], pos[keep]
+
+
+# Map intervals given as arrays of chrom, start and end onto every segment of a PlacementTable they hit. With
+# mode='overlap' an interval hits a segment it overlaps. With mode='endpoint' one of the interval's ends must lie in the
+# segment, as used for links and interior segments. An interval in a repeated segment gets one hit for each copy.
+# The segments of each chromosome are grouped by length in powers of two and sorted by start. Within a group no
+# segment is longer than twice the shortest, so the candidates for an interval found with two binary searches that miss
+# it all cover one nearby point. Their number is bounded by the depth of the segments there, even when the chromosome
+# also has a much longer segment.
+# Returns arrays of (interval index, table row, norm_starts, norm_ends), ordered by interval and then by row.
+def map_to_placements(table, chroms, starts, ends, mode="overlap", lo=0):
+    chroms = np.asarray(chroms)
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    f_inds, r_inds = [np.array([], dtype=int)], [np.array([], dtype=int)]
+    for chrom in set(chroms.tolist()):
+        rows = table.chrom_rows(chrom)
+        if len(rows) == 0:
+            continue
+
+        f_chrom = np.flatnonzero(chroms == chrom)
+        rows = rows[np.argsort(table.ref_start[rows], kind='stable')]
+        rs, re = table.ref_start[rows], table.ref_end[rows]
+        len_groups = np.floor(np.log2(np.maximum(re - rs, 1))).astype(int)
+        for g in np.unique(len_groups):
+            g_inds = np.flatnonzero(len_groups == g)
+            q, pos = _segment_hits(rs[g_inds], re[g_inds], starts[f_chrom], ends[f_chrom], mode)
+            f_inds.append(f_chrom[q])
+            r_inds.append(rows[g_inds[pos]])
+
+    f_inds, r_inds = np.concatenate(f_inds).astype(int), np.concatenate(r_inds).astype(int)
+    order = np.lexsort((r_inds, f_inds))
+    f_inds, r_inds = f_inds[order], r_inds[order]
+
+    rs, re = table.ref_start[r_inds], table.ref_end[r_inds]
+    is_fwd = table.direction[r_inds] == 1
+    s, e = starts[f_inds], ends[f_inds]
+    ts = np.where(is_fwd, np.maximum(lo, s - rs), np.maximum(lo, re - e))
+    te = np.where(is_fwd, np.minimum(re - rs, e - rs), np.minimum(re - rs, re - s))
+    abs_starts = table.abs_start[r_inds]
+    return f_inds, r_inds, abs_starts + ts, abs_starts + te
 
 
 # this stores the local properties of each gene's visualization
@@ -186,7 +386,9 @@ class gene_viz_instance(object):
 
         return s_ang, e_ang, sm, em, tm
 
-    def draw_marker_ends(self, gbh):
+    # add the start and end markers of the gene to marker_ends, as (marker, rotation, x, y, size).
+    # they are drawn together by draw_gene_marker_ends
+    def add_marker_ends(self, gbh, marker_ends):
         # iterate over gdrops and see how many times the gene appears.
         # self.gdrops = sorted(self.gdrops, key=lambda x: x[-1])
         if self.hasStart or self.hasEnd:
@@ -194,15 +396,224 @@ class gene_viz_instance(object):
 
             if self.hasStart:
                 x_m, y_m = pol2cart(gbh, (s_ang / 360 * 2 * np.pi))
-                t = matplotlib.markers.MarkerStyle(marker=sm)
-                t._transform = t.get_transform().rotate_deg(s_ang - 89)
-                plt.scatter(x_m, y_m, marker=t, s=15, color='silver',zorder=3,alpha=0.8)
+                marker_ends.append((sm, s_ang - 89, x_m, y_m, 15))
 
             if self.hasEnd:
                 x_m, y_m = pol2cart(gbh, (e_ang / 360 * 2 * np.pi))
-                t = matplotlib.markers.MarkerStyle(marker=em)
-                t._transform = t.get_transform().rotate_deg(e_ang - 91)
-                plt.scatter(x_m, y_m, marker=t, s=5, color='silver',zorder=3,alpha=0.8)
+                marker_ends.append((em, e_ang - 91, x_m, y_m, 5))
+
+
+# keyword for the transform of collection offsets, which matplotlib renamed from transOffset in 3.6
+def _offset_transform_kwarg(ax):
+    if hasattr(PathCollection, "set_offset_transform"):
+        return {"offset_transform": ax.transData}
+
+    return {"transOffset": ax.transData}
+
+
+# draw gene start and end markers (see gene_viz_instance.add_marker_ends) as one collection per marker shape. Each
+# marker gets its own copy of the marker path with the rotation applied, which is what a scatter with a rotated
+# MarkerStyle would draw.
+def draw_gene_marker_ends(ax, marker_ends, color='silver', alpha=0.8, zorder=3):
+    by_marker = defaultdict(list)
+    for m in marker_ends:
+        by_marker[m[0]].append(m[1:])
+
+    for marker, mlist in by_marker.items():
+        mstyle = matplotlib.markers.MarkerStyle(marker=marker)
+        base_path = mstyle.get_path().transformed(mstyle.get_transform())
+        paths = []
+        for rot in np.radians([x[0] for x in mlist]):
+            c, s = np.cos(rot), np.sin(rot)
+            paths.append(Path(base_path.vertices.dot([[c, s], [-s, c]]), base_path.codes))
+
+        coll = PathCollection(paths, sizes=[x[3] for x in mlist], offsets=[(x[1], x[2]) for x in mlist],
+                              facecolors=color, edgecolors=color, alpha=alpha, zorder=zorder,
+                              **_offset_transform_kwarg(ax))
+        coll.set_transform(IdentityTransform())
+        ax.add_collection(coll)
+
+
+# sample positions along an arc with n points, shared by all sectors sampled at that count
+_unit_arc_cache = {}
+
+
+def _unit_arc(n):
+    if n not in _unit_arc_cache:
+        _unit_arc_cache[n] = np.linspace(0, 1, n)
+
+    return _unit_arc_cache[n]
+
+
+# Vertices of annulus sectors, given arrays (or scalars) of inner radius, outer radius and start/end angle in degrees.
+# As with Wedge, the sector sweeps counter-clockwise from theta1 to theta2. The arcs are sampled so that the polygon is
+# within arc_tolerance_px of the circle when drawn at px_per_unit output pixels per data unit, and sectors with the same
+# sample count are computed together. Returns a list of (n, 2) vertex arrays, for a PolyCollection.
+def annulus_sectors(r_inner, r_outer, theta1, theta2, px_per_unit):
+    r_inner, r_outer, theta1, theta2 = np.broadcast_arrays(np.asarray(r_inner, dtype=float),
+                                                           np.asarray(r_outer, dtype=float),
+                                                           np.asarray(theta1, dtype=float),
+                                                           np.asarray(theta2, dtype=float))
+    r_inner, r_outer, theta1, theta2 = [np.atleast_1d(x) for x in (r_inner, r_outer, theta1, theta2)]
+    spans = np.mod(theta2 - theta1, 360)
+    spans[(spans == 0) & (theta2 != theta1)] = 360
+
+    # angular step keeping the sagitta of each chord under the tolerance
+    r_px = np.maximum(r_outer * px_per_unit, arc_tolerance_px)
+    steps = np.degrees(2 * np.arccos(1 - np.minimum(arc_tolerance_px / r_px, 1)))
+    n_points = np.maximum(2, np.ceil(spans / steps).astype(int) + 1)
+
+    verts = [None] * len(spans)
+    for n in np.unique(n_points).tolist():
+        inds = np.flatnonzero(n_points == n)
+        phis = np.radians(theta1[inds, None] + spans[inds, None] * _unit_arc(n)[None, :])
+        cos_phis, sin_phis = np.cos(phis), np.sin(phis)
+        outer = np.stack([r_outer[inds, None] * cos_phis, r_outer[inds, None] * sin_phis], axis=-1)
+        inner = np.stack([r_inner[inds, None] * cos_phis, r_inner[inds, None] * sin_phis], axis=-1)[:, ::-1]
+        for i, v in zip(inds.tolist(), np.concatenate([outer, inner], axis=1)):
+            verts[i] = v
+
+    return verts
+
+
+# Paths for links between pairs of plot intervals. A link with an interval end is drawn as a ribbon between the two
+# intervals, a link between two points (or any link, when midpoint is set and the A end is a point) is drawn as a
+# curve between the interval centers. Returns the list of Paths and a boolean array marking the ribbons.
+def link_paths(a_tups, b_tups, inner_rad, outer_rad, total_length, midpoint=False):
+    a, b = np.asarray(a_tups, dtype=float).reshape(-1, 2), np.asarray(b_tups, dtype=float).reshape(-1, 2)
+    acenter, bcenter = a.sum(axis=1) / 2.0, b.sum(axis=1) / 2.0
+    is_ribbon = (a[:, 0] - a[:, 1] != 0) | ((b[:, 0] - b[:, 1] != 0) & (not midpoint))
+
+    # ribbon control points: a0, am, a1, a1, b0, b0, bm, b1, b1, a0, a0, a0
+    r_locs = np.column_stack([a[:, 0], acenter, a[:, 1], a[:, 1], b[:, 0], b[:, 0], bcenter, b[:, 1], b[:, 1],
+                              a[:, 0], a[:, 0], a[:, 0]])
+    r_phis = r_locs * ((1.0 / total_length) * 2 * np.pi)
+    r_rads = np.array([outer_rad, outer_rad, outer_rad, inner_rad, inner_rad, outer_rad, outer_rad, outer_rad,
+                       inner_rad, inner_rad, outer_rad, outer_rad])
+    r_codes = [Path.MOVETO, Path.CURVE3, Path.CURVE3, Path.CURVE4, Path.CURVE4, Path.CURVE4, Path.CURVE3, Path.CURVE3,
+               Path.CURVE4, Path.CURVE4, Path.CURVE4, Path.CLOSEPOLY]
+
+    # curve control points: am, am, bm, bm
+    aphi, bphi = acenter / total_length * 2 * np.pi, bcenter / total_length * 2 * np.pi
+    c_phis = np.column_stack([aphi, aphi, bphi, bphi])
+    c_rads = np.array([outer_rad, inner_rad, inner_rad, outer_rad])
+    c_codes = [Path.MOVETO, Path.CURVE4, Path.CURVE4, Path.CURVE4]
+
+    r_verts = np.stack(pol2cart(r_rads, r_phis), axis=-1)
+    c_verts = np.stack(pol2cart(c_rads, c_phis), axis=-1)
+    paths = [Path(r_verts[i], r_codes) if ribbon else Path(c_verts[i], c_codes)
+             for i, ribbon in enumerate(is_ribbon.tolist())]
+    return paths, is_ribbon
+
+
+# Greedily pack intervals into rows so that intervals in a row are separated by at least gap. Intervals are taken by
+# start position, and each goes into the lowest numbered free row, which uses the fewest rows possible (greedy interval
+# graph coloring). With max_rows set, intervals finding no free row are dropped (row -1), which caps the depth of the
+# stack. If period is given, the intervals lie on a circle of that length and those running past its end wrap around to
+# its start. The wrapping intervals are given the first rows, and the other intervals avoid both of their ends.
+# Returns the array of rows, in the input order.
+def pack_rows(starts, ends, max_rows=None, gap=0.0, period=None):
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    rows = np.full(len(starts), -1, dtype=int)
+    active, free_rows = [], []
+    # start of the wrapping interval of a row, which takes the row again up to the end of the circle
+    wrap_starts = {}
+    n_rows = 0
+    if period is not None:
+        ends = np.mod(starts, period) + (ends - starts)
+        starts = np.mod(starts, period)
+
+    order = np.lexsort((ends, starts))
+    if period is not None:
+        wraps = ends[order] > period
+        for ind in order[wraps].tolist():
+            if max_rows is not None and n_rows >= max_rows:
+                break
+
+            rows[ind] = n_rows
+            wrap_starts[n_rows] = starts[ind]
+            heapq.heappush(active, (ends[ind] - period, n_rows))
+            n_rows += 1
+
+        order = order[~wraps]
+
+    for ind in order.tolist():
+        while active and active[0][0] + gap <= starts[ind]:
+            heapq.heappush(free_rows, heapq.heappop(active)[1])
+
+        # skip free rows whose wrapping interval comes back around before this interval ends
+        blocked = []
+        while free_rows and wrap_starts.get(free_rows[0], np.inf) < ends[ind] + gap:
+            blocked.append(heapq.heappop(free_rows))
+
+        row = None
+        if free_rows:
+            row = heapq.heappop(free_rows)
+        elif max_rows is None or n_rows < max_rows:
+            row = n_rows
+            n_rows += 1
+
+        for b in blocked:
+            heapq.heappush(free_rows, b)
+
+        if row is None:
+            continue
+
+        rows[ind] = row
+        heapq.heappush(active, (ends[ind], row))
+
+    return rows
+
+
+# Position along the aligned contig of positions on an aligned molecule, using the alignment's query and reference
+# bounds (from iter_xmap). Stretching between the two maps is corrected for.
+def molecule_to_contig_posns(posns, aln):
+    q_lo, q_hi = sorted([aln["QryStartPos"], aln["QryEndPos"]])
+    r_lo, r_hi = sorted([aln["RefStartPos"], aln["RefEndPos"]])
+    scale = (r_hi - r_lo) / (q_hi - q_lo) if q_hi > q_lo else 1.0
+    posns = np.asarray(posns, dtype=float)
+    if aln["Orientation"] == "+":
+        return r_lo + (posns - q_lo) * scale
+
+    return r_lo + (q_hi - posns) * scale
+
+
+# plot coordinates of positions on a placed contig, consistent with its label_posns (also when its ends are trimmed)
+def contig_to_plot_posns(posns, cObj):
+    posns = np.asarray(posns, dtype=float)
+    if cObj.direction == "+":
+        return cObj.label_origin + cObj.scaling_factor * posns
+
+    return cObj.label_origin + cObj.scaling_factor * (cObj.cmap_vect[-1] - posns)
+
+
+# Bundle links by binning both ends along the plot, summing the scores of the links joining each pair of bins. Bin
+# pairs are unordered. Returns arrays of (A bin, B bin, summed score, index of the highest scoring link in the pair).
+def aggregate_links(a_centers, b_centers, scores, bin_width):
+    a_bins = np.floor(np.asarray(a_centers, dtype=float) / bin_width).astype(int)
+    b_bins = np.floor(np.asarray(b_centers, dtype=float) / bin_width).astype(int)
+    scores = np.asarray(scores, dtype=float)
+    bin_pairs = np.column_stack([np.minimum(a_bins, b_bins), np.maximum(a_bins, b_bins)])
+    uniq_pairs, pair_inds = np.unique(bin_pairs, axis=0, return_inverse=True)
+    pair_inds = pair_inds.reshape(-1)
+    agg_scores = np.bincount(pair_inds, weights=scores, minlength=len(uniq_pairs))
+
+    # representative link of each pair, the highest scoring one
+    order = np.lexsort((-scores, pair_inds))
+    firsts = np.flatnonzero(np.r_[True, pair_inds[order][1:] != pair_inds[order][:-1]])
+    return uniq_pairs[:, 0], uniq_pairs[:, 1], agg_scores, order[firsts]
+
+
+# keep the links scoring at least min_score, and of those the top_n highest scoring. Link order is preserved.
+def select_links(links, min_score=None, top_n=None):
+    if min_score is not None:
+        links = [x for x in links if x.score >= min_score]
+
+    if top_n is not None and len(links) > top_n:
+        top_inds = set(sorted(range(len(links)), key=lambda i: -links[i].score)[:max(0, int(top_n))])
+        links = [x for i, x in enumerate(links) if i in top_inds]
+
+    return links
 
 
 # makes a gene object from parsed refGene data
@@ -213,11 +624,13 @@ class gene(object):
         self.gstart = gstart
         self.gend = gend
         self.gname = gdata[-4]
+        # LOC, LINC and MIR entries are not drawn as genes
+        self.is_other_feature = self.gname.startswith(("LOC", "LINC", "MIR"))
         self.strand = gdata[3]
         self.highlight_name = highlight_name
-        estarts = [int(x) for x in gdata[9].rsplit(",") if x]
-        eends = [int(x) for x in gdata[10].rsplit(",") if x]
-        self.eposns = zip(estarts, eends)
+        self.estarts = np.array([int(x) for x in gdata[9].rsplit(",") if x], dtype=int)
+        self.eends = np.array([int(x) for x in gdata[10].rsplit(",") if x], dtype=int)
+        self.eposns = list(zip(self.estarts.tolist(), self.eends.tolist()))
         self.gdrops = []
         self.gdrops_go_to_link = set()
 
@@ -362,18 +775,18 @@ def handle_struct_bed_data(struct_data):
     isCycle = True
     uind = 0
     for ind, i in enumerate(flatvals):
-        print(i)
         # 0 is chrom, 1 is index, 2 is start, 3 is end, 4 is tuple of datastuff
         # datastuff is strand, connected
         pt = (i[0], i[1], i[2])
-        if pt not in segSeqD.values():
+        cind = rev_segSeqD.get(pt)
+        if cind is None:
             uind += 1
-            segSeqD[uind] = pt
-            rev_segSeqD[pt] = uind
+            cind = uind
+            segSeqD[cind] = pt
+            rev_segSeqD[pt] = cind
+            seg_end_pos_d[cind] = (pt[0] + ':' + str(pt[1]), pt[0] + ':' + str(pt[2]))
 
-        cind = rev_segSeqD[pt]
         cycle.append((cind, i[3][1]))
-        seg_end_pos_d[cind] = (pt[0] + ':' + str(pt[1]), pt[0] + ':' + str(pt[2]))
         connections.append(i[3][2] == 'True')  # expecting 'True' or 'False' string in this column from the file
 
     # if non-cyclic path, put zeros on it
@@ -383,36 +796,42 @@ def handle_struct_bed_data(struct_data):
         isCycle = False
 
     # make the bpg dict
-    print(cycle)
     for a, b, conn in zip(cycle, cycle[1:] + [cycle[0]], connections):
-        print(a,b,conn)
         if conn:
             ae = seg_end_pos_d[a[0]][1] if a[1] == '+' else seg_end_pos_d[a[0]][0]
             bs = seg_end_pos_d[b[0]][0] if b[1] == '+' else seg_end_pos_d[b[0]][1]
             bidirectional_edge_dict[ae].add(bs)
             bidirectional_edge_dict[bs].add(ae)
 
-    print(bidirectional_edge_dict)
+    logger.info("structure bed: %d entries, %d unique segments, %d connections", len(cycle), len(segSeqD),
+                sum(connections))
     return cycle, isCycle, segSeqD, seg_end_pos_d, bidirectional_edge_dict
 
 
-# return list of relevant genes sorted by starting position
+# rel_genes results, keyed by the gene tree, the region and the gene set. Segments recurring within a structure, or
+# across the structures of a run, reuse the result.
+_rel_genes_cache = {}
+
+
+# genes overlapping the region pTup, restricted to gene_set if it is not empty, sorted by position.
 def rel_genes(chrIntTree, pTup, gene_set=None):
-    if gene_set is None:
-        gene_set = set()
+    key = (id(chrIntTree), pTup[0], pTup[1], pTup[2], frozenset(gene_set) if gene_set else None)
+    cached = _rel_genes_cache.get(key)
+    if cached is None or cached[0] is not chrIntTree:
+        cached = (chrIntTree, _query_rel_genes(chrIntTree, pTup, gene_set))
+        _rel_genes_cache[key] = cached
+
+    return list(cached[1])
+
 
+def _query_rel_genes(chrIntTree, pTup, gene_set):
     currGenes = {}
     chrom = pTup[0]
     overlappingT = chrIntTree[chrom][pTup[1]:pTup[2]]
-    gene_set_only = (len(gene_set) == 0)
     for i in overlappingT:
         gObj = i.data
         gname = gObj.gname
-        is_other_feature = (gname.startswith("LOC") or gname.startswith("LINC") or gname.startswith("MIR"))
-        if gene_set_only:
-            gene_set.add(gname)
-
-        if not is_other_feature and gname in gene_set:
+        if not gObj.is_other_feature and (not gene_set or gname in gene_set):
             if gname not in currGenes:
                 currGenes[gname] = gObj
 
@@ -515,16 +934,38 @@ def parse_bed(bedfile, store_all_additional_fields=False):
     return data_dict
 
 
+# rects data has the color in the third additional field, either as a tuple like (0.4,0.4,0.4) or as a color name.
+# Replace it by its RGBA tuple, parsing each distinct color string once.
+def parse_rect_colors(data_dict):
+    rgba_cache = {}
+    for chrom, entries in data_dict.items():
+        parsed = []
+        for begin, end, data in entries:
+            cstr = data[2]
+            if cstr not in rgba_cache:
+                joined = "".join(cstr.split())
+                try:
+                    rgba_cache[cstr] = to_rgba(literal_eval(joined))
+                except (ValueError, SyntaxError):
+                    rgba_cache[cstr] = to_rgba(joined)
+
+            parsed.append((begin, end, data[:2] + (rgba_cache[cstr],) + data[3:]))
+
+        data_dict[chrom] = parsed
+
+    return data_dict
+
+
 def rescale_by_secondary(primary_dset, secondary_dset, chrom, mode):
     # put secondary data into an intervaltree
     if mode == True:
         mode = "mean"
 
     if mode != "mean" and mode != "each":
-        print("Incorrect norm by secondary mode selected, must be 'mean' or 'each'... using 'mean'")
+        logger.warning("Incorrect norm by secondary mode selected, must be 'mean' or 'each'... using 'mean'")
 
     if len(secondary_dset) == 0:
-        print("No secondary data! skipping normalization")
+        logger.info("No secondary data! skipping normalization")
         return primary_dset, secondary_dset
 
     sit = IntervalTree()
@@ -536,7 +977,7 @@ def rescale_by_secondary(primary_dset, secondary_dset, chrom, mode):
             normed_secondary[chrom].append([point[0], point[1], 2])
 
     elif mode == "mean":
-        print("Normalizing 'mean' for secondary will update secondary")
+        logger.debug("Normalizing 'mean' for secondary will update secondary")
         lscale = 100000.0
         runl = 0.
         runs = 0.
@@ -552,7 +993,7 @@ def rescale_by_secondary(primary_dset, secondary_dset, chrom, mode):
         if c > 0:
             allmean = runs/runl
         else:
-            print("no secondary data, setting scale to 1")
+            logger.info("no secondary data, setting scale to 1")
             allmean = 1.0
 
         #replace everything in secondary with that mean
@@ -561,35 +1002,118 @@ def rescale_by_secondary(primary_dset, secondary_dset, chrom, mode):
             normed_secondary[chrom].append([point[0], point[1], 2.0])
 
 
+    debug = logger.isEnabledFor(logging.DEBUG)
+    counts = defaultdict(int)
     for point in primary_dset[chrom]:
         hit_sec = list(sit[point[0]:point[1]])
         if not hit_sec:
-            print("could not normalize " + str(point))
+            counts["unmatched points"] += 1
+            if debug:
+                logger.debug("could not normalize %s", point)
 
         elif len(hit_sec) > 1:
-            print(str(point) + ": multiple secondary track hits for normalization, using first hit " + "(" + str(hit_sec[0]) + ")")
+            counts["points with multiple secondary hits"] += 1
+            if debug:
+                logger.debug("%s: multiple secondary track hits for normalization, using first hit (%s)", point,
+                             hit_sec[0])
 
         else:
             normed_primary[chrom].append([point[0], point[1], point[2]/float(hit_sec[0].data)])
 
+    log_counts(counts, "normalizing " + chrom + " by secondary")
     return normed_primary, normed_secondary
 
 
+# number of entries in the primary and secondary data of a feature track
+def count_track_points(cfc):
+    return sum(len(x) for x in cfc.primary_data.values()) + sum(len(x) for x in cfc.secondary_data.values())
+
+
+# decide if the aggregated genome overview representations should be used. mode is 'auto', 'on' or 'off'
+def use_genome_overview(mode, ref_placements):
+    if mode == "auto":
+        return ref_placements.ref_length() >= genome_overview_min_length
+
+    # yaml reads unquoted on/off as booleans
+    return mode is True or mode == "on"
+
+
+# aggregate the points of a data dictionary (chrom -> [start, end, value]) into bins of fixed width. Each point goes
+# to the bin holding its midpoint, and the bin value is the length-weighted mean of its points.
+def bin_feature_data(data, bin_width):
+    binned_data = defaultdict(list)
+    for chrom, points in data.items():
+        if not points:
+            continue
+
+        starts = np.array([x[0] for x in points], dtype=float)
+        ends = np.array([x[1] for x in points], dtype=float)
+        vals = np.array([x[2] for x in points], dtype=float)
+        weights = np.maximum(ends - starts, 1)
+        bin_ids, inv = np.unique(((starts + ends) / 2 // bin_width).astype(int), return_inverse=True)
+        wsums = np.bincount(inv, weights=weights)
+        means = np.bincount(inv, weights=weights * vals) / wsums
+        bstarts = np.full(len(bin_ids), np.inf)
+        bends = np.full(len(bin_ids), -np.inf)
+        np.minimum.at(bstarts, inv, starts)
+        np.maximum.at(bends, inv, ends)
+        binned_data[chrom] = [(bs, be, v) for bs, be, v in zip(bstarts.tolist(), bends.tolist(), means.tolist())]
+
+    return binned_data
+
+
+# pre-bin a standard feature track for the genome overview mode
+def bin_feature_track(cfc, bin_width):
+    n_points = count_track_points(cfc)
+    cfc.primary_data = bin_feature_data(cfc.primary_data, bin_width)
+    cfc.secondary_data = bin_feature_data(cfc.secondary_data, bin_width)
+    if cfc.track_props['granularity'] == 0:
+        cfc.track_props['granularity'] = bin_width
+
+    logger.info("binned track %d from %d to %d points", cfc.index, n_points, count_track_points(cfc))
+
+
+# count the genes overlapping a reference segment in bins of bin_width (in plot coordinates), using gene midpoints.
+# LOC, LINC and MIR features are skipped, as in rel_genes.
+def gene_density(chrIntTree, refObj, bin_width, gene_set=None):
+    seg_len = refObj.ref_end - refObj.ref_start
+    counts = np.zeros(max(1, int(np.ceil(seg_len / float(bin_width)))))
+    mids = []
+    for i in chrIntTree[refObj.chrom][refObj.ref_start:refObj.ref_end]:
+        gname = i.data.gname
+        if i.data.is_other_feature:
+            continue
+
+        if gene_set and gname not in gene_set:
+            continue
+
+        mids.append((max(i.data.gstart, refObj.ref_start) + min(i.data.gend, refObj.ref_end)) / 2.0)
+
+    if mids:
+        offsets = np.array(mids) - refObj.ref_start
+        if refObj.direction == "-":
+            offsets = seg_len - offsets
+
+        np.add.at(counts, np.minimum((offsets // bin_width).astype(int), len(counts) - 1), 1)
+
+    return counts
+
+
 # take the feature data (cfc) and extract only the regions overlapping the reference segment in question (obj)
 # append the coordinate restricted feature (restricted_cfc) to a list of features kept by the reference object (obj)
 def store_bed_data(cfc, ref_placements, primary_end_trim=0, secondary_end_trim=0):
     if cfc.track_props['tracktype'] == 'standard' or cfc.track_props['tracktype'] == 'rects':
-        print("extracting features, ET", primary_end_trim)
+        logger.info("extracting features for track %d, end trim %s", cfc.index, primary_end_trim)
+        counts = defaultdict(int)
         for obj in ref_placements.values():
             primeTrim = primary_end_trim
             if obj.ref_end - obj.ref_start <= primary_end_trim*2:
                 primeTrim = max(0,(obj.ref_end - obj.ref_start)/2 - 2)
-                print("reset ET ", primeTrim)
+                counts["segments with reduced end trim"] += 1
 
             secTrim = secondary_end_trim
             if obj.ref_end - obj.ref_start <= primary_end_trim * 2:
                 secTrim = max(0, (obj.ref_end - obj.ref_start) / 2 - 2)
-                print("reset ET ", secTrim)
 
             local_primary_data = defaultdict(list)
             local_secondary_data = defaultdict(list)
@@ -622,14 +1146,14 @@ def store_bed_data(cfc, ref_placements, primary_end_trim=0, secondary_end_trim=0
 
             restricted_cfc = copy.copy(cfc)
             if cfc.track_props['rescale_by_secondary']:
-                print(obj.to_string(), "normalizing by secondary")
+                counts["segments normalized by secondary"] += 1
                 normed_primary, normed_secondary = rescale_by_secondary(local_primary_data, local_secondary_data,
                                                                     obj.chrom, cfc.track_props['rescale_by_secondary'])
                 restricted_cfc.primary_data = normed_primary
                 restricted_cfc.secondary_data = normed_secondary
 
             elif cfc.track_props['rescale_by_count']:
-                print(obj.to_string(), "recaling by count")
+                counts["segments rescaled by count"] += 1
                 normed_primary = defaultdict(list)
                 for point in local_primary_data[obj.chrom]:
                     normed_primary[obj.chrom].append([point[0], point[1], point[2] / float(obj.seg_count)])
@@ -642,56 +1166,47 @@ def store_bed_data(cfc, ref_placements, primary_end_trim=0, secondary_end_trim=0
                 restricted_cfc.secondary_data = local_secondary_data
 
             obj.feature_tracks.append(restricted_cfc)
-            print(obj.to_string(),"now has",len(obj.feature_tracks),"tracks")
+
+        log_counts(counts, "track " + str(cfc.index))
 
     elif cfc.track_props['tracktype'] == 'links':
         for cdat, c_link_store in zip([cfc.primary_data, cfc.secondary_data], [cfc.primary_links, cfc.secondary_links]):
-            for cp, data_tup_list in cdat.items():
-                for data_tup in data_tup_list:
-                    cLink = cfc.Link(cp[0], cp[1], data_tup)
-                    # hitA, hitB = False, False
-                    for obj in ref_placements.values():
-                        seg_len = obj.ref_end - obj.ref_start
-                        # check if it's chromA
-                        if obj.chrom == cLink.chromA:
-                            # check if overlap coord
-                            if obj.ref_start <= cLink.startA <= obj.ref_end or \
-                                    obj.ref_start <= cLink.endA <= obj.ref_end:
-                                # compute the normpos
-                                # print("matched", cp, data_tup, "A")
-                                if obj.direction == "+":
-                                    normStart_A = obj.abs_start_pos + max(0, cLink.startA - obj.ref_start)
-                                    normEnd_A = obj.abs_start_pos + min(seg_len, cLink.endA - obj.ref_start)
-
-                                else:
-                                    normEnd_A = obj.abs_start_pos + min(seg_len, obj.ref_end - cLink.startA)
-                                    normStart_A = obj.abs_start_pos + max(0, obj.ref_end - cLink.endA)
-
-                                cLink.posA_hits.append((normStart_A, normEnd_A))
-                                # hitA = True
-
-                        # check if it's chromB
-                        if obj.chrom == cLink.chromB:
-                            # check if overlap coord
-                            if obj.ref_start <= cLink.startB <= obj.ref_end or \
-                                    obj.ref_start <= cLink.endB <= obj.ref_end:
-                                # print("matched", cp, data_tup, "B")
-                                # compute the normpos
-                                if obj.direction == "+":
-                                    normStart_B = obj.abs_start_pos + max(0, cLink.startB - obj.ref_start)
-                                    normEnd_B = obj.abs_start_pos + min(seg_len, cLink.endB - obj.ref_start)
-
-                                else:
-                                    normEnd_B = obj.abs_start_pos + min(seg_len, obj.ref_end - cLink.startB)
-                                    normStart_B = obj.abs_start_pos + max(0, obj.ref_end - cLink.endB)
-
-                                cLink.posB_hits.append((normStart_B, normEnd_B))
-                                # hitB = True
-
-                        # if cfc.track_props['link_single_match'] and hitA and hitB:
-                        #     break
-
-                    c_link_store.append(cLink)
+            link_rows = [(cp, data_tup) for cp, data_tup_list in cdat.items() for data_tup in data_tup_list]
+            if not link_rows:
+                continue
+
+            # an end of the link hits a segment if either of its coordinates is inside the segment
+            side_hits = []
+            for c_ind, s_ind in [(0, 0), (1, 2)]:
+                chroms = [x[0][c_ind] for x in link_rows]
+                starts = [x[1][s_ind] for x in link_rows]
+                ends = [x[1][s_ind + 1] for x in link_rows]
+                l_inds, _, norm_starts, norm_ends = map_to_placements(ref_placements, chroms, starts, ends, "endpoint")
+                hits = defaultdict(list)
+                for l_ind, ns, ne in zip(l_inds.tolist(), norm_starts.tolist(), norm_ends.tolist()):
+                    hits[l_ind].append((ns, ne))
+
+                side_hits.append(hits)
+
+            hitsA, hitsB = side_hits
+            n_dropped = 0
+            for l_ind, (cp, data_tup) in enumerate(link_rows):
+                # a link is only drawn if both of its ends are in the structure
+                if cfc.track_props['link_prefilter'] and not (l_ind in hitsA and l_ind in hitsB):
+                    n_dropped += 1
+                    continue
+
+                cLink = cfc.Link(cp[0], cp[1], data_tup)
+                cLink.posA_hits = hitsA.get(l_ind, [])
+                cLink.posB_hits = hitsB.get(l_ind, [])
+                c_link_store.append(cLink)
+
+            logger.debug("track %d: kept %d of %d links, %d have an end outside the structure", cfc.index,
+                         len(link_rows) - n_dropped, len(link_rows), n_dropped)
+            if cfc.track_props['link_min_score'] is not None or cfc.track_props['link_top_n'] is not None:
+                c_link_store[:] = select_links(c_link_store, cfc.track_props['link_min_score'],
+                                               cfc.track_props['link_top_n'])
+                logger.debug("track %d: %d links pass the score selection", cfc.index, len(c_link_store))
 
         # holds the place of the feature
         for obj in ref_placements.values():
@@ -713,46 +1228,22 @@ def handle_IS_data(ref_placements, IS_cycle, IS_segSeqD, IS_isCircular, IS_bh, c
 
     new_IS_cycle = []
     new_IS_links = []
-    # lastIndHit = -1
-    IS_rObj_placements = {}
-    u_ind = 0
-    for obj in ref_placements.values():
-        s_to_add = []
-        c_to_add = []
-        seg_len = obj.ref_end - obj.ref_start
-        for ind, (segID, segdir) in enumerate(IS_cycle):
-            padj, nadj = prev_seg_index_is_adj[ind], next_seg_index_is_adj[ind]
-            seg_id_count = cycle_seg_counts[segID]
+    IS_rObjs = []
+    if IS_cycle:
+        chroms, starts, ends = zip(*[IS_segSeqD[segID] for segID, _ in IS_cycle])
+        f_inds, r_inds, norm_starts, norm_ends = map_to_placements(ref_placements, chroms, starts, ends, "endpoint")
+        # group by reference segment, then order each group by position on the reference segment
+        order = np.lexsort((f_inds, norm_starts, r_inds))
+        for ind, r_ind, normStart, normEnd in zip(f_inds[order].tolist(), r_inds[order].tolist(),
+                                                  norm_starts[order].tolist(), norm_ends[order].tolist()):
+            segID, segdir = IS_cycle[ind]
             c, s, e = IS_segSeqD[segID]
-            if c != obj.chrom:
-                continue
-
-            # overlaps the ref seg
-            if obj.ref_start <= s <= obj.ref_end or obj.ref_start <= e <= obj.ref_end:
-                # compute the normpos
-                if obj.direction == "+":
-                    normStart = obj.abs_start_pos + max(0, s - obj.ref_start)
-                    normEnd = obj.abs_start_pos + min(seg_len, e - obj.ref_start)
-
-                else:
-                    normEnd = obj.abs_start_pos + min(seg_len, obj.ref_end - s)
-                    normStart = obj.abs_start_pos + max(0, obj.ref_end - e)
-
-                # make a refobj
-                currObj = CycleVizElemObj(segID, c, s, e, obj.direction, normStart, normEnd, seg_id_count, padj, nadj)
-                currObj.custom_color = cycleColor
-                currObj.custom_bh = IS_bh
-                s_to_add.append(currObj)
-                c_to_add.append((segID, segdir))
-
-        if not s_to_add:
-            continue
-
-        ssta, scta = zip(*sorted(zip(s_to_add, c_to_add), key=lambda x: x[0].abs_start_pos))
-        new_IS_cycle.extend(scta)
-        for rObj, ct in zip(ssta, scta):
-            IS_rObj_placements[u_ind] = rObj
-            u_ind+=1
+            currObj = CycleVizElemObj(segID, c, s, e, ref_placements.objs[r_ind].direction, normStart, normEnd,
+                                      cycle_seg_counts[segID], prev_seg_index_is_adj[ind], next_seg_index_is_adj[ind])
+            currObj.custom_color = cycleColor
+            currObj.custom_bh = IS_bh
+            IS_rObjs.append(currObj)
+            new_IS_cycle.append((segID, segdir))
 
     for a, b in zip(new_IS_cycle[:-1], new_IS_cycle[1:]):
         if (a,b) in valid_link_pairs or (b,a) in valid_link_pairs:
@@ -766,8 +1257,8 @@ def handle_IS_data(ref_placements, IS_cycle, IS_segSeqD, IS_isCircular, IS_bh, c
     else:
         new_IS_links.append(False)
 
-    print(new_IS_links)
-    print(new_IS_cycle)
+    logger.debug("interior segments %s, links %s", new_IS_cycle, new_IS_links)
+    IS_rObj_placements = PlacementTable(IS_rObjs)
     return IS_rObj_placements, new_IS_cycle, new_IS_links
 
 
@@ -776,7 +1267,7 @@ def handle_IS_data(ref_placements, IS_cycle, IS_segSeqD, IS_isCircular, IS_bh, c
 
 
 def check_segdup(aln_vect, cycle, circular):
-    print("Checking if segdup")
+    logger.debug("Checking if segdup")
     # iterate over and delete the second half it's bad
     num_contigs = len(set([x["contig_id"] for x in aln_vect]))
     if num_contigs != 1:
@@ -812,30 +1303,87 @@ def check_segdup(aln_vect, cycle, circular):
 
 
 # for use with bionano data & AR output
+# One row of an AlignmentTable, read and written like the row dicts parse_alnfile used to return. Writes go to the
+# table's columns.
+class AlignmentRow(object):
+    def __init__(self, table, ind):
+        self.table = table
+        self.ind = ind
+
+    def __getitem__(self, field):
+        value = self.table.columns[field][self.ind]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __setitem__(self, field, value):
+        self.table.columns[field][self.ind] = value
+
+    def __contains__(self, field):
+        return field in self.table.columns
+
+    def keys(self):
+        return list(self.table.columns)
+
+
+# Columnar storage of the rows of an AR path alignment file. The label and seg_aln_number columns are int arrays, the
+# others are object arrays of strings, so they take values of any length. It can be used like the list of row dicts
+# it replaces (len, iteration, indexing and slicing), with rows given as AlignmentRow views.
+class AlignmentTable(object):
+    int_fields = ["contig_label", "seg_label", "seg_aln_number"]
+
+    def __init__(self, columns=None, n_rows=0):
+        self.columns = columns if columns is not None else {}
+        self.n_rows = len(next(iter(self.columns.values()))) if self.columns else n_rows
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return AlignmentTable(dict((f, c[ind].copy()) for f, c in self.columns.items()),
+                                  len(range(*ind.indices(self.n_rows))))
+
+        if ind < 0:
+            ind += self.n_rows
+
+        if not 0 <= ind < self.n_rows:
+            raise IndexError("alignment row index out of range")
+
+        return AlignmentRow(self, ind)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __iter__(self):
+        return (AlignmentRow(self, ind) for ind in range(self.n_rows))
+
+
 def parse_alnfile(path_aln_file):
-    aln_vect = []
     with open(path_aln_file) as infile:
-        # read a few special header lines directly by calling .next(). This will not work in python3!
-        # Ideally there should be a way to read the next line from infile with a command that works in 2 & 3.
         meta_header = next(infile).rstrip()[1:].split()
         aln_metadata_fields = next(infile).rstrip()[1:].split()
         meta_dict = dict(zip(meta_header, aln_metadata_fields))
         aln_header = next(infile).rstrip()[1:].split()
-        for line in infile:
-            fields = line.rstrip().split()
-            fields_dict = dict(zip(aln_header, fields))
-            fields_dict["contig_label"] = int(fields_dict["contig_label"])
-            fields_dict["seg_label"] = int(fields_dict["seg_label"])
-            fields_dict["seg_aln_number"] = int(fields_dict["seg_aln_number"])
-            aln_vect.append(fields_dict)
+        rows = []
+        for line_num, line in enumerate(infile, 4):
+            fields = line.split()
+            if not fields:
+                continue
+
+            if len(fields) < len(aln_header):
+                raise ValueError("{}: line {} has {} fields, but the header has {} ({})".format(
+                    path_aln_file, line_num, len(fields), len(aln_header), " ".join(aln_header)))
+
+            rows.append(fields)
 
-    return aln_vect, meta_dict
+    columns = {}
+    for ind, field in enumerate(aln_header):
+        col = [x[ind] for x in rows]
+        columns[field] = np.array(col, dtype=int) if field in AlignmentTable.int_fields else np.array(col, dtype=object)
+
+    return AlignmentTable(columns, len(rows)), meta_dict
 
 # -----------------------------------------
 
 # determine segments linearly adjacent in ref genome
 def adjacent_segs(cycle, segSeqD, isCycle):
-    print("checking adjacency")
+    logger.debug("checking adjacency")
     prev_seg_index_is_adj = [False] * len(cycle)
     next_seg_index_is_adj = [False] * len(cycle)
     p_end = segSeqD[cycle[0][0]][2] if cycle[0][1] == "+" else segSeqD[cycle[0][0]][1]
@@ -903,46 +1451,45 @@ def imputed_status_from_aln(aln_vect, cycle_len):
 
 # check contig end trimming
 def decide_trim_contigs(contig_cmap_vects, contig_placements, total_length):
-    print("DECIDING TRIMMING")
+    logger.debug("deciding contig trimming")
     for cObj in contig_placements.values():
-        print(cObj.id)
         cmap_vect = contig_cmap_vects[cObj.id]
         first_lab, last_lab = cObj.aln_lab_ends
 
         if (cmap_vect[first_lab - 1] - cmap_vect[0]) * cObj.scaling_factor > unaligned_cutoff_frac * total_length:
             cObj.start_trim = True
-            print("start_trim true")
 
         if (cmap_vect[-1] - cmap_vect[last_lab - 1]) * cObj.scaling_factor > unaligned_cutoff_frac * total_length:
             cObj.end_trim = True
-            print("end_trim true")
 
         if cObj.start_trim or cObj.end_trim:
             cObj.trim_obj_ends(total_length)
 
 
-# TEMP SOLUTION (will break if too many consecutive overlaps)
-def set_contig_height_shifts(contig_placements, contig_list, scale_mult=1):
-    print("SETTING HEIGHTS")
-    prev_offset = 0
-    for ind, i in enumerate(contig_list[1:]):
-        prevObj = contig_placements[contig_list[ind]]
-        currObj = contig_placements[i]
+# stack overlapping contigs in rows (see pack_rows), shifting each row down by contig_row_shift * scale_mult. Give the
+# total_length of a circular layout to let contigs wrap around its start. Returns the number of rows used.
+def set_contig_height_shifts(contig_placements, contig_list, scale_mult=1, total_length=None):
+    logger.debug("setting contig heights")
+    if not contig_list:
+        return 0
 
-        if currObj.abs_start_pos < prevObj.abs_end_pos:
-            shift_mult = -1 if prev_offset == 0 else 0
-            currObj.track_height_shift = shift_mult * 1.5 * scale_mult
-            prev_offset = shift_mult
+    cObjs = [contig_placements[i] for i in contig_list]
+    rows = pack_rows([x.abs_start_pos for x in cObjs], [x.abs_end_pos for x in cObjs], period=total_length)
+    for cObj, row in zip(cObjs, rows.tolist()):
+        cObj.track_height_shift = -row * contig_row_shift * scale_mult
 
-        else:
-            prev_offset = 0
+    n_rows = int(rows.max()) + 1
+    logger.debug("placed %d contigs in %d rows", len(cObjs), n_rows)
+    return n_rows
 
 
 def place_path_segs_and_labels(path, ref_placements, seg_cmap_vects):
     path_seg_placements = {}
     for ind, i in enumerate(path):
         refObj = ref_placements[ind]
-        segObj = copy.deepcopy(refObj)
+        # the placement fields are all immutable or replaced below, so a shallow copy is enough
+        segObj = copy.copy(refObj)
+        segObj.feature_tracks = []
         segObj.cmap_vect = seg_cmap_vects[i[0]]
         segObj.compute_label_posns()
         path_seg_placements[ind] = segObj
@@ -950,53 +1497,101 @@ def place_path_segs_and_labels(path, ref_placements, seg_cmap_vects):
     return path_seg_placements
 
 
+# Index of the label positions of all the placed segments in one array. Returns the array, and the offset of each
+# segment's labels in it by seg_aln_number. Look up positions with segment_label_posns.
+def segment_label_index(path_seg_placements):
+    n_segs = max(path_seg_placements) + 1 if path_seg_placements else 0
+    counts = np.zeros(n_segs, dtype=int)
+    for ind, segObj in path_seg_placements.items():
+        counts[ind] = len(segObj.label_posns)
+
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    posns = np.empty(offsets[-1])
+    for ind, segObj in path_seg_placements.items():
+        posns[offsets[ind]:offsets[ind + 1]] = segObj.label_posns
+
+    return posns, offsets
+
+
+# positions of (1-based) labels of the placed segments, from the index of segment_label_index. As when indexing a
+# segment's label_posns directly, label 0 refers to the segment's last label, and a label outside the segment raises
+# an IndexError instead of reading a neighbouring segment's label.
+def segment_label_posns(seg_label_index, seg_nums, labels):
+    posns, offsets = seg_label_index
+    seg_nums = np.asarray(seg_nums, dtype=int)
+    inds = np.asarray(labels, dtype=int) - 1
+    bad_segs = np.flatnonzero((seg_nums < 0) | (seg_nums >= len(offsets) - 1))
+    if len(bad_segs):
+        raise IndexError("segment number {} is not a placed segment".format(seg_nums[bad_segs[0]]))
+
+    counts = offsets[seg_nums + 1] - offsets[seg_nums]
+    bad_labels = np.flatnonzero((inds < -counts) | (inds >= counts))
+    if len(bad_labels):
+        i = bad_labels[0]
+        raise IndexError("label {} is out of range for segment number {} with {} labels".format(
+            inds[i] + 1, seg_nums[i], counts[i]))
+
+    inds = np.where(inds < 0, inds + counts, inds)
+    return posns[offsets[seg_nums] + inds]
+
+
+# positions of the aligned contig and segment labels of each row of an AlignmentTable, along with the track height
+# shift of the contig of each row
+def alignment_label_posns(aln_vect, contig_locs, segment_locs):
+    cols = aln_vect.columns
+    c_l_pos = np.empty(len(aln_vect))
+    s_l_pos = segment_label_posns(segment_label_index(segment_locs), cols["seg_aln_number"], cols["seg_label"])
+    height_shifts = np.empty(len(aln_vect))
+    c_ids = cols["contig_id"]
+    for c_id in np.unique(c_ids):
+        rows = c_ids == c_id
+        cObj = contig_locs[str(c_id)]
+        c_l_pos[rows] = cObj.label_posns[cols["contig_label"][rows] - 1]
+        height_shifts[rows] = cObj.track_height_shift
+
+    return c_l_pos, s_l_pos, height_shifts
+
+
 # create an object for each contig encoding variables such as position of start and end of contig (absolute ends)
 # and positioning of contig labels
 def place_contigs_and_labels(path_seg_placements, aln_vect, total_length, contig_cmap_vects, isCycle, circularViz,
                              segSeqD):
-    contig_aln_dict = defaultdict(list)
-    contig_list = []
-    for i in aln_vect:
-        c_id = i["contig_id"]
-        contig_aln_dict[c_id].append(i)
-        if c_id not in contig_list: contig_list.append(c_id)
+    cols = aln_vect.columns
+    # alignment rows of each contig, in order of first appearance
+    contig_aln_dict = OrderedDict()
+    for ind, c_id in enumerate(cols["contig_id"].tolist()):
+        contig_aln_dict.setdefault(c_id, []).append(ind)
+
+    contig_list = list(contig_aln_dict)
+    seg_nums = cols["seg_aln_number"].tolist()
+    seg_labels = cols["seg_label"].tolist()
+    contig_labels = cols["contig_label"].tolist()
+    seg_label_pos = segment_label_posns(segment_label_index(path_seg_placements), seg_nums, seg_labels).tolist()
 
     contig_span_dict = {}
-    print(segSeqD.keys())
+    debug = logger.isEnabledFor(logging.DEBUG)
     for c_id, i_list in contig_aln_dict.items():
         # print "placing contigs computation step"
-        print(c_id, c_id[0])
         cc_vect = contig_cmap_vects[c_id]
-        san_f = i_list[0]["seg_aln_number"]
-        sal_f = i_list[0]["seg_label"]
-        cal_f = i_list[0]["contig_label"]
-        san_l = i_list[-1]["seg_aln_number"]
-        sal_l = i_list[-1]["seg_label"]
-        cal_l = i_list[-1]["contig_label"]
-        contig_dir = i_list[0]["contig_dir"]
-        # print(san_f,sal_f,cal_f)
-        # print(san_l,sal_l,cal_l)
+        r_f, r_l = i_list[0], i_list[-1]
+        cal_f = contig_labels[r_f]
+        cal_l = contig_labels[r_l]
+        contig_dir = str(cols["contig_dir"][r_f])
         #m_id, chrom, ref_start, ref_end, direction, s, t, seg_count, padj, nadj, cmap_vect=None
 
         curr_contig_struct = CycleVizElemObj(c_id, c_id, 0, cc_vect[-1], contig_dir, None, None, 1, False, False,
                                              cc_vect)
 
-        # look up aln posns from path_seg_placements
-        # look up position of first one
-        segObj_start = path_seg_placements[san_f]
-        seg_start_l_pos = segObj_start.label_posns[sal_f - 1]
-
-        # look up position of last one
-        segObj_end = path_seg_placements[san_l]
-        seg_end_l_pos = segObj_end.label_posns[sal_l - 1]
+        # look up aln posns of the first and last aligned labels
+        seg_start_l_pos = seg_label_pos[r_f]
+        seg_end_l_pos = seg_label_pos[r_l]
 
         if seg_end_l_pos < seg_start_l_pos:
             seg_end_l_pos += total_length
 
         # catch case where contig is overcircularized (e.g. circular assembly)
         if len(contig_aln_dict) == 1 and isCycle and len(i_list) > 2:
-            san_s = i_list[1]["seg_aln_number"]
-            segObj_second = path_seg_placements[san_s]
+            segObj_second = path_seg_placements[seg_nums[i_list[1]]]
             second_seg_abs_end_pos = segObj_second.abs_end_pos
             if seg_end_l_pos < second_seg_abs_end_pos:
                 seg_end_l_pos += total_length
@@ -1004,11 +1599,8 @@ def place_contigs_and_labels(path_seg_placements, aln_vect, total_length, contig
         # compute scaling
         scaling_factor = 1
         if circularViz:
-            print(c_id, "comp_scaling")
             scaled_seg_dist = abs(seg_end_l_pos - seg_start_l_pos) * (1 - contig_spacing)
             scaling_factor = scaled_seg_dist / (abs(cc_vect[cal_f - 1] - cc_vect[cal_l - 1]))
-            print(seg_start_l_pos, seg_end_l_pos, 1 - contig_spacing, scaled_seg_dist, total_length)
-            print(scaled_seg_dist, scaling_factor)
             # SET CONTIG SCALING FACTOR
 
         curr_contig_struct.scaling_factor = scaling_factor
@@ -1019,14 +1611,12 @@ def place_contigs_and_labels(path_seg_placements, aln_vect, total_length, contig
             abs_end_pos = abs_start_pos + (cc_vect[-1]) * scaling_factor
 
         else:
-            print("applying scaling to ends")
             abs_start_pos = seg_start_l_pos - (cc_vect[cal_l - 1]) * scaling_factor
             abs_end_pos = abs_start_pos + (cc_vect[-1]) * scaling_factor
-            print("now", abs_start_pos, abs_end_pos)
 
-        print("SEG PLACEMENT ", c_id)
-        print(abs_start_pos, abs_end_pos)
-        print(seg_start_l_pos, seg_end_l_pos, scaling_factor)
+        if debug:
+            logger.debug("contig %s placed at %s-%s, aligned %s-%s, scaling %s", c_id, abs_start_pos, abs_end_pos,
+                         seg_start_l_pos, seg_end_l_pos, scaling_factor)
 
         curr_contig_struct.abs_start_pos = abs_start_pos
         curr_contig_struct.abs_end_pos = abs_end_pos
@@ -1034,10 +1624,8 @@ def place_contigs_and_labels(path_seg_placements, aln_vect, total_length, contig
         # SET BOUNDARY ALN POSITIONS FROM TRACK
         curr_contig_struct.aln_bound_posns = (seg_start_l_pos, seg_end_l_pos)
 
-        csl = min(i_list[-1]["contig_label"], i_list[0]["contig_label"])
-        cel = max(i_list[-1]["contig_label"], i_list[0]["contig_label"])
-        print("CSL/CEL", csl, cel)
-        print("")
+        csl = min(cal_l, cal_f)
+        cel = max(cal_l, cal_f)
         # SET FIRST AND LAST LABEL ALIGNED IN THE CONTIG
         curr_contig_struct.aln_lab_ends = (csl, cel)
         curr_contig_struct.compute_label_posns()
@@ -1050,8 +1638,7 @@ def reduce_path(path, prev_seg_index_is_adj, inds, aln_vect=None):
     if aln_vect is None:
         aln_vect = []
 
-    print("Reducing path by " + str(inds))
-    print(path)
+    logger.info("Reducing path by %s", inds)
     left, right = inds
     path = path[left:]
     prev_seg_index_is_adj = prev_seg_index_is_adj[left:]
@@ -1072,7 +1659,7 @@ def reduce_path(path, prev_seg_index_is_adj, inds, aln_vect=None):
         for a_ind, a_d in enumerate(aln_vect):
             aln_vect[a_ind]["seg_aln_number"] = aln_vect[a_ind]["seg_aln_number"] - downshift
 
-    print(path)
+    logger.debug("reduced path %s", path)
     return path, prev_seg_index_is_adj, aln_vect
 
 
@@ -1193,7 +1780,6 @@ def parse_main_args_yaml(args):
         sample_data = yaml.safe_load(f)
         if "cycles_file" in sample_data:
             args.cycles_file = sample_data.get("cycles_file")
-            print(args.cycles_file)
             args.cycle = str(sample_data.get("cycle"))
         else:
             args.structure_bed = sample_data.get("structure_bed")
@@ -1208,6 +1794,10 @@ def parse_main_args_yaml(args):
             args.graph = sample_data.get("graph")
         if "i" in sample_data:
             args.path_alignment = sample_data.get("i")
+        if "AR_path_alignment" in sample_data:
+            args.AR_path_alignment = sample_data["AR_path_alignment"]
+        if "om_compare" in sample_data:
+            args.om_compare = sample_data["om_compare"]
         if "ref" in sample_data:
             args.ref = sample_data.get("ref")
         if "o" in sample_data:
@@ -1222,7 +1812,6 @@ def parse_main_args_yaml(args):
             args.gene_subset_files = sample_data.get("gene_subset_file")
         if "gene_subset_list" in sample_data:
             args.gene_subset_list = sample_data.get("gene_subset_list")
-            print(args.gene_subset_list)
         if "print_dup_genes" in sample_data:
             args.print_dup_genes = sample_data.get("print_dup_genes")
         if "gene_highlight_list" in sample_data:
@@ -1243,6 +1832,14 @@ def parse_main_args_yaml(args):
             args.structure_color = sample_data["structure_color"]
         if "annotate_structure" in sample_data:
             args.annotate_structure = sample_data["annotate_structure"]
+        if "genome_overview" in sample_data:
+            args.genome_overview = sample_data["genome_overview"]
+        if "om_molecule_xmap" in sample_data:
+            args.om_molecule_xmap = sample_data["om_molecule_xmap"]
+        if "om_molecules" in sample_data:
+            args.om_molecules = sample_data["om_molecules"]
+        if "om_molecule_depth" in sample_data:
+            args.om_molecule_depth = sample_data["om_molecule_depth"]
 
 
 def parse_feature_yaml(yaml_file, index, totfiles):
@@ -1276,6 +1873,11 @@ def parse_feature_yaml(yaml_file, index, totfiles):
             'sec_resc_zero': 0, #this is a 'private' param. User setting it won't change anything.
             'linkpoint': "", #or 'midpoint'
             'link_single_match': False,
+            'link_prefilter': True,
+            'link_min_score': None,
+            'link_top_n': None,
+            'link_aggregate': False,
+            'link_bin_width': 1.0,
             'primary_kwargs': {},
             'secondary_kwargs': {},
             'link_kwargs': {},
@@ -1284,7 +1886,7 @@ def parse_feature_yaml(yaml_file, index, totfiles):
         }
 
         indd = yaml.safe_load(yf)
-        print(indd)
+        logger.debug("feature track %d properties: %s", index, indd)
         dd.update(indd)
 
         lkeys = ['tracktype', 'primary_style', 'secondary_style', 'linkpoint']
@@ -1337,7 +1939,7 @@ def parse_feature_yaml(yaml_file, index, totfiles):
 
             minprimary = min([x[2] for y in primary_data for x in primary_data[y]])
             maxprimary = max([x[2] for y in primary_data for x in primary_data[y]])
-            print("MAX PRIM, MINPRIM", maxprimary, minprimary)
+            logger.debug("track %d primary min %s, max %s", index, minprimary, maxprimary)
 
             if len(secondary_data) > 0:
                 minsecondary = min([x[2] for y in secondary_data for x in secondary_data[y]])
@@ -1363,7 +1965,7 @@ def parse_feature_yaml(yaml_file, index, totfiles):
 
             if dd['rescale_secondary_to_primary']:
                 sec_rsf = (maxprimary - minprimary) / (maxsecondary - minsecondary)
-                print("RESCALNG secondary TO primary")
+                logger.debug("rescaling secondary to primary")
                 # print((maxsecondary - minsecondary),(maxprimary - minprimary))
 
                 rs_sec = defaultdict(list)
@@ -1400,15 +2002,17 @@ def parse_feature_yaml(yaml_file, index, totfiles):
 
         elif dd['tracktype'] == 'rects':
             if dd["primary_feature_bedgraph"]:
-                primary_data = parse_bed(dd['primary_feature_bedgraph'], store_all_additional_fields=True)
+                primary_data = parse_rect_colors(parse_bed(dd['primary_feature_bedgraph'],
+                                                           store_all_additional_fields=True))
 
             if dd["secondary_feature_bedgraph"]:
-                secondary_data = parse_bed(dd['secondary_feature_bedgraph'], store_all_additional_fields=True)
+                secondary_data = parse_rect_colors(parse_bed(dd['secondary_feature_bedgraph'],
+                                                             store_all_additional_fields=True))
 
             dv_min, dv_max = 0, 1
 
         else:
-            print("ERROR: feature " + str(index) + ": Unrecognized track type - " + str(dd['tracktype']) + "\n")
+            logger.error("feature " + str(index) + ": Unrecognized track type - " + str(dd['tracktype']))
             sys.exit(1)
 
     new_cfc = feature_track(index, primary_data, secondary_data, dd, dv_min, dv_max)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+
+"""
+Benchmark CycleViz and LinearViz on synthetic amplicons.
+
+Generates cycles files, breakpoint graphs, gene annotations, feature tracks and Bionano (CMAP/alignment) files of
+configurable size, runs each visualization under cProfile in a separate process and writes per-stage timings to a
+JSON file so that results can be compared across versions.
+"""
+
+import argparse
+from collections import defaultdict
+import json
+import os
+import platform
+import pstats
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+# functions from the CycleViz modules reported in the per-stage summary (all other functions from these modules are
+# still recorded under "functions")
+module_names = ["CycleViz.py", "LinearViz.py", "VizUtil.py", "bionanoUtil.py"]
+stage_names = ["parse_cycles_file", "parse_BPG", "handle_struct_bed_data", "parse_genes", "parse_feature_yaml",
+               "parse_bed", "parse_cmap", "get_cmap_lens", "parse_cmap_vects", "parse_alnfile",
+               "construct_cycle_ref_placements", "construct_path_ref_placements", "place_path_segs_and_labels", "place_contigs_and_labels",
+               "store_bed_data", "handle_IS_data", "rel_genes", "plot_ref_genome", "plot_genes", "plot_gene_bars",
+               "plot_gene_track", "plot_gene_direction_indicator", "plot_interior_tracks", "plot_standard_IF_track",
+               "plot_rects", "plot_links", "plot_cmap_track", "plot_alignment", "plot_bpg_connection",
+               "plot_track_legend", "savefig"]
+
+chrom_lengths = {"chr1": 248956422, "chr2": 242193529, "chr3": 198295559, "chr4": 190214555, "chr5": 181538259,
+                 "chr6": 170805979, "chr7": 159345973, "chr8": 145138636, "chr9": 138394717, "chr10": 133797422,
+                 "chr11": 135086622, "chr12": 133275309, "chr13": 114364328, "chr14": 107043718, "chr15": 101991189,
+                 "chr16": 90338345, "chr17": 83257441, "chr18": 80373285, "chr19": 58617616, "chr20": 64444167,
+                 "chr21": 46709983, "chr22": 50818468, "chrX": 156040895, "chrY": 57227415}
+
+
+# SYNTHETIC INPUTS
+# -----------------------------------------
+
+class SyntheticAmplicon(object):
+    def __init__(self, n_segments, chroms, min_len, max_len, circular, rng, adjacent_frac=0.3, repeat_frac=0.1):
+        self.chroms = chroms
+        self.circular = circular
+        self.segments = []  # (chrom, start, end), segment IDs are 1-based indices
+        self.path = []  # (seg_id, strand)
+        self.rng = rng
+
+        # lay segments out left to right on each chromosome, making some of them directly adjacent
+        next_pos = dict((c, 1000000) for c in chroms)
+        for i in range(n_segments):
+            chrom = chroms[i % len(chroms)] if rng.random() > adjacent_frac or i == 0 else self.segments[-1][0]
+            seg_len = rng.randint(min_len, max_len)
+            if self.segments and chrom == self.segments[-1][0] and rng.random() < adjacent_frac:
+                start = self.segments[-1][2] + 1
+            else:
+                start = next_pos[chrom] + rng.randint(10000, 5000000)
+
+            end = min(start + seg_len, chrom_lengths.get(chrom, 250000000) - 1)
+            self.segments.append((chrom, start, end))
+            next_pos[chrom] = end
+
+        for seg_id in range(1, n_segments + 1):
+            strand = "+" if rng.random() > 0.3 else "-"
+            self.path.append((seg_id, strand))
+            if rng.random() < repeat_frac:
+                self.path.append((seg_id, strand))
+
+    def regions(self):
+        return [self.segments[seg_id - 1] for seg_id, _ in self.path]
+
+    def write_cycles_file(self, fname):
+        with open(fname, 'w') as outfile:
+            outfile.write("List of cycle segments\n")
+            for ind, (chrom, start, end) in enumerate(self.segments):
+                outfile.write("Segment\t{}\t{}\t{}\t{}\n".format(ind + 1, chrom, start, end))
+
+            seg_str = ",".join(str(s) + d for s, d in self.path)
+            if not self.circular:
+                seg_str = "0+," + seg_str + ",0-"
+
+            outfile.write("Cycle=1;Copy_count=10.0;Segments=" + seg_str + "\n")
+
+    # one BPG sequence edge per segment (in segment ID order) and a discordant edge for every junction in the path
+    def write_graph_file(self, fname):
+        with open(fname, 'w') as outfile:
+            outfile.write("SequenceEdge: StartPosition, EndPosition, PredictedCopyCount, AverageCoverage, Size, "
+                          "NumberReadsMapped\n")
+            for chrom, start, end in self.segments:
+                outfile.write("sequence\t{}:{}-\t{}:{}+\t10.0\t50.0\t{}\t1000\n".format(chrom, start, chrom, end,
+                                                                                          end - start))
+
+            outfile.write("BreakpointEdge: StartPosition->EndPosition, PredictedCopyCount, NumberOfReadPairs, "
+                          "HomologySizeIfAvailable(<0ForInsertions), Homology/InsertionSequence\n")
+            junctions = list(zip(self.path, self.path[1:]))
+            if self.circular:
+                junctions.append((self.path[-1], self.path[0]))
+
+            for (a_id, a_dir), (b_id, b_dir) in junctions:
+                a_chrom, a_start, a_end = self.segments[a_id - 1]
+                b_chrom, b_start, b_end = self.segments[b_id - 1]
+                a_pos, a_sign = (a_end, "+") if a_dir == "+" else (a_start, "-")
+                b_pos, b_sign = (b_start, "-") if b_dir == "+" else (b_end, "+")
+                etype = "concordant" if a_chrom == b_chrom and abs(b_pos - a_pos) == 1 else "discordant"
+                outfile.write("{}\t{}:{}{}->{}:{}{}\t10.0\t20\tNone\tNone\n".format(etype, a_chrom, a_pos, a_sign,
+                                                                                   b_chrom, b_pos, b_sign))
+
+    def write_structure_bed(self, fname):
+        with open(fname, 'w') as outfile:
+            for ind, (seg_id, strand) in enumerate(self.path):
+                chrom, start, end = self.segments[seg_id - 1]
+                connected = self.circular or ind < len(self.path) - 1
+                outfile.write("\t".join([chrom, str(start), str(end), strand, str(connected)]) + "\n")
+
+    def write_interior_cycles_file(self, fname):
+        with open(fname, 'w') as outfile:
+            outfile.write("List of cycle segments\n")
+            for ind, (chrom, start, end) in enumerate(self.segments):
+                mid = (start + end) // 2
+                outfile.write("Segment\t{}\t{}\t{}\t{}\n".format(ind + 1, chrom, start + (mid - start) // 2, mid))
+
+            seg_str = ",".join(str(s + 1) + "+" for s in range(len(self.segments)))
+            outfile.write("Cycle=1;Copy_count=1.0;Segments=" + seg_str + "\n")
+
+
+# synthetic refGene table, with a gene-dense region at the start of every segment
+def write_refgene(fname, amplicons, genes_per_mb, dense_genes_per_mb, rng):
+    gnum = 0
+    with open(fname, 'w') as outfile:
+        for amp in amplicons:
+            for chrom, start, end in amp.segments:
+                dense_end = start + (end - start) // 4
+                pos = max(0, start - 200000)
+                while pos < end + 200000:
+                    density = dense_genes_per_mb if start <= pos <= dense_end else genes_per_mb
+                    pos += int(rng.expovariate(density / 1e6)) + 1
+                    glen = rng.randint(2000, 150000)
+                    gnum += 1
+                    prefix = rng.choice(["SYN", "SYN", "SYN", "SYN", "LOC", "LINC", "MIR"])
+                    gname = "{}{}".format(prefix, gnum)
+                    n_exons = rng.randint(2, 12)
+                    exon_starts = sorted(rng.sample(range(pos, pos + glen), n_exons))
+                    exon_ends = [min(s + rng.randint(50, 400), pos + glen) for s in exon_starts]
+                    strand = rng.choice(["+", "-"])
+                    fields = [str(rng.randint(0, 2000)), "NM_{}".format(gnum), chrom, strand, str(pos), str(pos + glen),
+                              str(pos), str(pos + glen), str(n_exons), ",".join(str(x) for x in exon_starts) + ",",
+                              ",".join(str(x) for x in exon_ends) + ",", "0", gname, "cmpl", "cmpl",
+                              ",".join(["0"] * n_exons) + ","]
+                    outfile.write("\t".join(fields) + "\n")
+
+    return gnum
+
+
+# bedgraph with roughly points_per_mb entries per Mb of the structure
+def write_bedgraph(fname, regions, points_per_mb, rng, base=10.0):
+    n = 0
+    with open(fname, 'w') as outfile:
+        for chrom, start, end in sorted(set(regions)):
+            step = max(2, int(1e6 / points_per_mb))
+            for pos in range(start, end, step):
+                outfile.write("{}\t{}\t{}\t{:.3f}\n".format(chrom, pos, pos + 1, max(0., rng.gauss(base, base / 4))))
+                n += 1
+
+    return n
+
+
+def write_bedpe(fname, regions, n_links, rng):
+    colors = ["red", "blue", "purple", "darkorange"]
+    with open(fname, 'w') as outfile:
+        for _ in range(n_links):
+            ca, sa, ea = rng.choice(regions)
+            cb, sb, eb = rng.choice(regions)
+            pa, pb = rng.randint(sa, ea), rng.randint(sb, eb)
+            wa, wb = rng.randint(0, 5000), rng.randint(0, 5000)
+            outfile.write("\t".join([ca, str(pa), str(pa + wa), cb, str(pb), str(pb + wb),
+                                     "{:.2f}".format(rng.uniform(1, 100)), rng.choice(colors)]) + "\n")
+
+    return n_links
+
+
+def write_rects(fname, regions, rects_per_mb, rng):
+    n = 0
+    with open(fname, 'w') as outfile:
+        for chrom, start, end in sorted(set(regions)):
+            step = max(100, int(1e6 / rects_per_mb))
+            for pos in range(start, end, step):
+                g = round(rng.uniform(0.3, 1.0), 1)
+                outfile.write("{}\t{}\t{}\tband{}\t({},{},{})\n".format(chrom, pos, min(end, pos + step - 1), n, g, g, g))
+                n += 1
+
+    return n
+
+
+def write_feature_yaml(fname, props):
+    with open(fname, 'w') as outfile:
+        for k, v in props.items():
+            outfile.write("{}: {}\n".format(k, v))
+
+
+def write_cmap(fname, cmap_vects):
+    with open(fname, 'w') as outfile:
+        outfile.write("# CMAP File Version:\t0.1\n# Label Channels:\t1\n")
+        outfile.write("#h\tCMapId\tContigLength\tNumSites\tSiteID\tLabelChannel\tPosition\tStdDev\tCoverage\t"
+                      "Occurrence\n")
+        outfile.write("#f\tint\tfloat\tint\tint\tint\tfloat\tfloat\tfloat\tfloat\n")
+        for cmap_id, posns in cmap_vects:
+            length = posns[-1]
+            for ind, pos in enumerate(posns):
+                channel = "0" if ind == len(posns) - 1 else "1"
+                outfile.write("\t".join([str(cmap_id), "{:.1f}".format(length), str(len(posns) - 1), str(ind + 1),
+                                         channel, "{:.1f}".format(pos), "1.0", "1.0", "1.0"]) + "\n")
+
+
+# in silico segment CMAPs, contig CMAPs tiling the path and an AR-style path alignment file
+def write_om_files(amp, seg_fname, contig_fname, aln_fname, labels_per_100kb, segs_per_contig, rng):
+    seg_posns = {}
+    for seg_id, (chrom, start, end) in enumerate(amp.segments, 1):
+        seg_len = float(end - start)
+        n_labels = max(2, int(seg_len / 100000. * labels_per_100kb))
+        posns = sorted(rng.sample(range(20, int(seg_len) - 20), min(n_labels, int(seg_len) - 41)))
+        seg_posns[seg_id] = [float(x) for x in posns] + [seg_len]
+
+    write_cmap(seg_fname, sorted(seg_posns.items()))
+    contig_vects = []
+    rows = []
+    path = amp.path
+    for c_ind, p_start in enumerate(range(0, len(path), segs_per_contig)):
+        contig_id = str(c_ind + 1)
+        overhang = 30000.
+        offset = overhang
+        c_posns = []
+        c_rows = []
+        for san in range(p_start, min(p_start + segs_per_contig, len(path))):
+            seg_id, strand = path[san]
+            s_posns = seg_posns[seg_id]
+            seg_len = s_posns[-1]
+            lab_order = range(1, len(s_posns)) if strand == "+" else range(len(s_posns) - 1, 0, -1)
+            for seg_label in lab_order:
+                p = s_posns[seg_label - 1]
+                c_posns.append(offset + (p if strand == "+" else seg_len - p))
+                c_rows.append((contig_id, str(seg_id), len(c_posns), seg_label, "+", strand, san))
+
+            offset += seg_len
+
+        c_posns.append(offset + overhang)
+        contig_vects.append((contig_id, c_posns))
+        rows.extend(c_rows)
+
+    write_cmap(contig_fname, contig_vects)
+    with open(aln_fname, 'w') as outfile:
+        outfile.write("#path_seg_seq\tscore\tcircular\n")
+        outfile.write("#" + ",".join(str(s) + d for s, d in path) + "\t100.0\t" + str(amp.circular) + "\n")
+        outfile.write("#contig_id\tseg_id\tcontig_label\tseg_label\tcontig_dir\tseg_dir\tseg_aln_number\tscore\t"
+                      "score_delta\timputed\n")
+        for r in rows:
+            outfile.write("\t".join([str(x) for x in r] + ["10.0", "1.0", "0"]) + "\n")
+
+    return len(rows)
+
+
+# set up a directory where the benchmarked scripts can find the resources they need. The real resources are linked,
+# a synthetic refGene file is only written if the source tree does not have one.
+def build_sandbox(src_dir, sandbox_dir, ref, amplicons, args, rng):
+    if os.path.exists(sandbox_dir):
+        shutil.rmtree(sandbox_dir)
+
+    os.makedirs(os.path.join(sandbox_dir, "resources"))
+    for fname in os.listdir(src_dir):
+        if fname.endswith(".py"):
+            os.symlink(os.path.join(src_dir, fname), os.path.join(sandbox_dir, fname))
+
+    src_resources = os.path.join(src_dir, "resources")
+    for fname in os.listdir(src_resources):
+        os.symlink(os.path.join(src_resources, fname), os.path.join(sandbox_dir, "resources", fname))
+
+    refgene_name = "refGene_hg19.txt" if ref in ["hg19", "GRCh37"] else "refGene_" + ref + ".txt"
+    refgene_path = os.path.join(sandbox_dir, "resources", refgene_name)
+    n_genes = None
+    if args.synthetic_genes or not os.path.exists(refgene_path):
+        if os.path.lexists(refgene_path):
+            os.remove(refgene_path)
+
+        n_genes = write_refgene(refgene_path, amplicons, args.genes_per_mb, args.dense_genes_per_mb, rng)
+
+    return n_genes
+
+
+# RUNNING & PROFILING
+# -----------------------------------------
+
+def summarize_profile(prof_file):
+    functions = {}
+    stages = defaultdict(lambda: {"cumtime": 0.0, "tottime": 0.0, "ncalls": 0})
+    st = pstats.Stats(prof_file)
+    for (fname, lineno, funcname), (cc, nc, tt, ct, callers) in st.stats.items():
+        base = os.path.basename(fname)
+        if base in module_names:
+            key = os.path.splitext(base)[0] + "." + funcname
+            functions[key] = {"cumtime": ct, "tottime": tt, "ncalls": nc}
+
+        # matplotlib's savefig appears in both pyplot and figure, only count the outer call
+        is_savefig = funcname == "savefig" and base == "pyplot.py"
+        if (base in module_names and funcname in stage_names) or is_savefig:
+            stages[funcname]["cumtime"] += ct
+            stages[funcname]["tottime"] += tt
+            stages[funcname]["ncalls"] += nc
+
+    return dict(stages), functions
+
+
+def run_case(case, sandbox_dir, out_dir, python_exe):
+    script = os.path.join(sandbox_dir, case["script"])
+    prof_file = os.path.join(out_dir, case["name"] + ".prof")
+    log_file = os.path.join(out_dir, case["name"] + ".log")
+    stage_file = os.path.join(out_dir, case["name"] + ".stages.json")
+    cmd = [python_exe, "-m", "cProfile", "-o", prof_file, script] + case["argv"]
+    # versions with --profile also report their own stage timings, memory use and artist counts
+    with open(script) as infile:
+        has_profile_flag = "--profile_json" in infile.read()
+
+    if has_profile_flag:
+        cmd += ["--profile_json", stage_file]
+
+    with open(log_file, 'w') as logf:
+        t_start = timer()
+        proc = subprocess.Popen(cmd, stdout=logf, stderr=subprocess.STDOUT, cwd=out_dir)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = timer() - t_start
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+    result = {"name": case["name"], "script": case["script"], "argv": case["argv"], "inputs": case["inputs"],
+              "returncode": proc.returncode, "wall_time": wall, "cpu_time": rusage.ru_utime + rusage.ru_stime,
+              "peak_rss_kb": rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss}
+
+    if proc.returncode == 0 and os.path.exists(prof_file):
+        result["stages"], result["functions"] = summarize_profile(prof_file)
+        if has_profile_flag and os.path.exists(stage_file):
+            with open(stage_file) as infile:
+                result["profile"] = json.load(infile)
+
+    else:
+        with open(log_file) as logf:
+            result["error"] = "".join(logf.readlines()[-20:])
+
+    return result
+
+
+def make_cases(args, work_dir, rng):
+    cases = []
+    amplicons = []
+    for n_segments in args.segments:
+        for circular in [True, False]:
+            chroms = ["chr" + str(x) for x in rng.sample(range(1, 23), min(args.chromosomes, 22))]
+            amp = SyntheticAmplicon(n_segments, chroms, args.min_seg_len, args.max_seg_len, circular, rng)
+            amplicons.append(amp)
+            shape = "circular" if circular else "linear"
+            tag = "{}seg_{}".format(n_segments, shape)
+            case_dir = os.path.join(work_dir, tag)
+            os.makedirs(case_dir)
+            cycles_file = os.path.join(case_dir, tag + "_cycles.txt")
+            graph_file = os.path.join(case_dir, tag + "_graph.txt")
+            struct_bed = os.path.join(case_dir, tag + "_structure.bed")
+            amp.write_cycles_file(cycles_file)
+            amp.write_graph_file(graph_file)
+            amp.write_structure_bed(struct_bed)
+            regions = amp.regions()
+            inputs = {"segments": len(amp.segments), "path_length": len(amp.path), "chromosomes": len(chroms),
+                      "structure_bp": sum(e - s for _, s, e in regions), "circular": circular}
+            common = ["--ref", args.ref]
+            pre = os.path.join(case_dir, tag + "_")
+
+            if "cycle" in args.cases:
+                cases.append({"name": tag + "_CycleViz", "script": "CycleViz.py", "inputs": dict(inputs),
+                              "argv": common + ["--cycles_file", cycles_file, "--cycle", "1", "-g", graph_file,
+                                                "-o", pre + "cv_"]})
+
+            if "structure_bed" in args.cases:
+                cases.append({"name": tag + "_CycleViz_structure_bed", "script": "CycleViz.py",
+                              "inputs": dict(inputs), "argv": common + ["--structure_bed", struct_bed,
+                                                                        "-o", pre + "sb_"]})
+
+            if "linear" in args.cases:
+                cases.append({"name": tag + "_LinearViz", "script": "LinearViz.py", "inputs": dict(inputs),
+                              "argv": common + ["--cycles_file", cycles_file, "--path", "1", "-g", graph_file,
+                                                "--outname", pre + "lv_"]})
+
+            if "features" in args.cases:
+                yamls = []
+                f_inputs = dict(inputs)
+                for density in args.feature_density:
+                    bg = os.path.join(case_dir, "{}_{}ppmb.bedgraph".format(tag, density))
+                    f_inputs["points_{}ppmb".format(density)] = write_bedgraph(bg, regions, density, rng)
+                    yml = os.path.join(case_dir, "{}_{}ppmb.yaml".format(tag, density))
+                    write_feature_yaml(yml, {"tracktype": "standard", "primary_feature_bedgraph": bg,
+                                             "primary_style": "points"})
+                    yamls.append(yml)
+
+                bedpe = os.path.join(case_dir, tag + "_links.bedpe")
+                f_inputs["links"] = write_bedpe(bedpe, regions, args.links, rng)
+                yml = os.path.join(case_dir, tag + "_links.yaml")
+                write_feature_yaml(yml, {"tracktype": "links", "primary_feature_bedgraph": bedpe})
+                yamls.append(yml)
+
+                rects = os.path.join(case_dir, tag + "_rects.bed")
+                f_inputs["rects"] = write_rects(rects, regions, args.rects_per_mb, rng)
+                rect_yml = os.path.join(case_dir, tag + "_rects.yaml")
+                write_feature_yaml(rect_yml, {"tracktype": "rects", "primary_feature_bedgraph": rects,
+                                              "end_trim": 0})
+
+                is_cycles = os.path.join(case_dir, tag + "_interior_cycles.txt")
+                amp.write_interior_cycles_file(is_cycles)
+                cases.append({"name": tag + "_CycleViz_features", "script": "CycleViz.py", "inputs": f_inputs,
+                              "argv": common + ["--cycles_file", cycles_file, "--cycle", "1", "-g", graph_file,
+                                                "--feature_yaml_list"] + yamls +
+                                      ["--annotate_structure", rect_yml, "--interior_segments_cycle", is_cycles,
+                                       "-o", pre + "cvf_"]})
+
+            if "om" in args.cases:
+                seg_cmap = os.path.join(case_dir, tag + "_segs.cmap")
+                contig_cmap = os.path.join(case_dir, tag + "_contigs.cmap")
+                aln_file = os.path.join(case_dir, tag + "_path_aln.txt")
+                om_inputs = dict(inputs)
+                om_inputs["aln_rows"] = write_om_files(amp, seg_cmap, contig_cmap, aln_file, args.labels_per_100kb,
+                                                       args.segs_per_contig, rng)
+                om_args = ["--om_alignments", "-c", contig_cmap, "--AR_path_alignment", aln_file]
+                cases.append({"name": tag + "_CycleViz_OM", "script": "CycleViz.py", "inputs": om_inputs,
+                              "argv": common + ["--cycles_file", cycles_file, "--cycle", "1", "-g", graph_file,
+                                                "--om_segs", seg_cmap, "-o", pre + "cvom_"] + om_args})
+                cases.append({"name": tag + "_LinearViz_OM", "script": "LinearViz.py", "inputs": om_inputs,
+                              "argv": common + ["--cycles_file", cycles_file, "--path", "1", "-g", graph_file,
+                                                "-s", seg_cmap, "--outname", pre + "lvom_"] + om_args})
+
+    return cases, amplicons
+
+
+def print_summary(results):
+    print("{:<40} {:>4} {:>9} {:>9} {:>10}".format("case", "rc", "wall(s)", "cpu(s)", "rss(MB)"))
+    for r in results:
+        print("{:<40} {:>4} {:>9.2f} {:>9.2f} {:>10.1f}".format(r["name"], r["returncode"], r["wall_time"],
+                                                              r["cpu_time"], r["peak_rss_kb"] / 1024.))
+        slowest = sorted(r.get("stages", {}).items(), key=lambda x: -x[1]["cumtime"])[:5]
+        for sname, sd in slowest:
+            print("    {:<36} {:>9.3f}s {:>8} calls".format(sname, sd["cumtime"], sd["ncalls"]))
+
+
+parser = argparse.ArgumentParser(description="Benchmark CycleViz and LinearViz on synthetic amplicons")
+parser.add_argument("-o", "--output", help="JSON file to write results to", default="benchmark_results.json")
+parser.add_argument("--src_dir", help="CycleViz source directory to benchmark (default: this directory)",
+                    default=os.path.dirname(os.path.abspath(__file__)))
+parser.add_argument("--work_dir", help="directory for synthetic inputs and plots (default: temporary directory)")
+parser.add_argument("--keep_files", help="do not delete the work directory when finished", action='store_true')
+parser.add_argument("--cases", nargs="+", choices=["cycle", "structure_bed", "linear", "features", "om"],
+                    default=["cycle", "structure_bed", "linear", "features", "om"], help="which cases to run")
+parser.add_argument("--ref", choices=["hg19", "hg38", "GRCh37", "GRCh38"], default="hg19")
+parser.add_argument("--segments", nargs="+", type=int, default=[5, 25, 100],
+                    help="numbers of segments in the synthetic amplicons")
+parser.add_argument("--chromosomes", type=int, default=3, help="number of chromosomes the segments are drawn from")
+parser.add_argument("--min_seg_len", type=int, default=20000)
+parser.add_argument("--max_seg_len", type=int, default=800000)
+parser.add_argument("--synthetic_genes", action='store_true',
+                    help="use a synthetic refGene file even if the real one is present")
+parser.add_argument("--genes_per_mb", type=float, default=10)
+parser.add_argument("--dense_genes_per_mb", type=float, default=80)
+parser.add_argument("--feature_density", nargs="+", type=int, default=[1000],
+                    help="points per Mb in each synthetic bedgraph track")
+parser.add_argument("--links", type=int, default=500, help="number of links in the synthetic bedpe track")
+parser.add_argument("--rects_per_mb", type=int, default=20)
+parser.add_argument("--labels_per_100kb", type=float, default=10)
+parser.add_argument("--segs_per_contig", type=int, default=3)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--python", help="python executable used to run the visualizations", default=sys.executable)
+
+args = parser.parse_args()
+if args.ref == "GRCh38":
+    args.ref = "hg38"
+
+rng = random.Random(args.seed)
+cleanup = not args.work_dir and not args.keep_files
+work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="cycleviz_bench_")
+if not os.path.exists(work_dir):
+    os.makedirs(work_dir)
+
+src_dir = os.path.abspath(args.src_dir)
+data_dir = os.path.join(work_dir, "data")
+if os.path.exists(data_dir):
+    shutil.rmtree(data_dir)
+
+cases, amplicons = make_cases(args, data_dir, rng)
+sandbox_dir = os.path.join(work_dir, "src")
+n_genes = build_sandbox(src_dir, sandbox_dir, args.ref, amplicons, args, rng)
+
+results = []
+for case in cases:
+    print("running " + case["name"])
+    case_out = os.path.join(work_dir, "out")
+    if not os.path.exists(case_out):
+        os.makedirs(case_out)
+
+    results.append(run_case(case, sandbox_dir, case_out, args.python))
+
+git_rev = None
+try:
+    git_rev = subprocess.check_output(["git", "-C", src_dir, "rev-parse", "HEAD"],
+                                      stderr=subprocess.STDOUT).decode().strip()
+except (subprocess.CalledProcessError, OSError):
+    pass
+
+report = {
+    "src_dir": src_dir,
+    "git_revision": git_rev,
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "seed": args.seed,
+    "synthetic_refgene_genes": n_genes,
+    "parameters": dict((k, v) for k, v in vars(args).items() if k not in ["output", "work_dir", "python"]),
+    "results": results,
+}
+
+with open(args.output, 'w') as outfile:
+    json.dump(report, outfile, indent=2, sort_keys=True)
+
+print_summary(results)
+print("wrote " + args.output)
+if cleanup:
+    shutil.rmtree(work_dir)
+
+if any(r["returncode"] != 0 for r in results):
+    sys.exit(1)
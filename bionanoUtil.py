@@ -5,7 +5,10 @@ jluebeck@ucsd.edu
 """
 
 from collections import defaultdict
+import os
+
 from intervaltree import IntervalTree
+import numpy as np
 
 # compute the median
 
@@ -21,6 +24,12 @@ def median(L):
     return None
 
 
+# move a finished file over its destination. os.replace is python3 only, and os.rename also replaces an existing file
+# on POSIX.
+def replace_file(src, dst):
+    getattr(os, "replace", os.rename)(src, dst)
+
+
 # parse cmap into a dictionary, to maintain the 1-indexing used in this format.
 # specify keep_length to keep the length field of the cmap entry.
 def parse_cmap(cmapf, keep_length=False):
@@ -65,20 +74,173 @@ def get_cmap_lens(cmapf):
     return cmap_lens
 
 
+# parse a cmap in one pass into 0-indexed label position arrays (as from vectorize_cmaps) and the map lengths (as from
+# get_cmap_lens). Columns are located from the #h header line.
+# specify keep_length to end each array with the length field of the cmap entry.
+def parse_cmap_vects(cmapf, keep_length=False):
+    sites, posns, cmap_lens = defaultdict(list), defaultdict(list), {}
+    keep_channels = ("1", "0") if keep_length else ("1",)
+    with open(cmapf) as infile:
+        for line in infile:
+            if line.startswith("#h"):
+                head = line.rstrip().rsplit()[1:]
+                id_col, len_col, site_col = head.index("CMapId"), head.index("ContigLength"), head.index("SiteID")
+                chan_col, pos_col = head.index("LabelChannel"), head.index("Position")
+
+            elif not line.startswith("#"):
+                fields = line.rsplit()
+                if not fields:
+                    continue
+
+                cmap_id = fields[id_col]
+                if cmap_id not in cmap_lens:
+                    cmap_lens[cmap_id] = float(fields[len_col])
+
+                if fields[chan_col] in keep_channels:
+                    sites[cmap_id].append(int(fields[site_col]))
+                    posns[cmap_id].append(float(fields[pos_col]))
+
+    cmap_vects = {}
+    for cmap_id in cmap_lens:
+        c_sites, c_posns = np.array(sites[cmap_id], dtype=int), np.array(posns[cmap_id], dtype=float)
+        cmap_vects[cmap_id] = c_posns[np.argsort(c_sites, kind='stable')]
+
+    return cmap_vects, cmap_lens
+
+
+# read molecules from an open bnx file (binary mode), from the current position until the end of the file, or until
+# the next molecule if single is set. Yields (mol_id, length, labels), the labels as an array of positions.
+# The length is the last value of the label line. Specify keep_length to end the labels with the length value.
+def _read_bnx_molecules(infile, keep_length=False, single=False):
+    mol_id = None
+    for line in infile:
+        if line.startswith(b'#'):
+            continue
+
+        if line.startswith(b'0'):
+            if single and mol_id is not None:
+                return
+
+            mol_id = line.split(b"\t", 2)[1].decode()
+
+        elif line.startswith(b'1') and mol_id is not None:
+            fields = line.rstrip().split(b"\t")
+            labels = np.array(fields[1:] if keep_length else fields[1:-1], dtype=float)
+            yield mol_id, float(fields[-1]), labels
+
+
+# Stream the molecules of a bnx file without loading the whole file, yielding (mol_id, length, labels). Molecules
+# shorter than min_length, with fewer than min_labels labels, or (if mol_ids is given) not in mol_ids are skipped.
+def iter_bnx(bnxF, min_length=0, min_labels=0, mol_ids=None, keep_length=False):
+    if mol_ids is not None:
+        mol_ids = set(mol_ids)
+
+    n_len_labels = 1 if keep_length else 0
+    with open(bnxF, 'rb') as infile:
+        for mol_id, length, labels in _read_bnx_molecules(infile, keep_length):
+            if length < min_length or len(labels) - n_len_labels < min_labels:
+                continue
+
+            if mol_ids is not None and mol_id not in mol_ids:
+                continue
+
+            yield mol_id, length, labels
+
+
+# scan a bnx file for the byte offset of each molecule, yielding (mol_id, offset)
+def scan_bnx_offsets(bnxF):
+    with open(bnxF, 'rb') as infile:
+        offset = 0
+        for line in infile:
+            if line.startswith(b'0'):
+                yield line.split(b"\t", 2)[1].decode(), offset
+
+            offset += len(line)
+
+
+# write an index of the byte offset of each molecule in a bnx file, as lines of mol_id and offset, after a header line
+# with the size of the bnx file. The default index file name is the bnx file name with .idx appended. The index is
+# written to a temporary file that is renamed into place once complete, so an interrupted run leaves no partial index.
+def write_bnx_index(bnxF, indexF=None):
+    if indexF is None:
+        indexF = bnxF + ".idx"
+
+    tmpF = indexF + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmpF, 'w') as outfile:
+            outfile.write("#bnx_size\t" + str(os.path.getsize(bnxF)) + "\n")
+            for mol_id, offset in scan_bnx_offsets(bnxF):
+                outfile.write(mol_id + "\t" + str(offset) + "\n")
+
+    except BaseException:
+        if os.path.exists(tmpF):
+            os.remove(tmpF)
+
+        raise
+
+    replace_file(tmpF, indexF)
+    return indexF
+
+
+# read an offset index (written by write_bnx_index, or with a container from xmap_to_SA_aln) into a dict of
+# id -> byte offset
+def read_bnx_index(indexF):
+    index = {}
+    with open(indexF) as infile:
+        for line in infile:
+            if line.startswith("#"):
+                continue
+
+            fields = line.rstrip().rsplit("\t")
+            if len(fields) == 2:
+                index[fields[0]] = int(fields[1])
+
+    return index
+
+
+# check that a bnx index exists and was written for the current bnx file: the bnx is not newer than the index, and
+# has the size recorded in the index header
+def bnx_index_is_current(bnxF, indexF):
+    if not os.path.exists(indexF) or os.path.getmtime(bnxF) > os.path.getmtime(indexF):
+        return False
+
+    with open(indexF) as infile:
+        fields = infile.readline().rstrip().rsplit("\t")
+
+    return fields[0] == "#bnx_size" and len(fields) == 2 and fields[1] == str(os.path.getsize(bnxF))
+
+
+# Fetch molecules by id with random access through an offset index, yielding (mol_id, length, labels) in the order of
+# mol_ids. Ids missing from the index are skipped. The index is built if it does not exist, and rebuilt if the bnx
+# has changed since it was written. If the index cannot be written (e.g. the bnx is in a read-only directory), the
+# offsets are kept in memory instead.
+def fetch_bnx_molecules(bnxF, mol_ids, index=None, keep_length=False):
+    if index is None:
+        indexF = bnxF + ".idx"
+        try:
+            if not bnx_index_is_current(bnxF, indexF):
+                write_bnx_index(bnxF, indexF)
+
+            index = read_bnx_index(indexF)
+
+        except (IOError, OSError):
+            index = dict(scan_bnx_offsets(bnxF))
+
+    with open(bnxF, 'rb') as infile:
+        for mol_id in mol_ids:
+            if mol_id not in index:
+                continue
+
+            infile.seek(index[mol_id])
+            for mol in _read_bnx_molecules(infile, keep_length, single=True):
+                yield mol
+
+
 # parse a bnx file into a vector. Can specify keep_length to keep the length value.
 def parse_bnx(bnxF, keep_length=False):
     moleculeD = {}
-    with open(bnxF) as infile:
-        for line in infile:
-            if not line.startswith('#'):
-                fields = line.rstrip().rsplit("\t")
-                if line.startswith('0'):
-                    currKey = fields[1]
-                elif line.startswith('1'):
-                    if keep_length:
-                        moleculeD[currKey] = [float(x) for x in fields[1:]]
-                    else:
-                        moleculeD[currKey] = [float(x) for x in fields[1:-1]]
+    for mol_id, length, labels in iter_bnx(bnxF, keep_length=keep_length):
+        moleculeD[mol_id] = labels.tolist()
 
     return moleculeD
 
@@ -86,15 +248,9 @@ def parse_bnx(bnxF, keep_length=False):
 # parse a bnx file and store map of mol_id -> mol_length
 def get_mol_lens(bnxF):
     moleculeLenD = {}
-    with open(bnxF) as infile:
-        for line in infile:
-            if not line.startswith('#'):
-                fields = line.rstrip().rsplit("\t")
-                if line.startswith('0'):
-                    currKey = fields[1]
-                elif line.startswith('1'):
-                    # gets the length of the molecule, note the position of the last label
-                    moleculeLenD[currKey] = float(fields[-1])
+    # gets the length of the molecule, note the position of the last label
+    for mol_id, length, labels in iter_bnx(bnxF):
+        moleculeLenD[mol_id] = length
 
     return moleculeLenD
 
@@ -136,8 +292,134 @@ def parse_xmap(xmapf):
     return xmapPair
 
 
+# Stream the alignments of an xmap, without keeping the file in memory. Yields a dict per alignment with the fields
+# of parse_xmap (except Alignment), positions, lengths and confidence as floats. Alignments to reference maps not in
+# ref_ids (if given) or with confidence below min_confidence are skipped.
+def iter_xmap(xmapf, ref_ids=None, min_confidence=0):
+    str_fields = ["XmapEntryID", "QryContigID", "RefContigID", "Orientation"]
+    float_fields = ["Confidence", "QryLen", "RefLen", "QryStartPos", "QryEndPos", "RefStartPos", "RefEndPos"]
+    with open(xmapf) as infile:
+        for line in infile:
+            if line.startswith("#h"):
+                head = line.rstrip().rsplit()[1:]
+                str_cols = [(x, head.index(x)) for x in str_fields]
+                float_cols = [(x, head.index(x)) for x in float_fields]
+                ref_col, conf_col = head.index("RefContigID"), head.index("Confidence")
+
+            elif not line.startswith("#"):
+                fields = line.rsplit()
+                if not fields:
+                    continue
+
+                if ref_ids is not None and fields[ref_col] not in ref_ids:
+                    continue
+
+                if float(fields[conf_col]) < min_confidence:
+                    continue
+
+                fD = dict((x, fields[i]) for x, i in str_cols)
+                fD.update((x, float(fields[i])) for x, i in float_cols)
+                yield fD
+
+
+# decode an xmap alignment string like (1,2)(3,4) into a list of (ref label, qry label) tuples
+def decode_xmap_alignment(alnstring):
+    if not alnstring:
+        return []
+
+    return [(int(x[0]), int(x[1])) for x in (y.rsplit(",") for y in alnstring[1:-1].rsplit(")("))]
+
+
+# An entry of an XmapTable. Entries are read-only snapshots of a table row, so changing one raises a TypeError
+# instead of being silently lost.
+class XmapEntry(dict):
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("xmap table entries are read-only")
+
+    __setitem__ = __delitem__ = update = setdefault = pop = popitem = clear = _read_only
+
+    # copy and pickle through the constructor, as the default for dicts sets the items one by one
+    def __reduce__(self):
+        return XmapEntry, (dict(self),)
+
+
+# Columnar storage of the entries of an xmap. Position, length and confidence columns are float arrays, the others are
+# lists. Alignment strings are decoded only when the Alignment field of an entry is first read by xmap id.
+# The table can be read like the dict of entry dicts that parse_generic_xmap used to return (xmap_id -> field dict),
+# but the entries are read-only XmapEntry snapshots built on access. values() and items() are generators that decode
+# each alignment without caching it, for a single pass over the table.
+class XmapTable(object):
+    str_fields = ["XmapEntryID", "QryContigID", "RefContigID", "Orientation", "HitEnum"]
+    float_fields = ["Confidence", "QryLen", "RefLen", "QryStartPos", "QryEndPos", "RefStartPos", "RefEndPos"]
+
+    def __init__(self, columns, alignments):
+        self.columns = columns
+        self.alignments = alignments
+        self.decoded_alignments = {}
+        self.swapped = False
+        # a repeated XmapEntryID refers to its last entry
+        self.index = {}
+        for ind, xmap_id in enumerate(columns["XmapEntryID"]):
+            self.index[xmap_id] = ind
+
+    def alignment(self, ind, cache=True):
+        if ind in self.decoded_alignments:
+            return self.decoded_alignments[ind]
+
+        aln_pairs = decode_xmap_alignment(self.alignments[ind])
+        if self.swapped:
+            aln_pairs = [(y, x) for x, y in aln_pairs]
+
+        if cache:
+            self.decoded_alignments[ind] = aln_pairs
+
+        return aln_pairs
+
+    # swap the reference and query of every entry
+    def swap_ref_qry(self):
+        c = self.columns
+        c["QryStartPos"], c["RefStartPos"] = c["RefStartPos"], c["QryStartPos"]
+        c["QryEndPos"], c["RefEndPos"] = c["RefEndPos"], c["QryEndPos"]
+        c["QryContigID"], c["RefContigID"] = c["RefContigID"], c["QryContigID"]
+        self.swapped = not self.swapped
+        self.decoded_alignments = {}
+
+    def entry(self, ind, cache=True):
+        fields = [(x, self.columns[x][ind]) for x in self.str_fields]
+        fields.extend((x, self.columns[x][ind].item()) for x in self.float_fields)
+        fields.append(("Alignment", self.alignment(ind, cache)))
+        return XmapEntry(fields)
+
+    def __getitem__(self, xmap_id):
+        return self.entry(self.index[xmap_id])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, xmap_id):
+        return xmap_id in self.index
+
+    def keys(self):
+        return list(self.index)
+
+    def values(self):
+        for ind in self.index.values():
+            yield self.entry(ind, False)
+
+    def items(self):
+        for xmap_id, ind in self.index.items():
+            yield xmap_id, self.entry(ind, False)
+
+
 # Swap reference and query for a given xmap
 def swap_xmap_RQ(xmapD):
+    if isinstance(xmapD, XmapTable):
+        xmapD.swap_ref_qry()
+        return
+
     for xmap_id, fD in xmapD.items():
         # fD["QryLen"],fD["RefLen"] = fD["RefLen"],fD["QryLen"] #do this in the parsing itself
         fD["QryStartPos"], fD["RefStartPos"] = fD["RefStartPos"], fD["QryStartPos"]
@@ -148,51 +430,54 @@ def swap_xmap_RQ(xmapD):
 
 
 # can handle poorly formatted .xmap files, such as those from OMBlast. Requires more inputs than parse_xmap.
+# Returns an XmapTable.
 def parse_generic_xmap(xmapf, qryLenD, refLenD, swap_Ref_Qry=False):
-    detailFields = ["XmapEntryID", "QryContigID", "RefContigID", "Orientation", "Confidence", "QryLen", "RefLen",
-                    "QryStartPos", "QryEndPos", "RefStartPos", "RefEndPos", "HitEnum"]
-    xmapPair = {}
+    detail_lower = dict((x.lower(), x) for x in XmapTable.str_fields + XmapTable.float_fields + ["Alignment"])
+    rows = []
     with open(xmapf) as infile:
         for line in infile:
             if line.startswith("#h"):
-                head = line.rstrip().rsplit()[1:]
-
-            elif not line.startswith("#"):
-                fields = line.rstrip().rsplit()
-                fD = dict(zip(head, fields))
-
                 # handle mis-capitalizations
-                for i in fD.keys():
-                    for dname in detailFields:
-                        if i.lower() == dname.lower():
-                            fD[dname] = fD[i]
-
-                fD["Confidence"] = float(fD["Confidence"])
-
-                # refactor to eliminate,reduce, or simplify need for extra checks
-                try:
-                    fD["QryLen"], fD["RefLen"] = float(fD["QryLen"]), float(fD["RefLen"])
-                except KeyError:
-                    if not swap_Ref_Qry:
-                        fD["QryLen"], fD["RefLen"] = qryLenD[fD["QryContigID"]], refLenD[fD["RefContigID"]]
-                    else:
-                        fD["QryLen"], fD["RefLen"] = qryLenD[fD["RefContigID"]], refLenD[fD["QryContigID"]]
-
-                fD["QryStartPos"], fD["QryEndPos"] = sorted([float(fD["QryStartPos"]), float(fD["QryEndPos"])])
-                if fD["Orientation"] == "+":
-                    fD["RefStartPos"], fD["RefEndPos"] = sorted([float(fD["RefStartPos"]), float(fD["RefEndPos"])])
-                else:
-                    fD["RefEndPos"], fD["RefStartPos"] = sorted([float(fD["RefStartPos"]), float(fD["RefEndPos"])])
-
-                xmapPair[fD["XmapEntryID"]] = {x: fD[x] for x in detailFields}
+                head = [detail_lower.get(x.lower(), x) for x in line.rstrip().rsplit()[1:]]
 
-                try:
-                    alnstring = ")" + fD["Alignment"] + "("
-                    aln_pairs = [(int(x.rsplit(",")[0]), int(x.rsplit(",")[1])) for x in alnstring.rsplit(")(")[1:-1]]
-                    xmapPair[fD["XmapEntryID"]]["Alignment"] = aln_pairs
-                except KeyError:
-                    # xmap does not have Alignment field
-                    xmapPair[fD["XmapEntryID"]]["Alignment"] = []
+            elif not line.startswith("#"):
+                fields = line.rsplit()
+                if fields:
+                    rows.append(fields)
+
+    cols = dict((x, ind) for ind, x in enumerate(head))
+    columns = {}
+    for x in XmapTable.str_fields:
+        columns[x] = [f[cols[x]] for f in rows] if x in cols else [None] * len(rows)
+
+    for x in ["Confidence", "QryStartPos", "QryEndPos", "RefStartPos", "RefEndPos"]:
+        columns[x] = np.array([f[cols[x]] for f in rows], dtype=float)
+
+    # refactor to eliminate,reduce, or simplify need for extra checks
+    if "QryLen" in cols and "RefLen" in cols:
+        columns["QryLen"] = np.array([f[cols["QryLen"]] for f in rows], dtype=float)
+        columns["RefLen"] = np.array([f[cols["RefLen"]] for f in rows], dtype=float)
+
+    elif not swap_Ref_Qry:
+        columns["QryLen"] = np.array([qryLenD[x] for x in columns["QryContigID"]], dtype=float)
+        columns["RefLen"] = np.array([refLenD[x] for x in columns["RefContigID"]], dtype=float)
+
+    else:
+        columns["QryLen"] = np.array([qryLenD[x] for x in columns["RefContigID"]], dtype=float)
+        columns["RefLen"] = np.array([refLenD[x] for x in columns["QryContigID"]], dtype=float)
+
+    q_lo = np.minimum(columns["QryStartPos"], columns["QryEndPos"])
+    q_hi = np.maximum(columns["QryStartPos"], columns["QryEndPos"])
+    columns["QryStartPos"], columns["QryEndPos"] = q_lo, q_hi
+    r_lo = np.minimum(columns["RefStartPos"], columns["RefEndPos"])
+    r_hi = np.maximum(columns["RefStartPos"], columns["RefEndPos"])
+    is_fwd = np.array([x == "+" for x in columns["Orientation"]], dtype=bool)
+    columns["RefStartPos"], columns["RefEndPos"] = np.where(is_fwd, r_lo, r_hi), np.where(is_fwd, r_hi, r_lo)
+
+    # xmap may not have Alignment field
+    aln_col = cols.get("Alignment", len(head))
+    alignments = [f[aln_col] if len(f) > aln_col else "" for f in rows]
+    xmapPair = XmapTable(columns, alignments)
 
     # handle the case where the user wants to swap the reference and qry (e.g. segments aligned to contigs)
     if swap_Ref_Qry: swap_xmap_RQ(xmapPair)
@@ -250,17 +535,30 @@ def add_full_reverse_cmaps(cmaps, key_dict):
         cmaps[new_ID][tot_labs + 1] = cmap_len
 
 
-# binary search find the label corresponding to some position in a cmap dict.
+# sorted array of the label positions of a cmap, from a cmap dict (label -> position) or a vector of positions
+def cmap_label_array(item_cmap):
+    if isinstance(item_cmap, dict):
+        return np.array([item_cmap[k] for k in range(1, max(item_cmap.keys()) + 1)], dtype=float)
+
+    return np.asarray(item_cmap, dtype=float)
+
+
+# binary search find the label corresponding to some position in a cmap dict or label array.
 # return the RIGHT index of bisect (cmap is 1 based)
 def pos_to_label(x, item_cmap):
-    import bisect
-    arr = [item_cmap[k] for k in range(1, max(item_cmap.keys()) + 1)]
-    return bisect.bisect(arr, x)
+    if isinstance(item_cmap, dict):
+        item_cmap = cmap_label_array(item_cmap)
 
+    return int(np.searchsorted(item_cmap, x, side='right'))
 
-# convert XMAP format to SegAligner alignment format. OMPathFinder requires alignments in SA format.
-def xmap_to_SA_aln(xmapD, outdir, fname_prefix, ref_cmaps, contig_cmaps):
+
+# convert the entries of an XMAP to SegAligner alignment format, yielding the file name of each alignment (in outdir)
+# and its text
+def _sa_alignments(xmapD, outdir, fname_prefix, ref_cmaps, contig_cmaps):
     seg_contig_count = {}
+    # label position arrays are built once per map, and only for maps needing a dummy alignment
+    ref_label_arrays = {}
+    contig_label_arrays = {}
     for xmap_id, fD in xmapD.items():
         contig_id = fD["QryContigID"]
         seg_id = fD["RefContigID"]
@@ -279,36 +577,82 @@ def xmap_to_SA_aln(xmapD, outdir, fname_prefix, ref_cmaps, contig_cmaps):
 
         outname += (str(seg_contig_count[cso_key]) + "_aln.txt")
 
-        with open(outname, 'w') as outfile:
-            outfile.write("#seg_seq\ttotal_score\tcircular\n")
-            outfile.write("#" + seg_id + orientation + "\t" + str(score) + "\tFalse\n")
-            outfile.write(
-                "#contig_id\tseg_id\tcontig_label\tseg_label\tcontig_dir\tseg_dir\tseg_aln_number\tscore\tscore_delta\n")
+        # handle orientation
+        if fD["Alignment"]:
+            alist = fD["Alignment"]
+
+        # if no alignment string given (incomplete XMAP), make a dummy alignment
+        else:
+            if seg_id not in ref_label_arrays:
+                ref_label_arrays[seg_id] = cmap_label_array(ref_cmaps[seg_id])
+
+            if contig_id not in contig_label_arrays:
+                contig_label_arrays[contig_id] = cmap_label_array(contig_cmaps[contig_id])
+
+            ref_labels = np.searchsorted(ref_label_arrays[seg_id], [fD["RefStartPos"], fD["RefEndPos"]], side='right')
+            contig_labels = np.searchsorted(contig_label_arrays[contig_id], [fD["QryStartPos"], fD["QryEndPos"]],
+                                            side='right')
+            alist = list(zip(ref_labels.tolist(), contig_labels.tolist()))
 
-            # handle orientation
-            if fD["Alignment"]:
-                alist = fD["Alignment"]
+        if orientation == "-":
+            alist = alist[::-1]
 
-            # if no alignment string given (incomplete XMAP), make a dummy alignment
-            else:
-                ref_start_label = pos_to_label(fD["RefStartPos"], ref_cmaps[seg_id])
-                contig_start_label = pos_to_label(fD["QryStartPos"], contig_cmaps[contig_id])
-                ref_end_label = pos_to_label(fD["RefEndPos"], ref_cmaps[seg_id])
-                contig_end_label = pos_to_label(fD["QryEndPos"], contig_cmaps[contig_id])
-                alist = [(ref_start_label, contig_start_label), (ref_end_label, contig_end_label)]
+        lines = ["#seg_seq\ttotal_score\tcircular\n", "#" + seg_id + orientation + "\t" + str(score) + "\tFalse\n",
+                 "#contig_id\tseg_id\tcontig_label\tseg_label\tcontig_dir\tseg_dir\tseg_aln_number\tscore\tscore_delta\n"]
+        # write converted alignment
+        for i in alist[:-1]:
+            outlist = [contig_id, seg_id, str(i[1]), str(i[0]), "+", orientation, "0", "0", "0"]
+            lines.append("\t".join(outlist) + "\n")
 
-            if orientation == "-":
-                alist = alist[::-1]
+        # write the last one and include total score
+        i = alist[-1]
+        outlist = [contig_id, seg_id, str(i[1]), str(i[0]), "+", orientation, "0", str(score), "0"]
+        lines.append("\t".join(outlist) + "\n")
+        yield outname, "".join(lines)
 
-            # write converted alignment
-            for i in alist[:-1]:
-                outlist = [contig_id, seg_id, str(i[1]), str(i[0]), "+", orientation, "0", "0", "0"]
-                outfile.write("\t".join(outlist) + "\n")
 
-            # write the last one and include total score
-            i = alist[-1]
-            outlist = [contig_id, seg_id, str(i[1]), str(i[0]), "+", orientation, "0", str(score), "0"]
-            outfile.write("\t".join(outlist) + "\n")
+# convert XMAP format to SegAligner alignment format. OMPathFinder requires alignments in SA format.
+# By default each alignment is written to its own file in outdir. If container_name is given, all the alignments are
+# instead written to that one file in outdir, each under a ">name" line giving the file name it would otherwise have,
+# along with an index of the byte offset of each alignment (the container name with .idx appended). Read the container
+# with parse_seg_alignment_container. The container and index are written to temporary files that are renamed into
+# place once complete, so a failed run leaves no partial container. Returns the list of files written.
+def xmap_to_SA_aln(xmapD, outdir, fname_prefix, ref_cmaps, contig_cmaps, container_name=None):
+    alignments = _sa_alignments(xmapD, outdir, fname_prefix, ref_cmaps, contig_cmaps)
+    if container_name is None:
+        outfiles = []
+        for outname, text in alignments:
+            with open(outname, 'w') as outfile:
+                outfile.write(text)
+
+            outfiles.append(outname)
+
+        return outfiles
+
+    container_path = outdir + "/" + container_name
+    outfiles = [container_path, container_path + ".idx"]
+    tmp_files = [x + ".tmp" for x in outfiles]
+    try:
+        # the container is binary so the offsets are byte offsets on every platform
+        with open(tmp_files[0], 'wb') as container, open(tmp_files[1], 'w') as index_file:
+            offset = 0
+            for outname, text in alignments:
+                block = (">" + os.path.basename(outname) + "\n" + text).encode()
+                index_file.write(os.path.basename(outname) + "\t" + str(offset) + "\n")
+                container.write(block)
+                offset += len(block)
+
+    except BaseException:
+        for x in tmp_files:
+            if os.path.exists(x):
+                os.remove(x)
+
+        raise
+
+    for tmp_f, f in zip(tmp_files, outfiles):
+        replace_file(tmp_f, f)
+
+    return outfiles
 
 
 # takes vector of cmap vector of positions, including the length of the map
@@ -329,27 +673,76 @@ def write_cmap_from_vector(cmap_vector, fname):
                      "0.0"]) + "\n")
 
 
+# parses the lines of one SegAligner alignment
+def _parse_seg_alignment_lines(lines, tip_aln):
+    alignment = []
+    lines = iter(lines)
+    meta_head = next(lines).rstrip()[1:].rsplit()
+    meta_vals = next(lines).rstrip()[1:].rsplit()
+    meta_dict = dict(zip(meta_head, meta_vals))
+    aln_head = next(lines).rstrip()[1:].rsplit()
+    for line in lines:
+        fields = line.rstrip().rsplit()
+        alignment.append(dict(zip(aln_head, fields)))
+
+    seg_id = meta_dict["seg_seq"][:-1]
+    strand = meta_dict["seg_seq"][-1]
+    tot_score = float(meta_dict["total_score"])
+    seg_start = int(alignment[0]["seg_label"])
+    seg_end = int(alignment[-1]["seg_label"])
+    seg_ends = (seg_start, seg_end)
+    contig_start = int(alignment[0]["contig_label"])
+    contig_end = int(alignment[-1]["contig_label"])
+    contig_ends = (contig_start, contig_end)
+
+    return alignment[0]["contig_id"], [seg_id, seg_ends, contig_ends, strand, tot_score, alignment, tip_aln]
+
+
 # parses the output from SegAligner
 def parse_seg_alignment_file(alignfile):
-    alignment = []
     tip_aln = True if "_tip_" in alignfile else False
     with open(alignfile) as infile:
-        meta_head = next(infile).rstrip()[1:].rsplit()
-        meta_vals = next(infile).rstrip()[1:].rsplit()
-        meta_dict = dict(zip(meta_head, meta_vals))
-        aln_head = next(infile).rstrip()[1:].rsplit()
-        for line in infile:
-            fields = line.rstrip().rsplit()
-            alignment.append(dict(zip(aln_head, fields)))
-
-        seg_id = meta_dict["seg_seq"][:-1]
-        strand = meta_dict["seg_seq"][-1]
-        tot_score = float(meta_dict["total_score"])
-        seg_start = int(alignment[0]["seg_label"])
-        seg_end = int(alignment[-1]["seg_label"])
-        seg_ends = (seg_start, seg_end)
-        contig_start = int(alignment[0]["contig_label"])
-        contig_end = int(alignment[-1]["contig_label"])
-        contig_ends = (contig_start, contig_end)
-
-    return alignment[0]["contig_id"], [seg_id, seg_ends, contig_ends, strand, tot_score, alignment, tip_aln]
\ No newline at end of file
+        return _parse_seg_alignment_lines(infile, tip_aln)
+
+
+# parses a container of alignments written by xmap_to_SA_aln. Returns a dict of alignment name -> the value
+# parse_seg_alignment_file gives for the corresponding single alignment file. If names is given, only those alignments
+# are read, using the offset index of the container.
+def parse_seg_alignment_container(containerF, names=None):
+    alignments = {}
+    if names is None:
+        with open(containerF) as infile:
+            name, lines = None, []
+            for line in infile:
+                if line.startswith(">"):
+                    if name is not None:
+                        alignments[name] = _parse_seg_alignment_lines(lines, "_tip_" in name)
+
+                    name, lines = line.rstrip()[1:], []
+
+                else:
+                    lines.append(line)
+
+            if name is not None:
+                alignments[name] = _parse_seg_alignment_lines(lines, "_tip_" in name)
+
+        return alignments
+
+    index = read_bnx_index(containerF + ".idx")
+    with open(containerF, 'rb') as infile:
+        for name in names:
+            if name not in index:
+                continue
+
+            infile.seek(index[name])
+            next(infile)
+            lines = []
+            for line in infile:
+                if line.startswith(b'>'):
+                    break
+
+                lines.append(line.decode())
+
+            alignments[name] = _parse_seg_alignment_lines(lines, "_tip_" in name)
+
+    return alignments
\ No newline at end of file
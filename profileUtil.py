@@ -0,0 +1,122 @@
+"""
+Per-stage timing and memory instrumentation for CycleViz and LinearViz (enabled with --profile).
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on MacOS and in kilobytes on Linux
+    return maxrss / 1048576. if sys.platform == "darwin" else maxrss / 1024.
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+# number of artists currently drawn in a figure. A collection counts as one artist.
+def count_artists(fig):
+    if fig is None:
+        return 0
+
+    n = 0
+    for ax in fig.get_axes():
+        n += len(ax.patches) + len(ax.lines) + len(ax.collections) + len(ax.texts) + len(ax.images)
+
+    return n
+
+
+class StageProfiler(object):
+    def __init__(self, enabled=False, fig=None):
+        self.enabled = enabled
+        self.fig = fig
+        self.records = []
+        self.start_time = timer()
+        self.sizes = {}
+
+    # time a stage of the pipeline. Input sizes can be given as keywords, or added to the yielded dict within the block.
+    @contextmanager
+    def stage(self, name, **sizes):
+        if not self.enabled:
+            yield sizes
+            return
+
+        rec = {"name": name, "sizes": sizes}
+        n_artists = count_artists(self.fig)
+        t_start, c_start = timer(), cpu_time()
+        try:
+            yield sizes
+
+        finally:
+            rec["start"] = t_start - self.start_time
+            rec["wall"] = timer() - t_start
+            rec["cpu"] = cpu_time() - c_start
+            rec["peak_rss_mb"] = peak_rss_mb()
+            rec["artists"] = count_artists(self.fig) - n_artists
+            self.records.append(rec)
+
+    # record global input sizes (segments, genes, points, ...)
+    def set_size(self, key, value):
+        self.sizes[key] = value
+
+    def summary_table(self):
+        lines = ["{:<32} {:>9} {:>9} {:>10} {:>8}  {}".format("stage", "wall(s)", "cpu(s)", "rss(MB)", "artists",
+                                                                "sizes")]
+        for rec in self.records:
+            size_str = " ".join("{}={}".format(k, v) for k, v in sorted(rec["sizes"].items()))
+            lines.append("{:<32} {:>9.3f} {:>9.3f} {:>10.1f} {:>8}  {}".format(rec["name"], rec["wall"], rec["cpu"],
+                                                                              rec["peak_rss_mb"], rec["artists"],
+                                                                              size_str))
+
+        total = timer() - self.start_time
+        lines.append("{:<32} {:>9.3f} {:>9.3f} {:>10.1f}".format("total", total, cpu_time(), peak_rss_mb()))
+        if self.sizes:
+            lines.append("inputs: " + " ".join("{}={}".format(k, v) for k, v in sorted(self.sizes.items())))
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"stages": self.records, "inputs": self.sizes, "total_wall": timer() - self.start_time,
+                "total_cpu": cpu_time(), "peak_rss_mb": peak_rss_mb()}
+
+    def write_json(self, fname):
+        with open(fname, 'w') as outfile:
+            json.dump(self.to_dict(), outfile, indent=2)
+
+    # Chrome trace event format, can be opened in chrome://tracing or Perfetto
+    def write_chrome_trace(self, fname):
+        events = []
+        pid = os.getpid()
+        for rec in self.records:
+            args = dict(rec["sizes"])
+            args.update({"cpu_s": rec["cpu"], "peak_rss_mb": rec["peak_rss_mb"], "artists": rec["artists"]})
+            events.append({"name": rec["name"], "ph": "X", "ts": rec["start"] * 1e6, "dur": rec["wall"] * 1e6,
+                           "pid": pid, "tid": 0, "args": args})
+
+        with open(fname, 'w') as outfile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.sizes}, outfile)
+
+    def report(self, json_file=None, trace_file=None):
+        if not self.enabled:
+            return
+
+        print(self.summary_table())
+        if json_file:
+            self.write_json(json_file)
+
+        if trace_file:
+            self.write_chrome_trace(trace_file)